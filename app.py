@@ -1,22 +1,47 @@
 from flask import Flask, render_template
 from config import Config
 from extensions import db, login_manager, migrate
+from db_routing import replica_router
+from storage import blob_store, blob_reclaimer
+from preview_cache import conversion_cache
+from converter_pool import converter_pool
+from metrics import metrics
+from response_cache import listing_cache
+from versioning import chunker
 
-def create_app():
+def create_app(config_class=Config):
     app = Flask(__name__, static_folder='static')
-    app.config.from_object(Config)
+    app.config.from_object(config_class)
 
     db.init_app(app)
     migrate.init_app(app, db)  
+    replica_router.init_app(app)
     login_manager.init_app(app)
+    blob_store.init_app(app)
+    blob_reclaimer.init_app(app)
+    conversion_cache.init_app(app)
+    converter_pool.init_app(app)
+    metrics.init_app(app)
+    listing_cache.init_app(app)
+    chunker.init_app(app)
+    conversion_cache.version_provider = converter_pool.version
+    conversion_cache.resolve_version()
     login_manager.login_view = 'auth.login'
 
     from models import User
+    import tree
+    import schema
+    import search_index
+    import usage
+    import archives
+    from thumbnails import thumbnail_generator
     from auth import auth_bp
     from file_management import file_bp
+    from chunked_upload import chunked_upload_bp
 
     app.register_blueprint(auth_bp)
     app.register_blueprint(file_bp, url_prefix='/file_management')
+    app.register_blueprint(chunked_upload_bp, url_prefix='/file_management')
 
     @login_manager.user_loader
     def load_user(user_id):
@@ -31,7 +56,21 @@ def create_app():
         return render_template('index.html')
 
     with app.app_context():
-        db.create_all()
+        # 副本只读，只在主库建表
+        db.create_all(bind_key=None)
+        schema.upgrade_schema()
+        tree.ensure_closure()
+    search_index.init_app(app)
+    archives.init_app(app)
+    thumbnail_generator.init_app(app)
+    metrics.add_snapshot('converter', converter_pool.snapshot,
+                         counters={'submitted', 'completed', 'failed', 'timeouts', 'rejected', 'restarts'})
+    metrics.add_snapshot('preview_cache', conversion_cache.snapshot,
+                         counters={'hits', 'misses', 'coalesced', 'evictions', 'failures'})
+    metrics.add_snapshot('thumbnails', thumbnail_generator.snapshot, counters={'generated', 'skipped', 'failed'})
+    metrics.add_snapshot('listing_cache', listing_cache.snapshot, counters={'hits', 'misses', 'not_modified'})
+    metrics.add_snapshot('chunking', chunker.snapshot,
+                         counters={'bytes', 'seconds', 'chunks', 'new_chunks', 'new_bytes'})
 
     return app
 
@@ -0,0 +1,113 @@
+import os
+import zlib
+import zipfile
+from storage import blob_store, CHUNK_SIZE
+
+try:
+    import rarfile
+    RAR_ERRORS = (rarfile.Error,)
+except ImportError:
+    rarfile = None
+    RAR_ERRORS = ()
+
+# 读取成员时可能出现的错误：加密成员、不支持的压缩算法、CRC 校验失败、数据截断
+READ_ERRORS = (zipfile.BadZipFile, RuntimeError, NotImplementedError, EOFError, zlib.error) + RAR_ERRORS
+
+ARCHIVE_EXTENSIONS = {'zip', 'rar'}
+# ZIP 规范要求 UTF-8 文件名设置该标志位，未设置时多为 Windows 中文环境打包的 GBK 文件名
+UTF8_FLAG = 0x800
+
+
+class ArchiveError(Exception):
+    pass
+
+
+def init_app(app):
+    unrar_path = app.config['UNRAR_PATH']
+    if rarfile is not None and unrar_path and os.path.exists(unrar_path):
+        rarfile.UNRAR_TOOL = unrar_path
+        rarfile.tool_setup(unrar=True, unar=False, bsdtar=False, force=True)
+
+
+def archive_type(file):
+    extension = file.filename.rsplit('.', 1)[-1].lower() if '.' in file.filename else ''
+    return extension if extension in ARCHIVE_EXTENSIONS else None
+
+
+def open_archive(file):
+    # 只读取中央目录（RAR 为各文件头），不解压任何成员
+    path = blob_store.path(file.content_hash)
+    kind = archive_type(file)
+    try:
+        if kind == 'zip':
+            return zipfile.ZipFile(path)
+        if kind == 'rar':
+            if rarfile is None:
+                raise ArchiveError('RAR support requires the rarfile package')
+            return rarfile.RarFile(path)
+    except zipfile.BadZipFile as e:
+        raise ArchiveError(f'Invalid zip archive: {e}')
+    except RAR_ERRORS as e:
+        raise ArchiveError(f'Invalid rar archive: {e}')
+    raise ArchiveError('Not an archive')
+
+
+def member_name(info):
+    name = info.filename
+    if isinstance(info, zipfile.ZipInfo) and not info.flag_bits & UTF8_FLAG:
+        try:
+            name = name.encode('cp437').decode('gbk')
+        except (UnicodeEncodeError, UnicodeDecodeError):
+            pass
+    return name.replace('\\', '/')
+
+
+def member_parts(name):
+    # 去掉空段、. 和 ..，避免成员路径跳出解压目录
+    return [part for part in name.split('/') if part not in ('', '.', '..')]
+
+
+def list_members(archive):
+    members = []
+    for info in archive.infolist():
+        members.append({
+            'name': member_name(info),
+            'size': info.file_size,
+            'compressed_size': info.compress_size,
+            'is_dir': info.is_dir(),
+            'modified': '%04d-%02d-%02dT%02d:%02d:%02d' % info.date_time if info.date_time else None,
+        })
+    return members
+
+
+def find_member(archive, name):
+    for info in archive.infolist():
+        if not info.is_dir() and member_name(info) == name:
+            return info
+    return None
+
+
+def stream_member(archive, info):
+    # 边解压边输出，发送完毕或客户端断开后关闭压缩包
+    try:
+        with archive.open(info) as member:
+            for chunk in iter(lambda: member.read(CHUNK_SIZE), b''):
+                yield chunk
+    finally:
+        archive.close()
+
+
+class MemberReader:
+    # 批量导入时成员很多，首次读取时才打开，读完立即关闭，同一时间只占用一个解压流
+    def __init__(self, archive, info):
+        self.archive = archive
+        self.info = info
+        self.stream = None
+
+    def read(self, size=-1):
+        if self.stream is None:
+            self.stream = self.archive.open(self.info)
+        data = self.stream.read(size)
+        if not data:
+            self.stream.close()
+        return data
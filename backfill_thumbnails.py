@@ -0,0 +1,47 @@
+import time
+import logging
+from app import create_app
+from extensions import db
+from models import File
+from thumbnails import thumbnail_generator, IMAGE_CATEGORY
+
+BATCH_SIZE = 500
+
+
+def backfill_thumbnails():
+    app = create_app()
+
+    logging.basicConfig(level=logging.INFO)
+    logger = logging.getLogger(__name__)
+
+    with app.app_context():
+        if thumbnail_generator.format is None:
+            logger.error("Pillow is not installed, nothing to do")
+            return
+        started = time.perf_counter()
+        processed = 0
+        generated = 0
+        last_hash = ''
+        while True:
+            # 按内容哈希去重，多个文件共享同一份缩略图
+            hashes = db.session.scalars(
+                db.select(File.content_hash).distinct().filter(
+                    File.category == IMAGE_CATEGORY, File.content_hash > last_hash
+                ).order_by(File.content_hash).limit(BATCH_SIZE)
+            ).all()
+            if not hashes:
+                break
+            for content_hash in hashes:
+                try:
+                    generated += thumbnail_generator.generate(content_hash)
+                except Exception as e:
+                    logger.error(f"Failed to generate thumbnails for {content_hash}: {e}")
+            processed += len(hashes)
+            last_hash = hashes[-1]
+            elapsed = time.perf_counter() - started
+            logger.info(f"Processed {processed} images, generated {generated} thumbnails "
+                        f"({processed / elapsed:.1f} images/s)")
+
+
+if __name__ == '__main__':
+    backfill_thumbnails()
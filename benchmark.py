@@ -0,0 +1,320 @@
+import io
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import logging
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+import tracemalloc
+from datetime import datetime
+from sqlalchemy import event
+from app import create_app
+from config import Config
+from extensions import db
+from models import File, User
+from auth import create_default_favorite_folder
+from bulk_ingest import BulkIngest
+import search_index
+
+SCALES = {
+    'small': {'depth': 2, 'fanout': 4, 'files': 10},
+    'medium': {'depth': 3, 'fanout': 6, 'files': 20},
+    'large': {'depth': 4, 'fanout': 8, 'files': 25},
+}
+WORDS = ['report', 'invoice', 'photo', 'budget', 'plan', 'notes', 'draft', 'summary', '报告', '合同', '会议', '预算']
+UNIQUE_BLOBS = 256
+
+
+class BenchmarkConfig(Config):
+    # 基准测试使用独立的临时数据库和内容目录，关闭后台线程以免干扰计时
+    BLOB_RECLAIMER_ENABLED = False
+    THUMBNAILS_ENABLED = False
+    SEARCH_INDEX_CONTENT = False
+    VERSION_CHUNKING_ENABLED = False
+    CONVERTER_WORKERS = 0
+    SLOW_REQUEST_SECONDS = None
+    # 列表缓存会让重复请求直接命中，测量的是数据库查询本身
+    RESPONSE_CACHE_SIZE = 0
+
+
+class QueryCounter:
+    def __init__(self, engine):
+        self.count = 0
+        event.listen(engine, 'after_cursor_execute', self._count)
+
+    def _count(self, *args):
+        self.count += 1
+
+
+def generate_account(user_id, depth, fanout, files_per_folder, blob_size, seed, prefix=''):
+    # 按固定随机种子生成目录树，内容从有限的内容池中取，同时覆盖去重路径
+    rng = random.Random(seed)
+    blobs = [rng.randbytes(blob_size) for _ in range(UNIQUE_BLOBS)]
+    ingest = BulkIngest(user_id)
+    counter = 0
+
+    def add_folder(dir_parts, level):
+        nonlocal counter
+        if dir_parts:
+            ingest.add_folder(dir_parts)
+        for index in range(files_per_folder):
+            counter += 1
+            name = f'{rng.choice(WORDS)}_{counter}.txt'
+            ingest.add_file(dir_parts, name, 'documents', io.BytesIO(blobs[counter % UNIQUE_BLOBS]))
+        if level < depth:
+            for index in range(fanout):
+                add_folder(dir_parts + [f'{prefix}d{level}_{index}'], level + 1)
+
+    add_folder([], 0)
+    stats = ingest.run()
+    db.session.commit()
+    return stats
+
+
+def top_folder_ids(user_id, prefix=''):
+    return [folder.id for folder in File.query.filter(
+        File.uploader_id == user_id, File.parent_id == None, File.is_folder == True,
+        File.is_favorite_folder == False, File.filename.like(f'{prefix}d0_%')
+    ).order_by(File.id)]
+
+
+def measure(client, counter, prepare, repeat):
+    # 第一次调用作为预热不计入结果，最后一次单独开启 tracemalloc 统计峰值内存
+    timings = []
+    queries = []
+    peak = None
+    response_bytes = 0
+    for iteration in range(repeat + 2):
+        call = prepare(iteration)
+        trace = iteration == repeat + 1
+        if trace:
+            tracemalloc.start()
+        counter.count = 0
+        started = time.perf_counter()
+        response = call(client)
+        response_bytes = sum(len(chunk) for chunk in response.iter_encoded()) if response.is_streamed else len(response.data)
+        elapsed = time.perf_counter() - started
+        if response.status_code >= 400:
+            raise RuntimeError(f'{response.status_code}: {response.get_data(as_text=True)[:200]}')
+        if trace:
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        elif iteration > 0:
+            timings.append(elapsed)
+            queries.append(counter.count)
+
+    timings.sort()
+    return {
+        'median_ms': round(statistics.median(timings) * 1000, 3),
+        'p95_ms': round(timings[min(len(timings) - 1, int(len(timings) * 0.95))] * 1000, 3),
+        'min_ms': round(timings[0] * 1000, 3),
+        'max_ms': round(timings[-1] * 1000, 3),
+        'queries': int(statistics.median(queries)),
+        'peak_memory_kb': round(peak / 1024, 1),
+        'response_bytes': response_bytes,
+    }
+
+
+def run_scale(name, params, repeat, blob_size, seed):
+    work_dir = tempfile.mkdtemp(prefix=f'clouddrive-bench-{name}-')
+    config_class = type('ScaleConfig', (BenchmarkConfig,), {
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(work_dir, 'bench.db'),
+        'BLOB_STORAGE_PATH': os.path.join(work_dir, 'blobs'),
+    })
+    try:
+        app = create_app(config_class)
+        with app.app_context():
+            counter = QueryCounter(db.engine)
+            user = User(username=f'bench-{name}', password='x')
+            db.session.add(user)
+            db.session.commit()
+            user_id = user.id
+            create_default_favorite_folder(user_id)
+
+            started = time.perf_counter()
+            dataset = generate_account(user_id, params['depth'], params['fanout'], params['files'], blob_size, seed)
+            dataset['generate_seconds'] = round(time.perf_counter() - started, 3)
+            folders = top_folder_ids(user_id)
+
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = str(user_id)
+            session['_fresh'] = True
+
+        def fresh_subtree(iteration):
+            with app.app_context():
+                prefix = f'del{iteration}_'
+                generate_account(user_id, 1, params['fanout'], params['files'], blob_size, seed + iteration, prefix)
+                return top_folder_ids(user_id, prefix)
+
+        def delete_case(iteration):
+            ids = fresh_subtree(iteration)
+            return lambda c: c.post('/file_management/delete', json={'file_ids': ids})
+
+        def move_case(iteration):
+            # 交替移入另一个顶层文件夹和移回根目录，每次移动的子树大小相同
+            target = folders[1] if iteration % 2 == 0 else None
+            return lambda c: c.post('/file_management/move', json={'file_ids': [folders[0]], 'target_folder_id': target})
+
+        def upload_case(iteration):
+            count = min(params['files'] * params['fanout'], 200)
+            rng = random.Random(seed + iteration)
+            parts = [(io.BytesIO(rng.randbytes(blob_size)), f'upload{iteration}/sub{index % 4}/file_{index}.txt')
+                     for index in range(count)]
+            return lambda c: c.post('/file_management/upload_folder', data={'folder': parts},
+                                    content_type='multipart/form-data')
+
+        word = WORDS[0]
+        cases = {
+            'files': lambda i: lambda c: c.get('/file_management/files?limit=100'),
+            'files_folder': lambda i: lambda c: c.get(f'/file_management/files?folder_id={folders[0]}&limit=100'),
+            'search_files': lambda i: lambda c: c.get(f'/file_management/search_files?q={word}&per_page=50'),
+            'move': move_case,
+            'delete': delete_case,
+            'upload_folder': upload_case,
+            'download': lambda i: lambda c: c.post('/file_management/download', json={'file_ids': [folders[0]]}),
+        }
+        results = {}
+        for case, prepare in cases.items():
+            # 不在外层推入应用上下文，每个请求使用独立的会话，与线上一致
+            results[case] = measure(client, counter, prepare, repeat)
+            logging.info(f'{name}/{case}: {results[case]["median_ms"]} ms median, {results[case]["queries"]} queries')
+        return {'params': params, 'dataset': dataset, 'results': results}
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def run_search(users, files_per_user, repeat, seed):
+    # 直接写入全文索引模拟多用户的大索引，测量单个用户的搜索延迟是否受其他用户文档数影响
+    work_dir = tempfile.mkdtemp(prefix='clouddrive-bench-search-')
+    config_class = type('SearchConfig', (BenchmarkConfig,), {
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(work_dir, 'bench.db'),
+        'BLOB_STORAGE_PATH': os.path.join(work_dir, 'blobs'),
+    })
+    try:
+        app = create_app(config_class)
+        with app.app_context():
+            rng = random.Random(seed)
+            started = time.perf_counter()
+            rows = []
+            for file_id in range(1, users * files_per_user + 1):
+                rows.append({
+                    'file_id': file_id,
+                    'uploader_id': (file_id - 1) // files_per_user + 1,
+                    'filename': search_index.segment(f'{rng.choice(WORDS)}_{file_id}.txt'),
+                    'tags': search_index.segment(rng.choice(WORDS)),
+                    'content': search_index.segment(' '.join(rng.choices(WORDS, k=20))),
+                })
+                if len(rows) == search_index.BATCH_SIZE:
+                    search_index._upsert(db.session, 'sqlite', rows)
+                    rows = []
+            if rows:
+                search_index._upsert(db.session, 'sqlite', rows)
+            db.session.commit()
+            generate_seconds = round(time.perf_counter() - started, 3)
+
+            results = {}
+            for word in ('report', '报告'):
+                timings = []
+                for iteration in range(repeat + 1):
+                    uploader_id = rng.randint(1, users)
+                    started = time.perf_counter()
+                    search_index.search(uploader_id, word)
+                    if iteration > 0:
+                        timings.append(time.perf_counter() - started)
+                timings.sort()
+                results[word] = {
+                    'median_ms': round(statistics.median(timings) * 1000, 3),
+                    'p95_ms': round(timings[min(len(timings) - 1, int(len(timings) * 0.95))] * 1000, 3),
+                    'max_ms': round(timings[-1] * 1000, 3),
+                }
+                logging.info(f'search/{word}: {results[word]["median_ms"]} ms median')
+            db.session.remove()
+        return {'users': users, 'files_per_user': files_per_user, 'rows': users * files_per_user,
+                'generate_seconds': generate_seconds, 'results': results}
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                              text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(baseline_path, current):
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = json.load(f)
+    print(f"{'scale':<8} {'endpoint':<14} {'baseline ms':>12} {'current ms':>12} {'ratio':>7} {'queries':>11}")
+    for scale, data in current['scales'].items():
+        old_scale = baseline.get('scales', {}).get(scale)
+        if not old_scale:
+            continue
+        for case, result in data['results'].items():
+            old = old_scale['results'].get(case)
+            if not old:
+                continue
+            ratio = result['median_ms'] / old['median_ms'] if old['median_ms'] else float('inf')
+            print(f"{scale:<8} {case:<14} {old['median_ms']:>12.2f} {result['median_ms']:>12.2f} {ratio:>7.2f} "
+                  f"{old['queries']:>5}->{result['queries']:<5}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the file management endpoints on synthetic accounts')
+    parser.add_argument('--scales', default='small,medium', help=f'comma separated, from {", ".join(SCALES)}')
+    parser.add_argument('--depth', type=int, help='override tree depth for every scale')
+    parser.add_argument('--fanout', type=int, help='override sub folders per folder')
+    parser.add_argument('--files', type=int, help='override files per folder')
+    parser.add_argument('--blob-size', type=int, default=4096, help='bytes per synthetic file')
+    parser.add_argument('--repeat', type=int, default=5, help='timed runs per endpoint')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--search-users', type=int, default=0,
+                        help='also measure search latency on a full-text index shared by this many users')
+    parser.add_argument('--search-files', type=int, default=1000, help='indexed files per user for --search-users')
+    parser.add_argument('--output', help='write JSON results to this file instead of stdout')
+    parser.add_argument('--compare', help='baseline JSON to compare the results against')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    for name in ('file_management', 'bulk_ingest', 'app', 'werkzeug'):
+        logging.getLogger(name).setLevel(logging.WARNING)
+
+    report = {
+        'commit': git_commit(),
+        'created_at': datetime.utcnow().isoformat() + 'Z',
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'blob_size': args.blob_size,
+        'repeat': args.repeat,
+        'seed': args.seed,
+        'scales': {},
+    }
+    for name in args.scales.split(','):
+        params = dict(SCALES[name])
+        for key in ('depth', 'fanout', 'files'):
+            if getattr(args, key) is not None:
+                params[key] = getattr(args, key)
+        report['scales'][name] = run_scale(name, params, args.repeat, args.blob_size, args.seed)
+    if args.search_users:
+        report['search'] = run_search(args.search_users, args.search_files, args.repeat * 10, args.seed)
+
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+    if args.compare:
+        compare(args.compare, report)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,157 @@
+import time
+from collections import Counter
+from extensions import db
+from models import File
+from storage import blob_store, add_blob_references
+import tagging
+
+BATCH_SIZE = 500
+
+
+def _batches(items, size=BATCH_SIZE):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+class BulkIngest:
+    # 一次性构建目录映射并分批插入，调用方负责在最后统一提交事务；parent_id 由调用方校验为整数
+    def __init__(self, uploader_id, parent_id=None, tags=None, batch_size=BATCH_SIZE):
+        self.uploader_id = uploader_id
+        self.parent_id = parent_id
+        self.tags = tags
+        self.batch_size = batch_size
+        self.entries = []
+        self.folder_ids = {(): parent_id}
+        self.top_folder_ids = []
+        self.stats = {}
+
+    def add_file(self, dir_parts, filename, category, stream):
+        self.entries.append((tuple(dir_parts), filename, category, stream))
+
+    def add_folder(self, dir_parts):
+        self.entries.append((tuple(dir_parts), None, None, None))
+
+    def run(self):
+        started = time.perf_counter()
+        directories = set()
+        for dir_parts, _, _, _ in self.entries:
+            for depth in range(1, len(dir_parts) + 1):
+                directories.add(dir_parts[:depth])
+
+        self._resolve_existing_folders(directories)
+        pending_files = self._skip_existing_files()
+
+        # 先写入内容，再开始数据库写事务，缩短持有写锁的时间
+        stored_files = []
+        total_bytes = 0
+        for dir_parts, filename, category, stream in pending_files:
+            content_hash, size = blob_store.write_stream(stream)
+            stored_files.append((dir_parts, filename, category, content_hash, size))
+            total_bytes += size
+
+        created_folders = self._create_missing_folders(directories)
+        file_ids = self._insert_files(stored_files)
+        tagging.tag_files(self.uploader_id, self.top_folder_ids + file_ids, self.tags)
+
+        sizes = {content_hash: size for _, _, _, content_hash, size in stored_files}
+        counts = Counter(content_hash for _, _, _, content_hash, _ in stored_files)
+        add_blob_references({content_hash: (sizes[content_hash], count) for content_hash, count in counts.items()})
+
+        elapsed = time.perf_counter() - started
+        self.stats = {
+            'files': len(stored_files),
+            'folders': created_folders,
+            'skipped': len([entry for entry in self.entries if entry[1] is not None]) - len(stored_files),
+            'bytes': total_bytes,
+            'seconds': round(elapsed, 3),
+            'files_per_second': round(len(stored_files) / elapsed, 1) if elapsed > 0 else None,
+        }
+        return self.stats
+
+    def _resolve_existing_folders(self, directories):
+        names = {dir_parts[-1] for dir_parts in directories}
+        existing = {}
+        for batch in _batches(names, self.batch_size):
+            rows = db.session.query(File.id, File.parent_id, File.filename).filter(
+                File.uploader_id == self.uploader_id,
+                File.is_folder == True,
+                File.is_favorite_folder == False,
+                File.filename.in_(batch)
+            )
+            for folder_id, parent_id, filename in rows:
+                existing.setdefault((parent_id, filename), folder_id)
+
+        for dir_parts in sorted(directories, key=len):
+            parent_key = dir_parts[:-1]
+            if parent_key in self.folder_ids:
+                folder_id = existing.get((self.folder_ids[parent_key], dir_parts[-1]))
+                if folder_id is not None:
+                    self.folder_ids[dir_parts] = folder_id
+
+    def _skip_existing_files(self):
+        files = [entry for entry in self.entries if entry[1] is not None]
+        parent_ids = {self.folder_ids[dir_parts] for dir_parts, _, _, _ in files if dir_parts in self.folder_ids}
+        existing = set()
+        for batch in _batches(parent_ids - {None}, self.batch_size):
+            rows = db.session.query(File.parent_id, File.filename).filter(
+                File.uploader_id == self.uploader_id, File.parent_id.in_(batch))
+            existing.update(rows)
+        if None in parent_ids:
+            rows = db.session.query(File.parent_id, File.filename).filter(
+                File.uploader_id == self.uploader_id, File.parent_id == None)
+            existing.update(rows)
+
+        pending = []
+        seen = set()
+        for dir_parts, filename, category, stream in files:
+            key = (self.folder_ids.get(dir_parts, dir_parts), filename)
+            if (dir_parts in self.folder_ids and key in existing) or key in seen:
+                continue
+            seen.add(key)
+            pending.append((dir_parts, filename, category, stream))
+        return pending
+
+    def _create_missing_folders(self, directories):
+        missing = sorted((dir_parts for dir_parts in directories if dir_parts not in self.folder_ids), key=len)
+        created = 0
+        depth = 0
+        while created < len(missing):
+            depth += 1
+            level = [dir_parts for dir_parts in missing if len(dir_parts) == depth]
+            for batch in _batches(level, self.batch_size):
+                folders = [File(
+                    filename=dir_parts[-1],
+                    uploader_id=self.uploader_id,
+                    is_folder=True,
+                    parent_id=self.folder_ids[dir_parts[:-1]],
+                    tags=self.tags if depth == 1 else None,
+                    is_favorite_folder=False
+                ) for dir_parts in batch]
+                db.session.add_all(folders)
+                db.session.flush()
+                for dir_parts, folder in zip(batch, folders):
+                    self.folder_ids[dir_parts] = folder.id
+                if depth == 1:
+                    self.top_folder_ids.extend(folder.id for folder in folders)
+            created += len(level)
+        return created
+
+    def _insert_files(self, stored_files):
+        file_ids = []
+        for batch in _batches(stored_files, self.batch_size):
+            files = [File(
+                filename=filename,
+                content_hash=content_hash,
+                size=size,
+                uploader_id=self.uploader_id,
+                category=category,
+                tags=self.tags,
+                parent_id=self.folder_ids[dir_parts]
+            ) for dir_parts, filename, category, content_hash, size in batch]
+            db.session.add_all(files)
+            db.session.flush()
+            for file in files:
+                file_ids.append(file.id)
+                db.session.expunge(file)
+        return file_ids
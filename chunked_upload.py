@@ -0,0 +1,296 @@
+import os
+import uuid
+import shutil
+import hashlib
+from datetime import datetime, timedelta
+from flask import Blueprint, request, jsonify, current_app
+from flask_login import login_required, current_user
+from models import File, UploadSession
+from extensions import db
+from storage import blob_store, add_blob_reference, claim_blob, CHUNK_SIZE
+from file_management import allowed_file, get_file_category, custom_secure_filename
+import tagging
+import usage
+import versioning
+
+chunked_upload_bp = Blueprint('chunked_upload', __name__)
+
+
+def session_dir(upload_id):
+    return os.path.join(blob_store.root, 'uploads', upload_id)
+
+
+def data_path(upload_id):
+    return os.path.join(session_dir(upload_id), 'data')
+
+
+def marker_path(upload_id, index):
+    return os.path.join(session_dir(upload_id), f'{index}.ok')
+
+
+def received_chunks(upload_session):
+    received = set()
+    for name in os.listdir(session_dir(upload_session.id)):
+        if name.endswith('.ok'):
+            received.add(int(name[:-3]))
+    return received
+
+
+def discard_session(upload_session):
+    shutil.rmtree(session_dir(upload_session.id), ignore_errors=True)
+    db.session.delete(upload_session)
+
+
+def purge_expired_sessions():
+    expire_before = datetime.utcnow() - timedelta(seconds=current_app.config['UPLOAD_SESSION_TTL'])
+    for upload_session in UploadSession.query.filter(UploadSession.created_at < expire_before).all():
+        discard_session(upload_session)
+
+
+def claim_known_blob(content_hash, size):
+    # 仅凭哈希即可取得内容，默认只认当前用户已有的文件；跨用户秒传需将 INSTANT_UPLOAD_SCOPE 设为 global
+    if current_app.config['INSTANT_UPLOAD_SCOPE'] != 'global':
+        owned = db.session.scalar(db.select(File.id).where(File.content_hash == content_hash,
+                                                           File.uploader_id == current_user.id).limit(1))
+        if owned is None:
+            return False
+    return claim_blob(content_hash, size)
+
+
+def get_user_session(upload_id, lock=False):
+    query = UploadSession.query.filter_by(id=upload_id, uploader_id=current_user.id)
+    if lock:
+        query = query.with_for_update()
+    return query.first()
+
+
+def completed_concurrently():
+    # 并发的另一次 complete 已取走数据文件
+    db.session.rollback()
+    return jsonify({'success': False, 'message': 'Upload already completed'}), 409
+
+
+@chunked_upload_bp.route('/uploads', methods=['POST'])
+@login_required
+def init_upload():
+    data = request.get_json()
+    filename = data.get('filename')
+    size = data.get('size')
+    parent_id = data.get('parent_id') or None
+    sha256 = data.get('sha256')
+
+    if not filename or not allowed_file(filename):
+        return jsonify({'success': False, 'message': 'File upload failed or invalid file type'}), 400
+    if not isinstance(size, int) or size < 0:
+        return jsonify({'success': False, 'message': 'Invalid file size'}), 400
+    if parent_id is not None:
+        # 秒传会立即占用内容引用，目标文件夹必须先确认存在且属于当前用户
+        try:
+            parent_id = int(parent_id)
+        except (TypeError, ValueError):
+            return jsonify({'success': False, 'message': 'Invalid parent folder'}), 400
+        if not File.query.filter_by(id=parent_id, uploader_id=current_user.id, is_folder=True).first():
+            return jsonify({'success': False, 'message': 'Parent folder not found'}), 404
+
+    filename = custom_secure_filename(filename)
+    existing_file = File.query.filter_by(filename=filename, parent_id=parent_id, uploader_id=current_user.id).first()
+    # new_version 为真时同名文件作为新版本保存，完成上传时需再次传入
+    if existing_file and (not data.get('new_version') or existing_file.is_folder):
+        return jsonify({'success': False, 'message': 'File with the same name already exists'}), 400
+
+    if not usage.check_quota(current_user.id, size):
+        return jsonify({'success': False, 'message': 'Storage quota exceeded'}), 413
+
+    if sha256 and claim_known_blob(sha256.lower(), size):
+        # 服务器已有相同内容，直接创建文件记录，客户端无需再上传分片
+        if existing_file:
+            version = versioning.add_version(existing_file, sha256.lower(), size)
+            db.session.commit()
+            return jsonify({'success': True, 'instant': True, 'message': 'New version uploaded successfully',
+                            'file_id': existing_file.id, 'version': version.version})
+        new_file = File(
+            filename=filename,
+            content_hash=sha256.lower(),
+            size=size,
+            uploader_id=current_user.id,
+            category=get_file_category(filename),
+            tags=data.get('tags'),
+            parent_id=parent_id,
+            created_at=datetime.utcnow()
+        )
+        db.session.add(new_file)
+        tagging.set_file_tags(new_file, data.get('tags'))
+        db.session.commit()
+        current_app.logger.info(f'Instant upload of {filename} as file {new_file.id}')
+        return jsonify({'success': True, 'instant': True, 'message': 'File uploaded successfully',
+                        'file_id': new_file.id})
+
+    chunk_size = data.get('chunk_size') or current_app.config['CHUNKED_UPLOAD_CHUNK_SIZE']
+    if not isinstance(chunk_size, int) or not 0 < chunk_size <= current_app.config['CHUNKED_UPLOAD_MAX_CHUNK_SIZE']:
+        return jsonify({'success': False, 'message': 'Invalid chunk size'}), 400
+
+    purge_expired_sessions()
+
+    upload_session = UploadSession(
+        id=uuid.uuid4().hex,
+        uploader_id=current_user.id,
+        filename=filename,
+        parent_id=parent_id,
+        tags=data.get('tags'),
+        size=size,
+        chunk_size=chunk_size,
+        sha256=sha256.lower() if sha256 else None
+    )
+    os.makedirs(session_dir(upload_session.id))
+    # 预先创建目标文件，各分片按偏移量直接写入，合并时无需再拷贝
+    with open(data_path(upload_session.id), 'wb') as f:
+        f.truncate(size)
+
+    db.session.add(upload_session)
+    db.session.commit()
+
+    return jsonify({'success': True, 'instant': False, 'upload_id': upload_session.id, 'chunk_size': chunk_size,
+                    'total_chunks': upload_session.total_chunks})
+
+
+@chunked_upload_bp.route('/uploads/<upload_id>', methods=['GET'])
+@login_required
+def upload_status(upload_id):
+    upload_session = get_user_session(upload_id)
+    if not upload_session:
+        return jsonify({'success': False, 'message': 'Upload session not found'}), 404
+
+    received = received_chunks(upload_session)
+    missing = [index for index in range(upload_session.total_chunks) if index not in received]
+    return jsonify({'success': True, 'upload_id': upload_id, 'total_chunks': upload_session.total_chunks,
+                    'received': sorted(received), 'missing': missing})
+
+
+@chunked_upload_bp.route('/uploads/<upload_id>/chunks/<int:index>', methods=['PUT'])
+@login_required
+def upload_chunk(upload_id, index):
+    upload_session = get_user_session(upload_id)
+    if not upload_session:
+        return jsonify({'success': False, 'message': 'Upload session not found'}), 404
+    if index < 0 or index >= upload_session.total_chunks:
+        return jsonify({'success': False, 'message': 'Invalid chunk index'}), 400
+
+    # 重传分片时先撤销旧标记，新数据校验失败或写入中断时该分片显示为缺失
+    try:
+        os.remove(marker_path(upload_id, index))
+    except FileNotFoundError:
+        pass
+
+    expected_length = upload_session.chunk_length(index)
+    sha = hashlib.sha256()
+    written = 0
+    with open(data_path(upload_id), 'r+b') as f:
+        f.seek(index * upload_session.chunk_size)
+        while written <= expected_length:
+            chunk = request.stream.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            sha.update(chunk)
+            f.write(chunk[:expected_length - written])
+            written += len(chunk)
+        f.flush()
+        os.fsync(f.fileno())
+
+    if written != expected_length:
+        return jsonify({'success': False, 'message': f'Chunk {index} should be {expected_length} bytes, got {written}'}), 400
+
+    chunk_sha256 = request.headers.get('X-Chunk-SHA256')
+    if chunk_sha256 and chunk_sha256.lower() != sha.hexdigest():
+        return jsonify({'success': False, 'message': f'Checksum mismatch for chunk {index}'}), 400
+
+    # 分片数据落盘后再写标记，中断的分片会在查询时显示为缺失
+    with open(marker_path(upload_id, index), 'w') as f:
+        f.write(sha.hexdigest())
+
+    return jsonify({'success': True, 'index': index, 'sha256': sha.hexdigest()})
+
+
+@chunked_upload_bp.route('/uploads/<upload_id>/complete', methods=['POST'])
+@login_required
+def complete_upload(upload_id):
+    # 锁住会话行，同一上传的并发 complete 依次执行，后到的请求看到会话已删除；
+    # SQLite 不支持行锁，数据文件已被取走时返回 409
+    upload_session = get_user_session(upload_id, lock=True)
+    if not upload_session:
+        return jsonify({'success': False, 'message': 'Upload session not found'}), 404
+
+    received = received_chunks(upload_session)
+    missing = [index for index in range(upload_session.total_chunks) if index not in received]
+    if missing:
+        return jsonify({'success': False, 'message': 'Upload incomplete', 'missing': missing}), 400
+
+    if upload_session.parent_id is not None:
+        parent = File.query.filter_by(id=upload_session.parent_id, uploader_id=current_user.id, is_folder=True).first()
+        if not parent:
+            discard_session(upload_session)
+            db.session.commit()
+            return jsonify({'success': False, 'message': 'Target folder no longer exists, upload discarded'}), 404
+
+    existing_file = File.query.filter_by(filename=upload_session.filename, parent_id=upload_session.parent_id,
+                                         uploader_id=current_user.id).first()
+    new_version = (request.get_json(silent=True) or {}).get('new_version')
+    if existing_file and (not new_version or existing_file.is_folder):
+        return jsonify({'success': False, 'message': 'File with the same name already exists'}), 400
+
+    sha = hashlib.sha256()
+    try:
+        with open(data_path(upload_id), 'rb') as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                sha.update(chunk)
+    except FileNotFoundError:
+        return completed_concurrently()
+    content_hash = sha.hexdigest()
+
+    if upload_session.sha256 and upload_session.sha256 != content_hash:
+        discard_session(upload_session)
+        db.session.commit()
+        return jsonify({'success': False, 'message': 'Checksum mismatch, upload discarded'}), 400
+
+    try:
+        blob_store.adopt(data_path(upload_id), content_hash)
+    except FileNotFoundError:
+        return completed_concurrently()
+    add_blob_reference(content_hash, upload_session.size)
+
+    if existing_file:
+        version = versioning.add_version(existing_file, content_hash, upload_session.size)
+        discard_session(upload_session)
+        db.session.commit()
+        current_app.logger.info(f'Chunked upload {upload_id} completed as version {version.version} of file {existing_file.id}')
+        return jsonify({'success': True, 'message': 'New version uploaded successfully',
+                        'file_id': existing_file.id, 'version': version.version})
+
+    new_file = File(
+        filename=upload_session.filename,
+        content_hash=content_hash,
+        size=upload_session.size,
+        uploader_id=current_user.id,
+        category=get_file_category(upload_session.filename),
+        tags=upload_session.tags,
+        parent_id=upload_session.parent_id,
+        created_at=datetime.utcnow()
+    )
+    db.session.add(new_file)
+    tagging.set_file_tags(new_file, upload_session.tags)
+    discard_session(upload_session)
+    db.session.commit()
+
+    current_app.logger.info(f'Chunked upload {upload_id} completed as file {new_file.id}')
+    return jsonify({'success': True, 'message': 'File uploaded successfully', 'file_id': new_file.id})
+
+
+@chunked_upload_bp.route('/uploads/<upload_id>', methods=['DELETE'])
+@login_required
+def abort_upload(upload_id):
+    upload_session = get_user_session(upload_id)
+    if not upload_session:
+        return jsonify({'success': False, 'message': 'Upload session not found'}), 404
+
+    discard_session(upload_session)
+    db.session.commit()
+    return jsonify({'success': True, 'message': 'Upload aborted'})
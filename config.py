@@ -1,7 +1,78 @@
 import os
 
+
+def _pool_options(prefix):
+    # 只在显式配置时传入连接池参数，SQLite 默认的连接池不接受 pool_size/pool_timeout
+    options = {}
+    if os.environ.get(f'{prefix}_POOL_SIZE'):
+        options['pool_size'] = int(os.environ[f'{prefix}_POOL_SIZE'])
+    if os.environ.get(f'{prefix}_POOL_TIMEOUT'):
+        options['pool_timeout'] = float(os.environ[f'{prefix}_POOL_TIMEOUT'])
+    return options
+
+
 class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'you-will-never-guess'
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or \
         'sqlite:///' + os.path.join(os.path.abspath(os.path.dirname(__file__)), 'app.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    SQLALCHEMY_ENGINE_OPTIONS = _pool_options('DATABASE')
+    # 只读副本，逗号分隔的数据库 URL；GET/HEAD 请求的查询发往副本，写操作和写入后的读取走主库
+    # 本地测试可复制一份 app.db 作为副本：DATABASE_REPLICA_URLS=sqlite:////path/to/replica.db
+    SQLALCHEMY_BINDS = {
+        f'replica_{index}': {'url': url.strip(), **_pool_options('DATABASE_REPLICA')}
+        for index, url in enumerate(filter(None, (os.environ.get('DATABASE_REPLICA_URLS') or '').split(',')))
+    }
+    # 写入提交后该用户的读请求继续走主库的秒数，应大于副本的复制延迟
+    REPLICA_STICKY_SECONDS = int(os.environ.get('REPLICA_STICKY_SECONDS') or 10)
+    BLOB_STORAGE_PATH = os.environ.get('BLOB_STORAGE_PATH') or \
+        os.path.join(os.path.abspath(os.path.dirname(__file__)), 'blobs')
+    CHUNKED_UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+    CHUNKED_UPLOAD_MAX_CHUNK_SIZE = 64 * 1024 * 1024
+    UPLOAD_SESSION_TTL = 24 * 3600
+    # 秒传（按 sha256 复用已有内容）的范围：user 只复用本人已有的内容，global 复用全站内容
+    INSTANT_UPLOAD_SCOPE = os.environ.get('INSTANT_UPLOAD_SCOPE') or 'user'
+    # 文件夹上传每个文件占一个表单分段，Werkzeug 默认只允许 1000 个
+    MAX_FORM_PARTS = int(os.environ.get('MAX_FORM_PARTS') or 100000)
+    BLOB_RECLAIMER_ENABLED = True
+    BLOB_RECLAIM_GRACE_SECONDS = 600
+    BLOB_RECLAIM_INTERVAL = 300
+    SEARCH_INDEX_CONTENT = True
+    PREVIEW_CACHE_PATH = os.environ.get('PREVIEW_CACHE_PATH')
+    PREVIEW_CACHE_MAX_BYTES = int(os.environ.get('PREVIEW_CACHE_MAX_BYTES') or 1024 * 1024 * 1024)
+    LIBREOFFICE_PATH = os.environ.get('LIBREOFFICE_PATH') or \
+        os.path.join(os.path.abspath(os.path.dirname(__file__)), 'LibreOffice', 'program', 'soffice.exe')
+    # rarfile 解压 RAR 成员使用的 unrar 程序，不存在时由 rarfile 自行查找 unrar/unar/bsdtar
+    UNRAR_PATH = os.environ.get('UNRAR_PATH') or \
+        os.path.join(os.path.abspath(os.path.dirname(__file__)), 'WinRAR', 'UnRAR.exe')
+    ARCHIVE_LIST_LIMIT = 10000
+    # 服务器端解压的成员数与解压后总大小上限，按中央目录声明的大小检查
+    ARCHIVE_EXTRACT_MAX_MEMBERS = 20000
+    ARCHIVE_EXTRACT_MAX_BYTES = int(os.environ.get('ARCHIVE_EXTRACT_MAX_BYTES') or 10 * 1024 * 1024 * 1024)
+    CONVERTER_PROFILE_PATH = os.environ.get('CONVERTER_PROFILE_PATH')
+    CONVERTER_WORKERS = int(os.environ.get('CONVERTER_WORKERS') or 2)
+    CONVERTER_QUEUE_SIZE = 32
+    CONVERTER_TIMEOUT = 120
+    # 预览请求最多同步等待的秒数，超时返回 202 由前端轮询
+    PREVIEW_CONVERT_WAIT = 15
+    # 默认每用户存储配额（字节），为空表示不限制；user_usage.quota_bytes 可按用户覆盖
+    STORAGE_QUOTA_BYTES = int(os.environ['STORAGE_QUOTA_BYTES']) if os.environ.get('STORAGE_QUOTA_BYTES') else None
+    # 版本内容分块的平均/最小/最大长度，最小和最大为空时取平均值的 1/4 和 8 倍；分块需要 fastcdc 的编译扩展
+    VERSION_CHUNK_AVG_SIZE = 1024 * 1024
+    VERSION_CHUNK_MIN_SIZE = None
+    VERSION_CHUNK_MAX_SIZE = None
+    # 版本内容在提交后由后台线程分块；关闭后各版本保留完整内容
+    VERSION_CHUNKING_ENABLED = True
+    # 文本预览单页最多读取的字节数和行数
+    TEXT_PREVIEW_MAX_BYTES = 1024 * 1024
+    TEXT_PREVIEW_MAX_LINES = 1000
+    THUMBNAILS_ENABLED = True
+    THUMBNAIL_WORKERS = 2
+    THUMBNAIL_MAX_AGE = 365 * 24 * 3600
+    # 超过该秒数的请求记录到日志（含 SQL 列表），为空则关闭
+    SLOW_REQUEST_SECONDS = float(os.environ['SLOW_REQUEST_SECONDS']) if os.environ.get('SLOW_REQUEST_SECONDS') else None
+    # 多进程部署时设为 redis，各进程共享版本号
+    RESPONSE_CACHE_BACKEND = os.environ.get('RESPONSE_CACHE_BACKEND') or 'local'
+    RESPONSE_CACHE_REDIS_URL = os.environ.get('RESPONSE_CACHE_REDIS_URL') or 'redis://localhost:6379/0'
+    RESPONSE_CACHE_SIZE = 10000
+    RESPONSE_CACHE_TTL = 3600
@@ -0,0 +1,178 @@
+import os
+import time
+import queue
+import shutil
+import logging
+import threading
+import subprocess
+from pathlib import Path
+from collections import OrderedDict
+from concurrent.futures import Future
+from metrics import metrics
+
+
+class ConverterBusy(Exception):
+    pass
+
+
+class ConversionTimeout(Exception):
+    pass
+
+
+class ConverterWorker:
+    # 每个工作线程使用独立的 LibreOffice 用户配置目录，多个实例可以并发运行且配置只需初始化一次
+    def __init__(self, pool, index):
+        self.pool = pool
+        self.name = f'converter-{index}'
+        self.profile_dir = os.path.join(pool.root, self.name)
+        self.process = None
+        self.busy = False
+
+    def command(self, *args):
+        profile = Path(os.path.abspath(self.profile_dir)).as_uri()
+        return [self.pool.soffice_path, f'-env:UserInstallation={profile}', '--headless', '--norestore',
+                '--nologo', '--nodefault', *args]
+
+    def convert(self, input_path, output_dir, target='pdf'):
+        command = self.command('--convert-to', target, '--outdir', output_dir, input_path)
+        started = time.perf_counter()
+        self.process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        try:
+            stdout, stderr = self.process.communicate(timeout=self.pool.timeout)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.communicate()
+            self.pool._count('timeouts')
+            metrics.conversion_duration.observe(time.perf_counter() - started, 'libreoffice', 'timeout')
+            self.restart()
+            raise ConversionTimeout(f'Conversion exceeded {self.pool.timeout} seconds')
+        finally:
+            returncode = self.process.returncode
+            self.process = None
+
+        metrics.conversion_duration.observe(time.perf_counter() - started, 'libreoffice',
+                                            'success' if returncode == 0 else 'error')
+        if returncode != 0:
+            self.restart()
+            raise subprocess.CalledProcessError(returncode, command, stdout, stderr)
+        return stdout, stderr
+
+    def restart(self):
+        # 崩溃或超时后配置目录可能残留锁文件，丢弃后由下一次转换重新初始化
+        shutil.rmtree(self.profile_dir, ignore_errors=True)
+        self.pool._count('restarts')
+        self.pool.logger.warning(f'{self.name} restarted with a fresh profile')
+
+
+class ConverterPool:
+    # 固定数量的转换线程消费有界队列，请求线程只提交任务并按截止时间等待结果
+    def __init__(self, app=None):
+        self.app = None
+        self.workers = []
+        self.jobs = {}
+        self.failures = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = {'submitted': 0, 'completed': 0, 'failed': 0, 'timeouts': 0, 'rejected': 0, 'restarts': 0,
+                      'busy_seconds': 0.0, 'wait_seconds': 0.0}
+        self.logger = logging.getLogger(__name__)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.soffice_path = app.config['LIBREOFFICE_PATH']
+        self.root = app.config['CONVERTER_PROFILE_PATH'] or os.path.join(app.config['BLOB_STORAGE_PATH'], 'converter')
+        self.timeout = app.config['CONVERTER_TIMEOUT']
+        self.queue = queue.Queue(maxsize=app.config['CONVERTER_QUEUE_SIZE'])
+        os.makedirs(self.root, exist_ok=True)
+        app.extensions['converter_pool'] = self
+        if not self.workers:
+            for index in range(app.config['CONVERTER_WORKERS']):
+                worker = ConverterWorker(self, index)
+                thread = threading.Thread(target=self._run, args=(worker,), name=worker.name, daemon=True)
+                self.workers.append(worker)
+                thread.start()
+
+    def version(self):
+        try:
+            result = subprocess.run([self.soffice_path, '--version'], stdout=subprocess.PIPE,
+                                    stderr=subprocess.PIPE, text=True, timeout=60)
+            return result.stdout.strip()
+        except (OSError, subprocess.SubprocessError):
+            return None
+
+    def submit(self, key, job):
+        # 相同 key 的任务在排队或执行中时直接复用，超时返回的请求重新提交不会重复转换
+        with self.lock:
+            future = self.jobs.get(key)
+            if future is not None:
+                return future
+            future = Future()
+            try:
+                self.queue.put_nowait((key, job, future, time.monotonic()))
+            except queue.Full:
+                self.stats['rejected'] += 1
+                raise ConverterBusy('Conversion queue is full')
+            self.jobs[key] = future
+            self.failures.pop(key, None)
+            self.stats['submitted'] += 1
+        return future
+
+    def status(self, key):
+        with self.lock:
+            if key in self.jobs:
+                return 'pending', None
+            if key in self.failures:
+                return 'failed', self.failures[key]
+        return None, None
+
+    def _run(self, worker):
+        while True:
+            key, job, future, queued_at = self.queue.get()
+            started = time.monotonic()
+            worker.busy = True
+            try:
+                with self.app.app_context():
+                    result = job(worker)
+            except Exception as e:
+                self.logger.error(f'Conversion {key} failed on {worker.name}: {e}')
+                with self.lock:
+                    self.stats['failed'] += 1
+                    self.failures[key] = str(e)
+                    while len(self.failures) > 256:
+                        self.failures.popitem(last=False)
+                future.set_exception(e)
+            else:
+                with self.lock:
+                    self.stats['completed'] += 1
+                future.set_result(result)
+            finally:
+                worker.busy = False
+                with self.lock:
+                    self.stats['busy_seconds'] += time.monotonic() - started
+                    self.stats['wait_seconds'] += started - queued_at
+                    self.jobs.pop(key, None)
+                self.queue.task_done()
+
+    def snapshot(self):
+        with self.lock:
+            stats = dict(self.stats)
+        finished = stats['completed'] + stats['failed']
+        stats.update({
+            'workers': len(self.workers),
+            'busy_workers': sum(1 for worker in self.workers if worker.busy),
+            'queue_depth': self.queue.qsize(),
+            'queue_size': self.queue.maxsize,
+            'average_seconds': round(stats['busy_seconds'] / finished, 3) if finished else None,
+            'average_wait_seconds': round(stats['wait_seconds'] / finished, 3) if finished else None,
+        })
+        stats['busy_seconds'] = round(stats['busy_seconds'], 3)
+        stats['wait_seconds'] = round(stats['wait_seconds'], 3)
+        return stats
+
+    def _count(self, name):
+        with self.lock:
+            self.stats[name] += 1
+
+
+converter_pool = ConverterPool()
@@ -0,0 +1,55 @@
+import time
+import random
+from flask import current_app, request, session as flask_session, has_request_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.sql.dml import UpdateBase
+
+REPLICA_BIND_PREFIX = 'replica_'
+
+
+class RoutingSession(Session):
+    # 只读请求的查询发往只读副本；flush、增删改语句以及本次会话写入之后的所有查询都回到主库
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        replica = self.info.get('replica')
+        if bind is None and replica is not None:
+            if self._flushing or isinstance(clause, UpdateBase):
+                self.info['wrote'] = True
+            elif not self.info.get('wrote'):
+                return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def mark_written(session, flush_context):
+    session.info['wrote'] = True
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def stick_to_primary(session):
+    # 写入提交后的一段时间内，该用户的读请求继续走主库，避免副本延迟导致读不到自己的修改
+    if session.info.pop('wrote', False) and has_request_context():
+        flask_session['db_primary_until'] = time.time() + current_app.config['REPLICA_STICKY_SECONDS']
+
+
+class ReplicaRouter:
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['replica_router'] = self
+        if any(key.startswith(REPLICA_BIND_PREFIX) for key in app.config.get('SQLALCHEMY_BINDS') or {}):
+            app.before_request(self.route_reads)
+
+    def route_reads(self):
+        if request.method not in ('GET', 'HEAD'):
+            return
+        if flask_session.get('db_primary_until', 0) > time.time():
+            return
+        db = current_app.extensions['sqlalchemy']
+        replicas = [engine for key, engine in db.engines.items() if key and key.startswith(REPLICA_BIND_PREFIX)]
+        db.session.info['replica'] = random.choice(replicas)
+
+
+replica_router = ReplicaRouter()
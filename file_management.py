@@ -1,20 +1,37 @@
 from flask import flash, redirect, url_for, render_template
 import re
 import io
+import csv
+import json
+import base64
 import os
-import zipfile
+import shutil
 import tempfile
 import subprocess
-from flask import Blueprint, request, jsonify, send_file, current_app
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from flask import Blueprint, request, jsonify, send_file, current_app, stream_with_context
 from flask_login import login_required, current_user
-from models import File,Favorite
+from sqlalchemy import select, cast, func, Text
+from sqlalchemy.orm import aliased
+from models import File,Favorite,FileVersion
 from extensions import db
+import tree
+import search_index
+import tagging
+import usage
+import versioning
+import archives
+from text_preview import TextFile
+from storage import blob_store, store_upload
+from bulk_ingest import BulkIngest
+from zip_stream import ZipEntry, compress_type_for, zip_response, set_attachment
+from preview_cache import conversion_cache, ConverterUnavailable
+from converter_pool import converter_pool, ConverterBusy, ConversionTimeout
+from thumbnails import thumbnail_generator, VARIANTS
+from response_cache import listing_cache
 from datetime import datetime
 
 file_bp = Blueprint('file_management', __name__)
-LIBREOFFICE_PATH = os.path.join(os.path.dirname(__file__), 'LibreOffice', 'program', 'soffice.exe')
-RAR_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), 'WinRAR', 'Rar.exe'))
-UNRAR_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), 'WinRAR', 'UnRAR.exe'))
 
 def allowed_file(filename):
     ALLOWED_EXTENSIONS = {'txt', 'pdf', 'png', 'jpg', 'jpeg', 'gif', 'doc', 'docx', 'xls', 'xlsx', 'ppt', 'pptx', 'mp4',
@@ -38,14 +55,28 @@ def custom_secure_filename(filename):
     filename = re.sub(r'[^a-zA-Z0-9\u4e00-\u9fa5\.\-\_]', '', filename)
     return filename
 
-def add_folder_to_zip(folder, zipf, folder_path):
-    sub_files = File.query.filter_by(parent_id=folder.id).all()
-    for sub_file in sub_files:
-        file_path = os.path.join(folder_path, sub_file.filename)
-        if sub_file.is_folder:
-            add_folder_to_zip(sub_file, zipf, file_path)
+def send_blob(file, mimetype, **kwargs):
+    # ETag 取内容哈希，配合 conditional=True 支持 Range/206 与 304 协商
+    return send_file(blob_store.path(file.content_hash), mimetype=mimetype, conditional=True,
+                     etag=file.content_hash, last_modified=file.updated_at, **kwargs)
+
+def file_zip_entry(file, arcname):
+    if file.is_folder:
+        return ZipEntry(arcname, None, 0, file.updated_at, None)
+    return ZipEntry(arcname, blob_store.path(file.content_hash), file.size, file.updated_at, compress_type_for(file))
+
+def collect_zip_entries(folder, folder_path):
+    entries = []
+    folder_paths = {}
+    for sub_file in tree.subtree_files(folder.id):
+        if sub_file.id == folder.id:
+            file_path = folder_path
         else:
-            zipf.writestr(file_path, sub_file.data)
+            file_path = f'{folder_paths[sub_file.parent_id]}/{sub_file.filename}'
+        if sub_file.is_folder:
+            folder_paths[sub_file.id] = file_path
+        entries.append(file_zip_entry(sub_file, file_path))
+    return entries
 
 @file_bp.route('/upload', methods=['POST'])
 @login_required
@@ -65,16 +96,27 @@ def upload_file():
             parent_id = None
 
         existing_file = File.query.filter_by(filename=filename, parent_id=parent_id, uploader_id=current_user.id).first()
-        if existing_file:
+        # new_version=true 时同名文件作为已有文件的新版本保存
+        new_version = request.form.get('new_version') in ('1', 'true')
+        if existing_file and (not new_version or existing_file.is_folder):
             return jsonify({'success': False, 'message': 'File with the same name already exists'}), 400
 
-        file_data = file.read()
+        if not usage.check_quota(current_user.id, request.content_length):
+            return jsonify({'success': False, 'message': 'Storage quota exceeded'}), 413
+
+        content_hash, size = store_upload(file.stream)
+        if existing_file:
+            version = versioning.add_version(existing_file, content_hash, size)
+            db.session.commit()
+            return jsonify({'success': True, 'message': 'New version uploaded successfully',
+                            'file_id': existing_file.id, 'version': version.version})
         category = get_file_category(filename)
         tags = request.form.get('tags')
 
         new_file = File(
             filename=filename,
-            data=file_data,
+            content_hash=content_hash,
+            size=size,
             uploader_id=current_user.id,
             category=category,
             tags=tags,
@@ -83,6 +125,7 @@ def upload_file():
         )
 
         db.session.add(new_file)
+        tagging.set_file_tags(new_file, tags)
         db.session.commit()
 
         all_files = File.query.filter_by(uploader_id=current_user.id).all()
@@ -113,75 +156,97 @@ def upload_folder():
 
     if parent_id == '':
         parent_id = None
+    elif parent_id is not None:
+        try:
+            parent_id = int(parent_id)
+        except ValueError:
+            return jsonify({'success': False, 'message': 'Invalid parent folder'}), 400
+        if not File.query.filter_by(id=parent_id, uploader_id=current_user.id, is_folder=True).first():
+            return jsonify({'success': False, 'message': 'Parent folder not found'}), 404
 
     existing_folder = File.query.filter_by(filename=root_folder_name, parent_id=parent_id, uploader_id=current_user.id, is_folder=True).first()
     if existing_folder:
         current_app.logger.error('Folder with the same name already exists')
         return jsonify({'success': False, 'message': 'Folder with the same name already exists'}), 400
 
-    root_folder = File(
-        filename=root_folder_name,
-        data=None,
-        uploader_id=current_user.id,
-        tags=tags,
-        is_folder=True,
-        parent_id=parent_id,
-        is_favorite_folder=False  # 标记为非收藏文件夹
-    )
+    if not usage.check_quota(current_user.id, request.content_length):
+        return jsonify({'success': False, 'message': 'Storage quota exceeded'}), 413
+
+    ingest = BulkIngest(current_user.id, parent_id, tags)
+    for file in folder_files:
+        if file.filename == '':
+            continue
 
-    db.session.add(root_folder)
+        path_parts = [custom_secure_filename(part) for part in file.filename.split('/')]
+        path_parts[0] = root_folder_name
+        ingest.add_file(path_parts[:-1], path_parts[-1], get_file_category(path_parts[-1]), file.stream)
+
+    stats = ingest.run()
     db.session.commit()
 
-    def process_file_tree(file, parent_id):
-        file_path_parts = file.filename.split('/')[1:]
-        current_parent_id = parent_id
-        for part in file_path_parts[:-1]:
-            existing_folder = File.query.filter_by(filename=custom_secure_filename(part), parent_id=current_parent_id, uploader_id=current_user.id, is_folder=True).first()
-            if existing_folder:
-                current_parent_id = existing_folder.id
-            else:
-                new_folder = File(
-                    filename=custom_secure_filename(part),
-                    data=None,
-                    uploader_id=current_user.id,
-                    is_folder=True,
-                    parent_id=current_parent_id,
-                    is_favorite_folder=False  # 标记为非收藏文件夹
-                )
-                db.session.add(new_folder)
-                db.session.commit()
-                current_parent_id = new_folder.id
-
-        filename = custom_secure_filename(file_path_parts[-1])
-        file_data = file.read()
-        category = get_file_category(filename)
-        current_app.logger.info(f'Processing file: {filename}, Category: {category}')
+    current_app.logger.info(f'Folder uploaded successfully: {stats["files"]} files, {stats["folders"]} folders '
+                            f'in {stats["seconds"]}s ({stats["files_per_second"]} files/s)')
+    return jsonify({'success': True, 'message': 'Folder uploaded successfully', 'stats': stats})
 
-        existing_file = File.query.filter_by(filename=filename, uploader_id=current_user.id, parent_id=current_parent_id).first()
-        if existing_file:
-            return
+@file_bp.route('/usage', methods=['GET'])
+@login_required
+def get_usage():
+    return jsonify({'success': True, 'usage': usage.get_usage(current_user.id)})
 
-        new_file = File(
-            filename=filename,
-            data=file_data,
-            uploader_id=current_user.id,
-            category=category,
-            tags=tags,
-            parent_id=current_parent_id
-        )
+def get_versioned_file(file_id):
+    return File.query.filter_by(id=file_id, uploader_id=current_user.id, is_folder=False).first()
 
-        db.session.add(new_file)
+@file_bp.route('/versions/<int:file_id>', methods=['GET'])
+@login_required
+def list_versions(file_id):
+    file = get_versioned_file(file_id)
+    if not file:
+        return jsonify({'success': False, 'message': 'File not found'}), 404
 
-    for file in folder_files:
-        if file.filename == '':
-            continue
+    versions = FileVersion.query.filter_by(file_id=file.id).order_by(FileVersion.version.desc()).all()
+    version_list = [dict(version.to_dict(), current=index == 0) for index, version in enumerate(versions)]
+    return jsonify({'success': True, 'file_id': file.id, 'versions': version_list,
+                    'dedup': versioning.dedup_report([file.id])})
 
-        process_file_tree(file, root_folder.id)
+@file_bp.route('/versions/<int:file_id>/<int:version>', methods=['GET'])
+@login_required
+def download_version(file_id, version):
+    file = get_versioned_file(file_id)
+    record = FileVersion.query.filter_by(file_id=file_id, version=version).first() if file else None
+    if not record:
+        return jsonify({'success': False, 'message': 'Version not found'}), 404
+
+    stem, _, extension = file.filename.rpartition('.')
+    download_name = f'{stem}.v{version}.{extension}' if stem else f'{file.filename}.v{version}'
+    if record.content_hash == file.content_hash:
+        return send_blob(file, download_name=download_name, as_attachment=True, mimetype='application/octet-stream')
+
+    # 历史版本没有完整副本，按块顺序流式拼出
+    response = current_app.response_class(stream_with_context(versioning.version_chunks(record)),
+                                          mimetype='application/octet-stream')
+    response.content_length = record.size
+    response.set_etag(record.content_hash)
+    set_attachment(response, download_name)
+    return response
+
+@file_bp.route('/versions/<int:file_id>/<int:version>/restore', methods=['POST'])
+@login_required
+def restore_version(file_id, version):
+    file = get_versioned_file(file_id)
+    record = FileVersion.query.filter_by(file_id=file_id, version=version).first() if file else None
+    if not record:
+        return jsonify({'success': False, 'message': 'Version not found'}), 404
 
+    restored = versioning.restore_version(file, record)
     db.session.commit()
+    return jsonify({'success': True, 'message': f'Version {version} restored', 'version': restored.version})
 
-    current_app.logger.info('Folder uploaded successfully')
-    return jsonify({'success': True, 'message': 'Folder uploaded successfully'})
+@file_bp.route('/versions/stats', methods=['GET'])
+@login_required
+def version_stats():
+    user_files = select(File.id).where(File.uploader_id == current_user.id)
+    return jsonify({'success': True, 'dedup': versioning.dedup_report(user_files),
+                    'chunking': versioning.chunker.snapshot()})
 
 @file_bp.route('/create_folder', methods=['POST'])
 @login_required
@@ -211,6 +276,7 @@ def create_folder():
     )
 
     db.session.add(new_folder)
+    tagging.set_file_tags(new_folder, tags)
     db.session.commit()
 
     return jsonify({'success': True, 'message': 'Folder created successfully', 'folder_name': folder_name, 'parent_id': parent_id})
@@ -222,70 +288,101 @@ def main_page():
     return render_template('main.html', files=files, category='all')
 
 @file_bp.route('/get_favorite_folders', methods=['GET'])
+@listing_cache.cached
 @login_required
 def get_favorite_folders():
     folders = File.query.filter_by(uploader_id=current_user.id, is_favorite_folder=True, is_folder=True).all()
     folder_list = [{'id': folder.id, 'filename': folder.filename} for folder in folders]
     return jsonify(folder_list)
 
+SORT_COLUMNS = {
+    'name': File.filename,
+    'created_at': File.created_at,
+    'updated_at': File.updated_at,
+    'size': db.func.coalesce(File.size, 0),
+}
+MAX_PAGE_SIZE = 1000
+
+def listing_query():
+    # 一次查询带出收藏状态和父文件夹名称，避免逐行查询
+    parent = aliased(File)
+    favorite = aliased(Favorite)
+    is_favorite = db.exists().where(favorite.file_id == File.id)
+    return db.session.query(File, parent.filename, is_favorite).outerjoin(parent, parent.id == File.parent_id)
+
+def listing_dict(row):
+    file, parent_name, is_favorite = row
+    file_dict = file.to_dict()
+    file_dict['is_favorite'] = bool(is_favorite)
+    file_dict['source'] = f'子文件夹：{parent_name}' if parent_name is not None else '单独上传'
+    return file_dict
+
+def encode_cursor(value, file_id):
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    return base64.urlsafe_b64encode(json.dumps([value, file_id]).encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor, sort):
+    value, file_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    if sort in ('created_at', 'updated_at'):
+        value = datetime.fromisoformat(value)
+    return value, file_id
+
+def paginate(query, sort_key_column, sort, descending, limit, cursor):
+    sort_key = db.tuple_(sort_key_column, File.id)
+    if cursor:
+        cursor_key = db.tuple_(*decode_cursor(cursor, sort))
+        query = query.filter(sort_key < cursor_key if descending else sort_key > cursor_key)
+    if descending:
+        query = query.order_by(sort_key_column.desc(), File.id.desc())
+    else:
+        query = query.order_by(sort_key_column, File.id)
+    if limit is None:
+        return query.all(), None
+
+    rows = query.add_columns(sort_key_column).limit(limit + 1).all()
+    next_cursor = encode_cursor(rows[limit - 1][-1], rows[limit - 1][0].id) if len(rows) > limit else None
+    return [row[:-1] for row in rows[:limit]], next_cursor
+
 @file_bp.route('/files', methods=['GET'])
+@listing_cache.cached
 @login_required
 def file_list():
     category = request.args.get('category', 'all')
     parent_id = request.args.get('folder_id', None)
+    sort = request.args.get('sort', 'created_at')
+    descending = request.args.get('order', 'asc') == 'desc'
+    limit = request.args.get('limit', type=int)
+    cursor = request.args.get('cursor')
 
     current_app.logger.info(f'file_list called with category: {category}, parent_id: {parent_id}')
 
-    files = []
+    if sort not in SORT_COLUMNS:
+        return jsonify({'success': False, 'message': f'Unsupported sort: {sort}'}), 400
+    if limit is not None:
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
 
+    query = listing_query()
     if category == 'favorites':
-        favorite_files = Favorite.query.filter_by(folder_id=parent_id).all()
-        for favorite in favorite_files:
-            file = File.query.get(favorite.file_id)
-            if file:
-                files.append(file)
+        query = query.join(Favorite, Favorite.file_id == File.id).filter(
+            Favorite.folder_id == parent_id, File.uploader_id == current_user.id).distinct()
+    elif category == 'all' or parent_id:
+        query = query.filter(File.uploader_id == current_user.id, File.parent_id == parent_id, File.is_favorite_folder == False)
     else:
-        if category == 'all':
-            query = File.query.filter_by(uploader_id=current_user.id, parent_id=parent_id, is_favorite_folder=False)
-            files = query.all()
-        else:
-            if parent_id:
-                query = File.query.filter_by(uploader_id=current_user.id, parent_id=parent_id, is_favorite_folder=False)
-                files = query.all()
-            else:
-                query = File.query.filter_by(uploader_id=current_user.id, is_favorite_folder=False, is_folder=False)
-                files = [file for file in query.all() if file.category == category]
-
-                # 递归获取所有子文件夹中的文件
-                for folder in File.query.filter_by(uploader_id=current_user.id, is_favorite_folder=False, is_folder=True, parent_id=None).all():
-                    files.extend(get_all_sub_files(folder, category))
+        query = query.filter(File.uploader_id == current_user.id, File.is_favorite_folder == False,
+                             File.is_folder == False, File.category == category)
 
-    file_list = []
-    seen_file_ids = set()
-    for file in files:
-        if file.id not in seen_file_ids:
-            file_dict = file.to_dict()
-            file_dict['is_favorite'] = Favorite.query.filter_by(file_id=file.id).first() is not None
-            if file.parent_id:
-                parent_folder = File.query.get(file.parent_id)
-                file_dict['source'] = f'子文件夹：{parent_folder.filename}'
-            else:
-                file_dict['source'] = '单独上传'
-            current_app.logger.info(f'Found file: {file_dict["filename"]}, Category: {file_dict["category"]}')
-            file_list.append(file_dict)
-            seen_file_ids.add(file.id)
-
-    current_app.logger.info(f'Returning file list: {file_list}')
-    return jsonify(file_list)
+    try:
+        rows, next_cursor = paginate(query, SORT_COLUMNS[sort], sort, descending, limit, cursor)
+    except (ValueError, TypeError):
+        return jsonify({'success': False, 'message': 'Invalid cursor'}), 400
 
-def get_all_sub_files(folder, category):
-    sub_files = []
-    for sub_file in File.query.filter_by(parent_id=folder.id).all():
-        if sub_file.is_folder:
-            sub_files.extend(get_all_sub_files(sub_file, category))
-        elif sub_file.category == category:
-            sub_files.append(sub_file)
-    return sub_files
+    file_list = [listing_dict(row) for row in rows]
+    current_app.logger.info(f'Returning {len(file_list)} files')
+    response = jsonify(file_list)
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response
 
 @file_bp.route('/delete', methods=['POST'])
 @login_required
@@ -301,19 +398,98 @@ def delete_files():
 
     parent_id = files[0].parent_id if files else None
 
-    for file in files:
-        delete_file_recursively(file)
-
+    tree.delete_subtrees([file.id for file in files])
+    listing_cache.touch(current_user.id)
     db.session.commit()
     return jsonify({'success': True, 'message': 'Files deleted successfully', 'parent_id': parent_id})
 
-def delete_file_recursively(file):
-    if file.is_folder:
-        sub_files = File.query.filter_by(parent_id=file.id).all()
-        for sub_file in sub_files:
-            delete_file_recursively(sub_file)
-    db.session.delete(file)
-    db.session.commit()
+def convert_to_pdf(worker, content_hash, file_extension, output_path):
+    work_dir = tempfile.mkdtemp(dir=os.path.dirname(output_path))
+    try:
+        temp_input_path = os.path.join(work_dir, f"source.{file_extension}")
+        with blob_store.open(content_hash) as source, open(temp_input_path, 'wb') as temp_input:
+            shutil.copyfileobj(source, temp_input)
+
+        temp_output_path = os.path.join(work_dir, "source.pdf")
+        current_app.logger.info(f"Input file path: {temp_input_path}")
+
+        stdout, stderr = worker.convert(temp_input_path, work_dir)
+        current_app.logger.info(f"LibreOffice stdout: {stdout}")
+        current_app.logger.info(f"LibreOffice stderr: {stderr}")
+
+        if not os.path.exists(temp_output_path):
+            raise FileNotFoundError(f"Converted file does not exist: {temp_output_path}")
+        os.replace(temp_output_path, output_path)
+        current_app.logger.info(f"LibreOffice conversion succeeded on {worker.name}")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+def pdf_conversion_job(content_hash, file_extension):
+    def job(worker):
+        return conversion_cache.get_or_create(
+            content_hash, 'pdf', lambda output_path: convert_to_pdf(worker, content_hash, file_extension, output_path))
+    return job
+
+def conversion_pending_response(file):
+    response = jsonify({'success': True, 'status': 'pending',
+                        'status_url': url_for('file_management.preview_status', file_id=file.id)})
+    response.status_code = 202
+    response.headers['Retry-After'] = '2'
+    return response
+
+@file_bp.route('/preview_status/<int:file_id>', methods=['GET'])
+@login_required
+def preview_status(file_id):
+    file = File.query.get_or_404(file_id)
+    if file.uploader_id != current_user.id:
+        return jsonify({'success': False, 'message': 'Permission denied'}), 403
+
+    if conversion_cache.lookup(file.content_hash, 'pdf'):
+        return jsonify({'success': True, 'status': 'ready',
+                        'url': url_for('file_management.preview_file_content', file_id=file.id)})
+    status, error = converter_pool.status(f'{file.content_hash}:pdf')
+    if status == 'failed':
+        return jsonify({'success': False, 'status': 'failed', 'message': error})
+    return jsonify({'success': True, 'status': status or 'idle'})
+
+@file_bp.route('/thumbnail/<int:file_id>/<variant>', methods=['GET'])
+@login_required
+def serve_thumbnail(file_id, variant):
+    file = File.query.get_or_404(file_id)
+    if file.uploader_id != current_user.id:
+        return "You do not have permission to access this file.", 403
+    if file.category != 'images' or not file.content_hash or variant not in VARIANTS:
+        return "Thumbnail not available", 404
+
+    try:
+        path = thumbnail_generator.ensure(file.content_hash, variant)
+    except Exception as e:
+        current_app.logger.warning(f'Thumbnail generation failed for file {file.id}: {e}')
+        path = None
+    if path is None:
+        # 未安装 Pillow 或无法解码生成缩略图时直接返回原图
+        return send_blob(file, mimetype=f"image/{file.filename.rsplit('.', 1)[1].lower()}")
+    response = send_file(path, mimetype=f'image/{thumbnail_generator.format}', conditional=True,
+                         etag=f'{file.content_hash}-{variant}', max_age=current_app.config['THUMBNAIL_MAX_AGE'])
+    response.cache_control.public = False
+    response.cache_control.private = True
+    response.cache_control.immutable = True
+    return response
+
+@file_bp.route('/thumbnails/stats', methods=['GET'])
+@login_required
+def thumbnail_stats():
+    return jsonify(thumbnail_generator.snapshot())
+
+@file_bp.route('/converter/stats', methods=['GET'])
+@login_required
+def converter_stats():
+    return jsonify(converter_pool.snapshot())
+
+@file_bp.route('/preview_cache/stats', methods=['GET'])
+@login_required
+def preview_cache_stats():
+    return jsonify(conversion_cache.snapshot())
 
 @file_bp.route('/preview/<int:file_id>')
 @login_required
@@ -334,62 +510,204 @@ def preview_file_content(file_id):
     try:
         file_extension = file.filename.rsplit('.', 1)[1].lower()
         if file_extension in ['txt']:
-            return file.data.decode('utf-8')
+            # 只返回第一页，完整内容通过 /text/<id> 分页读取
+            text = TextFile(file.content_hash, current_app.config['TEXT_PREVIEW_MAX_BYTES'])
+            page = text.read_window(0, text.max_bytes)
+            return page['text'], 200, {'Content-Type': 'text/plain; charset=utf-8', 'X-Text-Encoding': text.encoding,
+                                       'X-Text-Truncated': 'true' if page['next_offset'] is not None else 'false'}
         elif file_extension in ['pdf']:
-            return send_file(io.BytesIO(file.data), mimetype='application/pdf')
+            return send_blob(file, mimetype='application/pdf')
         elif file_extension in ['png', 'jpg', 'jpeg', 'gif']:
-            return send_file(io.BytesIO(file.data), mimetype=f'image/{file_extension}')
+            return send_blob(file, mimetype=f'image/{file_extension}')
         elif file_extension in ['mp4', 'avi', 'mkv']:
-            return send_file(io.BytesIO(file.data), mimetype=f'video/{file_extension}')
+            return send_blob(file, mimetype=f'video/{file_extension}')
         elif file_extension in ['mp3']:
-            return send_file(io.BytesIO(file.data), mimetype='audio/mpeg')
+            return send_blob(file, mimetype='audio/mpeg')
         elif file_extension in ['doc', 'docx', 'xls', 'xlsx', 'ppt', 'pptx']:
-            with tempfile.NamedTemporaryFile(delete=False, suffix=f".{file_extension}") as temp_input:
-                temp_input.write(file.data)
-                temp_input_path = temp_input.name
-
-            temp_output_path = temp_input_path.rsplit('.', 1)[0] + ".pdf"
-            current_app.logger.info(f"Input file path: {temp_input_path}")
-            current_app.logger.info(f"Output file path: {temp_output_path}")
-
-            try:
-                result = subprocess.run(
-                    [LIBREOFFICE_PATH, '--headless', '--convert-to', 'pdf', '--outdir',
-                     os.path.dirname(temp_input_path), temp_input_path],
-                    check=True,
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE,
-                    text=True
-                )
-                current_app.logger.info(f"LibreOffice stdout: {result.stdout}")
-                current_app.logger.info(f"LibreOffice stderr: {result.stderr}")
-                current_app.logger.info(f"LibreOffice conversion succeeded")
-            except subprocess.CalledProcessError as e:
-                current_app.logger.error(f"LibreOffice conversion failed: {e.stderr}")
-                os.remove(temp_input_path)
-                return "Error converting file", 500
-
-            if not os.path.exists(temp_output_path):
-                current_app.logger.error(f"Converted file does not exist: {temp_output_path}")
-                os.remove(temp_input_path)
-                return "Error converting file", 500
-
-            with open(temp_output_path, 'rb') as temp_output:
-                pdf_content = temp_output.read()
-
-            os.remove(temp_input_path)
-            os.remove(temp_output_path)
-
-            return send_file(io.BytesIO(pdf_content), mimetype='application/pdf')
+            pdf_etag = f'{file.content_hash}-pdf'
+            if request.if_none_match.contains(pdf_etag):
+                response = current_app.response_class(status=304)
+                response.set_etag(pdf_etag)
+                return response
+
+            pdf_path = conversion_cache.lookup(file.content_hash, 'pdf')
+            if not pdf_path:
+                try:
+                    future = converter_pool.submit(f'{file.content_hash}:pdf',
+                                                   pdf_conversion_job(file.content_hash, file_extension))
+                except ConverterBusy:
+                    return "Converter is busy, please retry later", 503, {'Retry-After': '10'}
+                wait = request.args.get('wait', current_app.config['PREVIEW_CONVERT_WAIT'], type=float)
+                try:
+                    pdf_path = future.result(timeout=wait)
+                except FutureTimeoutError:
+                    return conversion_pending_response(file)
+                except (subprocess.CalledProcessError, ConversionTimeout, ConverterUnavailable, OSError) as e:
+                    current_app.logger.error(f"LibreOffice conversion failed: {getattr(e, 'stderr', None) or e}")
+                    return "Error converting file", 500
+
+            return send_file(pdf_path, mimetype='application/pdf', conditional=True,
+                             etag=pdf_etag, last_modified=file.updated_at)
 
         elif file_extension in ['zip', 'rar']:
-            return jsonify({'message': 'Compressed files are not supported for preview. Please download.'})
+            return archive_listing_response(file)
         else:
             return "File type not supported for preview", 415
     except Exception as e:
         current_app.logger.error(f"Error reading file: {e}")
         return "Error reading file", 500
 
+@file_bp.route('/text/<int:file_id>', methods=['GET'])
+@login_required
+def text_page(file_id):
+    file = File.query.filter_by(id=file_id, uploader_id=current_user.id, is_folder=False).first()
+    if not file or not file.content_hash:
+        return jsonify({'success': False, 'message': 'File not found'}), 404
+
+    # 按行（start_line/lines）或按字节窗口（offset/length）分页，内容不变时 ETag 不变
+    etag = f"{file.content_hash}-{request.query_string.decode('ascii', 'ignore')}"
+    if request.if_none_match.contains(etag):
+        response = current_app.response_class(status=304)
+        response.set_etag(etag)
+        return response
+
+    text = TextFile(file.content_hash, current_app.config['TEXT_PREVIEW_MAX_BYTES'])
+    if 'offset' in request.args:
+        page = text.read_window(request.args.get('offset', 0, type=int),
+                                request.args.get('length', text.max_bytes, type=int))
+    else:
+        count = min(request.args.get('lines', 200, type=int), current_app.config['TEXT_PREVIEW_MAX_LINES'])
+        page = text.read_lines(max(0, request.args.get('start_line', 0, type=int)), max(1, count))
+
+    response = jsonify(dict(page, success=True, file_id=file.id, encoding=text.encoding, size=text.size))
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+def get_archive_file(file_id):
+    file = File.query.filter_by(id=file_id, uploader_id=current_user.id, is_folder=False).first()
+    return file if file and archives.archive_type(file) else None
+
+def archive_listing_response(file):
+    # 目录只取决于压缩包内容，ETag 沿用内容哈希
+    etag = f'{file.content_hash}-members'
+    if request.if_none_match.contains(etag):
+        response = current_app.response_class(status=304)
+        response.set_etag(etag)
+        return response
+
+    try:
+        with archives.open_archive(file) as archive:
+            members = archives.list_members(archive)
+    except archives.ArchiveError as e:
+        return jsonify({'success': False, 'message': str(e)}), 422
+
+    limit = current_app.config['ARCHIVE_LIST_LIMIT']
+    response = jsonify({'success': True, 'file_id': file.id, 'total': len(members),
+                        'truncated': len(members) > limit, 'members': members[:limit]})
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+@file_bp.route('/archive/<int:file_id>', methods=['GET'])
+@login_required
+def list_archive(file_id):
+    file = get_archive_file(file_id)
+    if not file:
+        return jsonify({'success': False, 'message': 'Archive not found'}), 404
+    return archive_listing_response(file)
+
+@file_bp.route('/archive/<int:file_id>/member', methods=['GET'])
+@login_required
+def download_archive_member(file_id):
+    file = get_archive_file(file_id)
+    if not file:
+        return jsonify({'success': False, 'message': 'Archive not found'}), 404
+
+    name = request.args.get('name', '')
+    try:
+        archive = archives.open_archive(file)
+    except archives.ArchiveError as e:
+        return jsonify({'success': False, 'message': str(e)}), 422
+    info = archives.find_member(archive, name)
+    if info is None:
+        archive.close()
+        return jsonify({'success': False, 'message': 'Member not found'}), 404
+
+    # 单个成员边解压边发送，不落盘也不读取整个压缩包
+    response = current_app.response_class(stream_with_context(archives.stream_member(archive, info)),
+                                          mimetype='application/octet-stream')
+    response.content_length = info.file_size
+    set_attachment(response, name.rsplit('/', 1)[-1])
+    return response
+
+@file_bp.route('/archive/<int:file_id>/extract', methods=['POST'])
+@login_required
+def extract_archive(file_id):
+    file = get_archive_file(file_id)
+    if not file:
+        return jsonify({'success': False, 'message': 'Archive not found'}), 404
+
+    data = request.get_json(silent=True) or {}
+    target_folder_id = data.get('target_folder_id', file.parent_id)
+    selected = set(data.get('members') or [])
+    if target_folder_id is not None:
+        target_folder = File.query.filter_by(id=target_folder_id, uploader_id=current_user.id, is_folder=True).first()
+        if not target_folder:
+            return jsonify({'success': False, 'message': 'Target folder not found'}), 404
+        target_folder_id = target_folder.id
+
+    try:
+        archive = archives.open_archive(file)
+    except archives.ArchiveError as e:
+        return jsonify({'success': False, 'message': str(e)}), 422
+
+    with archive:
+        members = []
+        skipped = 0
+        for info in archive.infolist():
+            name = archives.member_name(info)
+            if info.is_dir() or (selected and name not in selected):
+                continue
+            parts = [custom_secure_filename(part) for part in archives.member_parts(name)]
+            if not parts or not all(parts) or not allowed_file(parts[-1]):
+                skipped += 1
+                continue
+            members.append((parts, info))
+
+        total_bytes = sum(info.file_size for _, info in members)
+        if len(members) > current_app.config['ARCHIVE_EXTRACT_MAX_MEMBERS'] or \
+                total_bytes > current_app.config['ARCHIVE_EXTRACT_MAX_BYTES']:
+            return jsonify({'success': False, 'message': 'Archive is too large to extract on the server'}), 413
+        if not usage.check_quota(current_user.id, total_bytes):
+            return jsonify({'success': False, 'message': 'Storage quota exceeded'}), 413
+
+        # 解压到以压缩包命名的新文件夹，同名时加 _copy 后缀
+        taken = set(db.session.scalars(select(File.filename).where(
+            File.uploader_id == current_user.id, File.parent_id == target_folder_id)))
+        folder_name = copy_name(custom_secure_filename(file.filename.rsplit('.', 1)[0]) or 'archive', taken)
+
+        ingest = BulkIngest(current_user.id, target_folder_id)
+        ingest.add_folder([folder_name])
+        for parts, info in members:
+            ingest.add_file([folder_name] + parts[:-1], parts[-1], get_file_category(parts[-1]),
+                            archives.MemberReader(archive, info))
+        try:
+            stats = ingest.run()
+        except archives.READ_ERRORS as e:
+            db.session.rollback()
+            current_app.logger.error(f'Extracting archive {file.id} failed: {e}')
+            return jsonify({'success': False, 'message': 'Archive is corrupt or encrypted'}), 422
+    db.session.commit()
+
+    stats['skipped'] += skipped
+    current_app.logger.info(f'Extracted archive {file.id}: {stats["files"]} files, {stats["folders"]} folders '
+                            f'in {stats["seconds"]}s')
+    return jsonify({'success': True, 'message': 'Archive extracted successfully',
+                    'folder_id': ingest.top_folder_ids[0] if ingest.top_folder_ids else None, 'stats': stats})
+
 @file_bp.route('/serve_file_for_download/<int:file_id>')
 @login_required
 def serve_file_for_download(file_id):
@@ -422,16 +740,12 @@ def serve_file_for_download(file_id):
     mimetype = mimetypes.get(file_extension, 'application/octet-stream')
 
     if file.is_folder:
-        temp_dir = tempfile.mkdtemp()
-        zip_path = os.path.join(temp_dir, f"{file.filename}.zip")
-        with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-            add_folder_to_zip(file, zipf, file.filename)
-        return send_file(zip_path, as_attachment=True, download_name=f"{file.filename}.zip", mimetype='application/zip')
+        return zip_response(collect_zip_entries(file, file.filename), f"{file.filename}.zip")
 
     if file_extension == 'rar':
-        return send_file(io.BytesIO(file.data), download_name=file.filename, as_attachment=True, mimetype=mimetype)
+        return send_blob(file, download_name=file.filename, as_attachment=True, mimetype=mimetype)
 
-    return send_file(io.BytesIO(file.data), download_name=file.filename, as_attachment=True, mimetype=mimetype)
+    return send_blob(file, download_name=file.filename, as_attachment=True, mimetype=mimetype)
 
 @file_bp.route('/download', methods=['POST'])
 @login_required
@@ -445,24 +759,94 @@ def download_files():
     if not files:
         return jsonify({'success': False, 'message': 'No files found or insufficient permissions'}), 404
 
-    temp_dir = tempfile.mkdtemp()
-    zip_path = os.path.join(temp_dir, "files.zip")
-    with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-        for file in files:
-            if file.is_folder:
-                add_folder_to_zip(file, zipf, file.filename)
-            else:
-                zipf.writestr(file.filename, file.data)
+    entries = []
+    for file in files:
+        if file.is_folder:
+            entries.extend(collect_zip_entries(file, file.filename))
+        else:
+            entries.append(file_zip_entry(file, file.filename))
 
-    return send_file(zip_path, as_attachment=True, download_name="files.zip", mimetype='application/zip')
+    return zip_response(entries, "files.zip")
 
 @file_bp.route('/get_folders', methods=['GET'])
+@listing_cache.cached
 @login_required
 def get_folders():
     folders = File.query.filter_by(uploader_id=current_user.id, is_folder=True).all()
     folder_list = [{'id': folder.id, 'filename': folder.filename, 'is_favorite_folder': folder.is_favorite_folder} for folder in folders]
     return jsonify(folder_list)
 
+MAX_TREE_DEPTH = 5
+MAX_TREE_NODES = 5000
+
+def child_folders_query(user_id, parent_ids, prefix=None, include_favorites=False):
+    parent_filter = File.parent_id.in_([parent_id for parent_id in parent_ids if parent_id is not None])
+    if None in parent_ids:
+        parent_filter = db.or_(parent_filter, File.parent_id == None)
+    query = File.query.filter(File.uploader_id == user_id, File.is_folder == True, parent_filter)
+    if not include_favorites:
+        query = query.filter(File.is_favorite_folder == False)
+    if prefix:
+        # 用范围条件代替 LIKE，前缀过滤可以走 (uploader_id, parent_id, is_folder, filename) 索引
+        query = query.filter(File.filename >= prefix, File.filename < prefix + '\U0010ffff')
+    return query.order_by(File.parent_id, File.filename, File.id)
+
+def child_folder_counts(user_id, folder_ids):
+    if not folder_ids:
+        return {}
+    return dict(db.session.query(File.parent_id, db.func.count()).filter(
+        File.uploader_id == user_id, File.is_folder == True, File.parent_id.in_(folder_ids)
+    ).group_by(File.parent_id).all())
+
+@file_bp.route('/folder_tree', methods=['GET'])
+@listing_cache.cached
+@login_required
+def folder_tree():
+    parent_id = request.args.get('parent_id', type=int)
+    depth = max(1, min(request.args.get('depth', 1, type=int), MAX_TREE_DEPTH))
+    prefix = request.args.get('prefix', '').strip() or None
+    include_favorites = request.args.get('include_favorites') == 'true'
+
+    if parent_id is not None:
+        parent = File.query.filter_by(id=parent_id, uploader_id=current_user.id, is_folder=True).first()
+        if not parent:
+            return jsonify({'success': False, 'message': '未找到文件夹或权限不足'}), 404
+
+    # 每展开一层只执行两条查询：取子文件夹、统计它们各自的子文件夹数
+    roots = []
+    nodes = {parent_id: {'children': roots}}
+    level_ids = [parent_id]
+    total = 0
+    truncated = False
+    for level in range(depth):
+        # 前缀只过滤请求的这一层，展开的下级显示完整内容
+        query = child_folders_query(current_user.id, level_ids, prefix if level == 0 else None,
+                                    include_favorites and level == 0 and parent_id is None)
+        folders = query.limit(MAX_TREE_NODES - total + 1).all()
+        if total + len(folders) > MAX_TREE_NODES:
+            folders = folders[:MAX_TREE_NODES - total]
+            truncated = True
+        counts = child_folder_counts(current_user.id, [folder.id for folder in folders])
+        for folder in folders:
+            node = {
+                'id': folder.id,
+                'filename': folder.filename,
+                'parent_id': folder.parent_id,
+                'is_favorite_folder': folder.is_favorite_folder,
+                'child_count': counts.get(folder.id, 0),
+                'has_children': counts.get(folder.id, 0) > 0,
+            }
+            if level + 1 < depth:
+                node['children'] = []
+            nodes[folder.parent_id]['children'].append(node)
+            nodes[folder.id] = node
+        total += len(folders)
+        level_ids = [folder.id for folder in folders if counts.get(folder.id)]
+        if truncated or not level_ids:
+            break
+
+    return jsonify({'success': True, 'parent_id': parent_id, 'folders': roots, 'truncated': truncated})
+
 @file_bp.route('/move', methods=['POST'])
 @login_required
 def move_files():
@@ -483,10 +867,8 @@ def move_files():
         return jsonify({'success': False, 'message': 'No files found or insufficient permissions'}), 404
 
     for file in files:
-        if file.is_folder:
-            subfolder_ids = get_subfolder_ids(file.id)
-            current_app.logger.info(f'Subfolder IDs for file {file.id}: {subfolder_ids}')
-            if file.id == target_folder_id or target_folder_id in subfolder_ids:
+        if file.is_folder and target_folder_id is not None:
+            if tree.is_descendant(target_folder_id, file.id):
                 current_app.logger.error('Cannot move folder into itself or its subfolder')
                 return jsonify({'success': False, 'message': 'Cannot move folder into itself or its subfolder'}), 400
 
@@ -499,9 +881,11 @@ def move_files():
             else:
                 new_favorite = Favorite(file_id=file.id, folder_id=target_folder_id)
                 db.session.add(new_favorite)
-        else:
-            file.parent_id = target_folder_id if target_folder_id is not None else None
-            db.session.add(file)
+            # 只修改了 Favorite 行，File 没有变化，需要手动让列表缓存失效
+            listing_cache.touch(current_user.id)
+        elif file.parent_id != target_folder_id:
+            file.parent_id = target_folder_id
+            tree.move_subtree(file.id, target_folder_id)
 
     db.session.commit()
 
@@ -513,52 +897,136 @@ def move_files():
     current_app.logger.info(f'Files moved successfully to folder: {target_folder_name}')
     return jsonify({'success': True, 'message': 'Files moved successfully', 'target_folder_name': target_folder_name})
 
-def get_subfolder_ids(folder_id):
-    subfolder_ids = []
-    subfolders = File.query.filter_by(parent_id=folder_id).all()
-    for subfolder in subfolders:
-        subfolder_ids.append(subfolder.id)
-        subfolder_ids.extend(get_subfolder_ids(subfolder.id))
-    return subfolder_ids
+def copy_name(filename, taken):
+    if filename not in taken:
+        return filename
+    stem, dot, extension = filename.rpartition('.')
+    if not stem:
+        stem, dot, extension = filename, '', ''
+    number = 1
+    while True:
+        candidate = f"{stem}_copy{number if number > 1 else ''}{dot}{extension}"
+        if candidate not in taken:
+            return candidate
+        number += 1
+
+@file_bp.route('/copy', methods=['POST'])
+@login_required
+def copy_files():
+    data = request.get_json()
+    file_ids = data.get('file_ids', [])
+    target_folder_id = data.get('target_folder_id')
+
+    if not file_ids:
+        return jsonify({'success': False, 'message': 'No files selected for copying'}), 400
+
+    files = File.query.filter(File.id.in_(file_ids), File.uploader_id == current_user.id,
+                              File.is_favorite_folder == False).order_by(File.id).all()
+    if not files:
+        return jsonify({'success': False, 'message': 'No files found or insufficient permissions'}), 404
+
+    if target_folder_id is not None:
+        target_folder = File.query.filter_by(id=target_folder_id, uploader_id=current_user.id, is_folder=True).first()
+        if not target_folder:
+            return jsonify({'success': False, 'message': 'Target folder not found'}), 404
+        for file in files:
+            if file.is_folder and tree.is_descendant(target_folder_id, file.id):
+                return jsonify({'success': False, 'message': 'Cannot copy folder into itself or its subfolder'}), 400
+
+    # 副本不占用额外的存储空间，但计入用户的用量和配额
+    copied_bytes = db.session.scalar(select(func.coalesce(func.sum(File.size), 0)).where(
+        File.id.in_(tree.subtree_ids_query([file.id for file in files]))))
+    if not usage.check_quota(current_user.id, copied_bytes):
+        return jsonify({'success': False, 'message': 'Storage quota exceeded'}), 413
+
+    # 目标位置已有同名项时，副本名加 _copy 后缀
+    taken = set(db.session.scalars(select(File.filename).where(
+        File.uploader_id == current_user.id, File.parent_id == target_folder_id)))
+    roots = {}
+    for file in files:
+        roots[file.id] = copy_name(file.filename, taken)
+        taken.add(roots[file.id])
+
+    new_ids = tree.copy_subtrees(roots, target_folder_id)
+    db.session.commit()
+
+    current_app.logger.info(f'Copied {len(new_ids)} items to folder ID: {target_folder_id}')
+    return jsonify({'success': True, 'message': 'Files copied successfully', 'file_ids': new_ids})
 
 @file_bp.route('/get_subfolders/<int:folder_id>', methods=['GET'])
 @login_required
 def get_subfolders(folder_id):
-    def fetch_subfolder_ids(folder_id):
-        subfolder_ids = []
-        subfolders = File.query.filter_by(parent_id=folder_id).all()
-        for subfolder in subfolders:
-            subfolder_ids.append(subfolder.id)
-            subfolder_ids.extend(fetch_subfolder_ids(subfolder.id))
-        return subfolder_ids
-
     folder = File.query.filter_by(id=folder_id, uploader_id=current_user.id).first()
     if not folder or not folder.is_folder:
         return jsonify({'success': False, 'message': '未找到文件夹或权限不足'}), 404
 
-    subfolder_ids = fetch_subfolder_ids(folder.id)
+    subfolder_ids = tree.descendant_ids(folder.id)
     return jsonify({'success': True, 'subfolder_ids': subfolder_ids})
 
+EXPORT_FORMATS = {'txt': 'text/plain', 'csv': 'text/csv', 'json': 'application/json'}
+EXPORT_BATCH_SIZE = 1000
+
+def export_rows(user_id):
+    # 递归 CTE 在数据库中一次算出全部完整路径，按路径排序后分批流式读取
+    child = aliased(File)
+    # 锚点列转为 Text，PostgreSQL 要求递归两侧类型一致
+    paths = select(File.id, cast(File.filename, Text).label('path'), File.is_folder, File.size, File.updated_at).where(
+        File.uploader_id == user_id, File.parent_id == None
+    ).cte('paths', recursive=True)
+    paths = paths.union_all(
+        select(child.id, paths.c.path + '/' + child.filename, child.is_folder, child.size, child.updated_at)
+        .where(child.uploader_id == user_id, child.parent_id == paths.c.id)
+    )
+    return db.session.execute(select(paths).order_by(paths.c.path).execution_options(yield_per=EXPORT_BATCH_SIZE))
+
+def export_lines(rows, export_format):
+    if export_format == 'csv':
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        # 带 BOM，Excel 打开中文路径不会乱码
+        buffer.write('\ufeff')
+        writer.writerow(['id', 'path', 'type', 'size', 'updated_at'])
+        for partition in rows.partitions():
+            for row in partition:
+                writer.writerow([row.id, row.path, 'folder' if row.is_folder else 'file', row.size or '',
+                                 row.updated_at.isoformat() + 'Z' if row.updated_at else ''])
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        yield buffer.getvalue()
+    elif export_format == 'json':
+        separator = '[\n'
+        for partition in rows.partitions():
+            chunk = []
+            for row in partition:
+                chunk.append(separator + json.dumps({
+                    'id': row.id,
+                    'path': row.path,
+                    'is_folder': bool(row.is_folder),
+                    'size': row.size,
+                    'updated_at': row.updated_at.isoformat() + 'Z' if row.updated_at else None
+                }, ensure_ascii=False))
+                separator = ',\n'
+            yield ''.join(chunk)
+        yield '[]\n' if separator == '[\n' else '\n]\n'
+    else:
+        for partition in rows.partitions():
+            yield ''.join(f'{row.path} (ID: {row.id})\n' for row in partition)
+
 @file_bp.route('/export_directory', methods=['GET'])
 @login_required
 def export_directory():
-    files = File.query.filter_by(uploader_id=current_user.id).all()
-    file_structure = []
-
-    for file in files:
-        path = build_file_path(file)
-        file_structure.append(f'{path} (ID: {file.id})')
-
-    file_structure_str = "\n".join(file_structure)
-    return send_file(io.BytesIO(file_structure_str.encode('utf-8')), download_name='file_structure.txt',
-                     as_attachment=True)
-
-def build_file_path(file):
-    parent = file.parent_id
-    if parent:
-        parent_file = File.query.get(parent)
-        return parent_file.filename if parent_file else '单独上传'
-    return '单独上传'
+    export_format = request.args.get('format', 'txt')
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({'success': False, 'message': 'Unsupported export format'}), 400
+
+    user_id = current_user.id
+    response = current_app.response_class(
+        stream_with_context(export_lines(export_rows(user_id), export_format)),
+        mimetype=EXPORT_FORMATS[export_format]
+    )
+    response.headers['Content-Disposition'] = f'attachment; filename=file_structure.{export_format}'
+    return response
 
 @file_bp.route('/rename', methods=['POST'])
 @login_required
@@ -652,6 +1120,7 @@ def add_to_favorites():
             new_favorite = Favorite(file_id=file.id, folder_id=folder.id)
             db.session.add(new_favorite)
 
+    listing_cache.touch(current_user.id)
     db.session.commit()
 
     current_app.logger.info(f'文件已添加到收藏夹: {file_ids} 到收藏夹 {folder_id}')
@@ -662,32 +1131,79 @@ def add_to_favorites():
 def search_files():
     filename_query = request.args.get('filename', '').strip()
     tags_query = request.args.get('tags', '').strip()
-
-    filters = [File.is_favorite_folder == False]
-
-    if filename_query:
-        filters.append(File.filename.ilike(f"%{filename_query}%"))
-    if tags_query:
-        filters.append(File.tags.ilike(f"%{tags_query}%"))
-
-    if not filters:
-        return jsonify([])
-
-    files = File.query.filter(db.and_(*filters), File.uploader_id == current_user.id).all()
-
-    def build_file_dict(file):
+    text_query = request.args.get('q', '').strip()
+    page = max(1, request.args.get('page', 1, type=int))
+    per_page = max(1, min(request.args.get('per_page', 50, type=int), MAX_PAGE_SIZE))
+    offset = (page - 1) * per_page
+
+    query = listing_query().filter(File.uploader_id == current_user.id, File.is_favorite_folder == False)
+    file_ids = None
+    if filename_query or tags_query or text_query:
+        file_ids = search_index.search(current_user.id, text_query, filename_query, tags_query, per_page, offset)
+
+    if file_ids is not None:
+        # 结果按索引给出的相关度排序
+        rank = {file_id: position for position, file_id in enumerate(file_ids)}
+        rows = sorted(query.filter(File.id.in_(file_ids)).all(), key=lambda row: rank[row[0].id])
+    else:
+        # 未输入条件时列出全部文件；数据库不支持全文索引时退回到 LIKE 查询
+        if filename_query:
+            query = query.filter(File.filename.ilike(f"%{filename_query}%"))
+        if tags_query:
+            query = query.filter(File.tags.ilike(f"%{tags_query}%"))
+        if text_query:
+            query = query.filter(db.or_(File.filename.ilike(f"%{text_query}%"), File.tags.ilike(f"%{text_query}%")))
+        rows = query.order_by(File.id).limit(per_page).offset(offset).all()
+
+    def build_file_dict(row):
+        file, parent_name, is_favorite = row
         file_dict = {
             'id': file.id,
             'filename': file.filename,
             'is_folder': file.is_folder,
             'created_at': file.created_at,
             'tags': file.tags,
-            'is_favorite': Favorite.query.filter_by(file_id=file.id).first() is not None,
-            'source': build_file_path(file)
+            'is_favorite': bool(is_favorite),
+            'source': parent_name if parent_name is not None else '单独上传'
         }
         return file_dict
 
-    return jsonify([build_file_dict(file) for file in files])
+    return jsonify([build_file_dict(row) for row in rows])
+
+@file_bp.route('/tags', methods=['GET'])
+@login_required
+def tag_list():
+    return jsonify([{'name': tag.name, 'file_count': tag.file_count} for tag in tagging.tag_counts(current_user.id)])
+
+@file_bp.route('/tags/files', methods=['GET'])
+@login_required
+def files_by_tags():
+    all_tags = tagging.parse_tags(request.args.get('all'))
+    any_tags = tagging.parse_tags(request.args.get('any'))
+    none_tags = tagging.parse_tags(request.args.get('none'))
+    sort = request.args.get('sort', 'created_at')
+    descending = request.args.get('order', 'asc') == 'desc'
+    limit = request.args.get('limit', type=int)
+    cursor = request.args.get('cursor')
+
+    if not (all_tags or any_tags or none_tags):
+        return jsonify({'success': False, 'message': 'No tags provided'}), 400
+    if sort not in SORT_COLUMNS:
+        return jsonify({'success': False, 'message': f'Unsupported sort: {sort}'}), 400
+    if limit is not None:
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+
+    query = listing_query().filter(File.uploader_id == current_user.id, File.is_favorite_folder == False)
+    query = tagging.filter_by_tags(query, current_user.id, all_tags, any_tags, none_tags)
+    try:
+        rows, next_cursor = paginate(query, SORT_COLUMNS[sort], sort, descending, limit, cursor)
+    except (ValueError, TypeError):
+        return jsonify({'success': False, 'message': 'Invalid cursor'}), 400
+
+    response = jsonify([listing_dict(row) for row in rows])
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response
 
 @file_bp.route('/remove_from_favorites', methods=['POST'])
 @login_required
@@ -703,6 +1219,7 @@ def remove_from_favorites():
         if favorite:
             db.session.delete(favorite)
 
+    listing_cache.touch(current_user.id)
     db.session.commit()
     return jsonify({'success': True, 'message': '文件已移出收藏夹'})
 
@@ -719,16 +1236,8 @@ def delete_favorite_folder_and_contents():
     if not folder:
         return jsonify({'success': False, 'message': '未找到收藏夹或权限不足'}), 404
 
-    def delete_folder_and_contents(folder):
-        sub_files = File.query.filter_by(parent_id=folder.id).all()
-        for sub_file in sub_files:
-            delete_folder_and_contents(sub_file)
-        favorites = Favorite.query.filter_by(file_id=folder.id).all()
-        for favorite in favorites:
-            db.session.delete(favorite)
-        db.session.delete(folder)
-
-    delete_folder_and_contents(folder)
+    tree.delete_subtrees([folder.id])
+    listing_cache.touch(current_user.id)
     db.session.commit()
 
     return jsonify({'success': True, 'message': '收藏夹及其内容删除成功'})
\ No newline at end of file
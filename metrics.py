@@ -0,0 +1,210 @@
+import time
+import logging
+import threading
+from flask import g, request, has_app_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+SLOW_QUERY_LIMIT = 200
+
+
+def _label_text(names, values):
+    if not names:
+        return ''
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+class Counter:
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} counter']
+        with self.lock:
+            for label_values, value in sorted(self.values.items()):
+                lines.append(f'{self.name}{_label_text(self.labels, label_values)} {value}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, labels=(), buckets=DURATION_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = buckets
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self.lock:
+            state = self.values.get(label_values)
+            if state is None:
+                state = self.values[label_values] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        names = self.labels + ('le',)
+        with self.lock:
+            for label_values, (counts, total, count) in sorted(self.values.items()):
+                for bound, bucket_count in zip(self.buckets, counts):
+                    lines.append(f'{self.name}_bucket{_label_text(names, label_values + (bound,))} {bucket_count}')
+                lines.append(f'{self.name}_bucket{_label_text(names, label_values + ("+Inf",))} {count}')
+                lines.append(f'{self.name}_sum{_label_text(self.labels, label_values)} {total}')
+                lines.append(f'{self.name}_count{_label_text(self.labels, label_values)} {count}')
+        return lines
+
+
+class Metrics:
+    # 请求耗时、SQL 语句数与耗时、收发字节数，以 Prometheus 文本格式导出
+    def __init__(self, app=None):
+        self.request_duration = Histogram('clouddrive_http_request_duration_seconds',
+                                          'Time until the response headers are ready', ('endpoint', 'method'))
+        self.requests = Counter('clouddrive_http_requests_total', 'Handled requests',
+                                ('endpoint', 'method', 'status'))
+        self.request_bytes = Counter('clouddrive_http_request_bytes_total', 'Request body bytes', ('endpoint',))
+        self.response_bytes = Counter('clouddrive_http_response_bytes_total', 'Response body bytes sent',
+                                      ('endpoint',))
+        self.sql_statements = Histogram('clouddrive_sql_statements_per_request', 'SQL statements per request',
+                                        ('endpoint',), COUNT_BUCKETS)
+        self.sql_seconds = Counter('clouddrive_sql_seconds_total', 'Time spent in SQL statements', ('endpoint',))
+        self.conversion_duration = Histogram('clouddrive_conversion_duration_seconds',
+                                             'External converter run time', ('converter', 'outcome'))
+        self.collectors = {}
+        self.logger = logging.getLogger(__name__)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.slow_request_seconds = app.config['SLOW_REQUEST_SECONDS']
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+        app.add_url_rule('/metrics', 'metrics', self.metrics_view)
+        app.extensions['metrics'] = self
+
+    def add_collector(self, name, collector):
+        # collector 返回 [(name, type, help, value)]，抓取时读取各组件的即时状态；
+        # 按名称登记，多次 create_app 时替换而不是重复导出
+        self.collectors[name] = collector
+
+    def add_snapshot(self, prefix, snapshot, counters=()):
+        # 把组件 snapshot() 中的数值项导出为指标，counters 中的键按计数器导出，其余为 gauge
+        def collect():
+            for key, value in snapshot().items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    metric_type = 'counter' if key in counters else 'gauge'
+                    suffix = '_total' if key in counters else ''
+                    yield f'clouddrive_{prefix}_{key}{suffix}', metric_type, f'{prefix} {key}', value
+        self.add_collector(prefix, collect)
+
+    def _before_request(self):
+        g.metrics_started = time.perf_counter()
+        g.sql_count = 0
+        g.sql_seconds = 0.0
+        g.sql_queries = [] if self.slow_request_seconds is not None else None
+
+    def _after_request(self, response):
+        endpoint = self._record(response.status_code)
+        if endpoint is None:
+            return response
+        if response.content_length is not None:
+            self.response_bytes.inc(endpoint, amount=response.content_length)
+        elif response.is_streamed:
+            # 长度未知的流式响应（ZIP 打包、导出）在发送过程中累计字节数
+            response.response = self._count_bytes(response.response, endpoint)
+        return response
+
+    def _teardown_request(self, exception):
+        # 未处理的异常直接抛出时（调试和测试模式）不会经过 after_request，在此按 500 记录
+        self._record(500)
+
+    def _record(self, status_code):
+        started = g.pop('metrics_started', None)
+        if started is None:
+            return None
+        elapsed = time.perf_counter() - started
+        endpoint = request.endpoint or 'unmatched'
+        self.request_duration.observe(elapsed, endpoint, request.method)
+        self.requests.inc(endpoint, request.method, status_code)
+        self.request_bytes.inc(endpoint, amount=request.content_length or 0)
+        self.sql_statements.observe(g.sql_count, endpoint)
+        self.sql_seconds.inc(endpoint, amount=g.sql_seconds)
+
+        if self.slow_request_seconds is not None and elapsed >= self.slow_request_seconds:
+            queries = '\n'.join(f'  {seconds * 1000:.1f}ms {statement}' for statement, seconds in g.sql_queries)
+            self.logger.warning(f'Slow request {request.method} {request.full_path.rstrip("?")} -> {status_code} '
+                                f'in {elapsed:.3f}s, {g.sql_count} SQL statements ({g.sql_seconds:.3f}s)\n{queries}')
+        return endpoint
+
+    def _count_bytes(self, iterable, endpoint):
+        try:
+            for chunk in iterable:
+                # 流式生成器可能产出 str，由 Werkzeug 按 UTF-8 编码后发送，按编码后的字节计数
+                self.response_bytes.inc(endpoint, amount=len(chunk.encode('utf-8') if isinstance(chunk, str) else chunk))
+                yield chunk
+        finally:
+            if hasattr(iterable, 'close'):
+                iterable.close()
+
+    def record_query(self, statement, seconds):
+        if not has_app_context() or 'sql_count' not in g:
+            return
+        g.sql_count += 1
+        g.sql_seconds += seconds
+        if g.sql_queries is not None and len(g.sql_queries) < SLOW_QUERY_LIMIT:
+            g.sql_queries.append((' '.join(statement.split()), seconds))
+
+    def render(self):
+        lines = []
+        for metric in (self.request_duration, self.requests, self.request_bytes, self.response_bytes,
+                       self.sql_statements, self.sql_seconds, self.conversion_duration):
+            lines.extend(metric.render())
+        for collector in self.collectors.values():
+            for name, metric_type, help_text, value in collector():
+                if value is None:
+                    continue
+                lines.extend([f'# HELP {name} {help_text}', f'# TYPE {name} {metric_type}', f'{name} {value}'])
+        return '\n'.join(lines) + '\n'
+
+    def metrics_view(self):
+        return self.render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+
+metrics = Metrics()
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def stop_query_timer(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info['query_started'].pop()
+    metrics.record_query(statement, time.perf_counter() - started)
+
+
+@event.listens_for(Engine, 'handle_error')
+def discard_query_timer(exception_context):
+    connection = exception_context.connection
+    if connection is not None and connection.info.get('query_started'):
+        connection.info['query_started'].pop()
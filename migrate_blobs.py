@@ -0,0 +1,43 @@
+import io
+import logging
+from app import create_app
+from config import Config
+from extensions import db
+from models import File
+from storage import store_upload
+
+BATCH_SIZE = 100
+
+
+def migrate_blobs(config_class=Config):
+    # create_app 会先为旧库的 files 表补上 content_hash/size 列和索引
+    app = create_app(config_class)
+
+    logging.basicConfig(level=logging.INFO)
+    logger = logging.getLogger(__name__)
+
+    with app.app_context():
+        migrated = 0
+        while True:
+            # 每批只加载少量旧行的 data，避免一次性读入全部 BLOB
+            files = File.query.options(db.undefer(File.data)).filter(
+                File.is_folder == False, File.content_hash == None, File.data != None
+            ).limit(BATCH_SIZE).all()
+            if not files:
+                break
+            try:
+                for file in files:
+                    file.content_hash, file.size = store_upload(io.BytesIO(file.data))
+                    file.data = None
+                db.session.commit()
+            except Exception as e:
+                logger.error(f"An error occurred: {e}")
+                db.session.rollback()
+                raise
+            migrated += len(files)
+            logger.info(f"Migrated {migrated} files to blob store")
+        return migrated
+
+
+if __name__ == '__main__':
+    migrate_blobs()
@@ -0,0 +1,18 @@
+import logging
+from app import create_app
+from tagging import migrate_legacy_tags
+
+
+def migrate_tags():
+    app = create_app()
+
+    logging.basicConfig(level=logging.INFO)
+    logger = logging.getLogger(__name__)
+
+    with app.app_context():
+        migrated = migrate_legacy_tags()
+        logger.info(f"Migrated tags for {migrated} files")
+
+
+if __name__ == '__main__':
+    migrate_tags()
@@ -6,32 +6,158 @@ class File(db.Model):
     __tablename__ = 'files'
     id = db.Column(db.Integer, primary_key=True)
     filename = db.Column(db.String(255), nullable=False)
-    data = db.Column(db.LargeBinary, nullable=True)
+    # 仅用于旧数据迁移（migrate_blobs.py），新内容存放在 BlobStore 中
+    data = db.deferred(db.Column(db.LargeBinary, nullable=True))
+    content_hash = db.Column(db.String(64), nullable=True, index=True)
+    size = db.Column(db.BigInteger, nullable=True)
     uploader_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     category = db.Column(db.String(50), nullable=True)
     tags = db.Column(db.String(255), nullable=True)
     is_folder = db.Column(db.Boolean, default=False)
-    parent_id = db.Column(db.Integer, db.ForeignKey('files.id'), nullable=True)
+    parent_id = db.Column(db.Integer, db.ForeignKey('files.id'), nullable=True, index=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     is_favorite_folder = db.Column(db.Boolean, default=False)
 
     parent = db.relationship('File', remote_side=[id], backref='children')
 
+    __table_args__ = (
+        db.Index('ix_files_uploader_parent', 'uploader_id', 'parent_id', 'filename'),
+        # 目录树按父节点取子文件夹，文件夹较少而文件很多时无需扫描文件行
+        db.Index('ix_files_uploader_parent_folder', 'uploader_id', 'parent_id', 'is_folder', 'filename'),
+        db.Index('ix_files_uploader_category', 'uploader_id', 'category'),
+    )
+
     def to_dict(self):
         return {
             'id': self.id,
             'filename': self.filename,
             'uploader_id': self.uploader_id,
             'category': self.category,
+            'size': self.size,
             'tags': self.tags,
             'is_folder': self.is_folder,
             'parent_id': self.parent_id,
             'created_at': self.created_at.isoformat() + 'Z',
             'updated_at': self.updated_at.isoformat() + 'Z',
-            'is_favorite_folder': self.is_favorite_folder
+            'is_favorite_folder': self.is_favorite_folder,
+            'thumbnails': self.thumbnail_urls()
         }
 
+    def thumbnail_urls(self):
+        if self.category != 'images' or not self.content_hash:
+            return None
+        from thumbnails import VARIANTS
+        # 地址带上内容哈希，内容变化后地址随之变化，浏览器可以长期缓存
+        return {variant: f'/file_management/thumbnail/{self.id}/{variant}?v={self.content_hash[:16]}'
+                for variant in VARIANTS}
+
+
+class FileClosure(db.Model):
+    # 祖先/后代闭包表，每个节点含一条 depth=0 的自身记录
+    __tablename__ = 'file_closure'
+    ancestor_id = db.Column(db.Integer, db.ForeignKey('files.id', ondelete='CASCADE'), primary_key=True)
+    descendant_id = db.Column(db.Integer, db.ForeignKey('files.id', ondelete='CASCADE'), primary_key=True, index=True)
+    depth = db.Column(db.Integer, nullable=False)
+
+
+class Blob(db.Model):
+    __tablename__ = 'blobs'
+    hash = db.Column(db.String(64), primary_key=True)
+    size = db.Column(db.BigInteger, nullable=False)
+    ref_count = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class FileVersion(db.Model):
+    __tablename__ = 'file_versions'
+    id = db.Column(db.Integer, primary_key=True)
+    file_id = db.Column(db.Integer, db.ForeignKey('files.id', ondelete='CASCADE'), nullable=False)
+    version = db.Column(db.Integer, nullable=False)
+    # 整个版本内容的哈希；内容本身按块存放在 version_chunks 引用的 Blob 中
+    content_hash = db.Column(db.String(64), nullable=False)
+    size = db.Column(db.BigInteger, nullable=False)
+    # 为空表示尚未分块，此时版本持有 content_hash 对应 Blob 的一个引用
+    chunk_count = db.Column(db.Integer, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.UniqueConstraint('file_id', 'version', name='uq_file_versions_file_version'),
+    )
+
+    def to_dict(self):
+        return {
+            'version': self.version,
+            'size': self.size,
+            'chunks': self.chunk_count,
+            'created_at': self.created_at.isoformat() + 'Z',
+        }
+
+
+class VersionChunk(db.Model):
+    __tablename__ = 'version_chunks'
+    version_id = db.Column(db.Integer, db.ForeignKey('file_versions.id', ondelete='CASCADE'), primary_key=True)
+    seq = db.Column(db.Integer, primary_key=True)
+    chunk_hash = db.Column(db.String(64), nullable=False, index=True)
+    size = db.Column(db.Integer, nullable=False)
+
+
+class UploadSession(db.Model):
+    __tablename__ = 'upload_sessions'
+    id = db.Column(db.String(32), primary_key=True)
+    uploader_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    filename = db.Column(db.String(255), nullable=False)
+    # 不设外键：目标文件夹可能在上传过程中被删除，完成时再校验
+    parent_id = db.Column(db.Integer, nullable=True)
+    tags = db.Column(db.String(255), nullable=True)
+    size = db.Column(db.BigInteger, nullable=False)
+    chunk_size = db.Column(db.Integer, nullable=False)
+    sha256 = db.Column(db.String(64), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    @property
+    def total_chunks(self):
+        return max(1, -(-self.size // self.chunk_size))
+
+    def chunk_length(self, index):
+        return min(self.chunk_size, self.size - index * self.chunk_size)
+
+
+class Tag(db.Model):
+    __tablename__ = 'tags'
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    name = db.Column(db.String(64), nullable=False)
+    # 增量维护的文件计数，标签统计无需扫描 file_tags
+    file_count = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (db.UniqueConstraint('user_id', 'name', name='uq_tags_user_name'),)
+
+
+class FileTag(db.Model):
+    __tablename__ = 'file_tags'
+    file_id = db.Column(db.Integer, db.ForeignKey('files.id', ondelete='CASCADE'), primary_key=True)
+    tag_id = db.Column(db.Integer, db.ForeignKey('tags.id', ondelete='CASCADE'), primary_key=True, index=True)
+
+
+class UserUsage(db.Model):
+    # 增量维护的用户用量汇总，由 usage.py 在同一事务中更新，reconcile_usage.py 可全量重建
+    __tablename__ = 'user_usage'
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    bytes = db.Column(db.BigInteger, nullable=False, default=0)
+    files = db.Column(db.Integer, nullable=False, default=0)
+    folders = db.Column(db.Integer, nullable=False, default=0)
+    # 为空时使用配置中的 STORAGE_QUOTA_BYTES
+    quota_bytes = db.Column(db.BigInteger, nullable=True)
+
+
+class CategoryUsage(db.Model):
+    __tablename__ = 'category_usage'
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    category = db.Column(db.String(50), primary_key=True)
+    files = db.Column(db.Integer, nullable=False, default=0)
+    bytes = db.Column(db.BigInteger, nullable=False, default=0)
+
 
 class User(db.Model, UserMixin):
     __tablename__ = 'user'
@@ -43,8 +169,8 @@ class User(db.Model, UserMixin):
 class Favorite(db.Model):
     __tablename__ = 'favorites'
     id = db.Column(db.Integer, primary_key=True)
-    file_id = db.Column(db.Integer, db.ForeignKey('files.id'), nullable=False)
-    folder_id = db.Column(db.Integer, db.ForeignKey('files.id'), nullable=False)
+    file_id = db.Column(db.Integer, db.ForeignKey('files.id'), nullable=False, index=True)
+    folder_id = db.Column(db.Integer, db.ForeignKey('files.id'), nullable=False, index=True)
 
     file = db.relationship('File', foreign_keys=[file_id], backref=db.backref('favorites', cascade='all, delete-orphan'))
     folder = db.relationship('File', foreign_keys=[folder_id], backref=db.backref('favorite_folders', cascade='all, delete-orphan'))
@@ -0,0 +1,185 @@
+import os
+import time
+import hashlib
+import logging
+import threading
+from concurrent.futures import Future
+
+# 查询转换器版本失败后的重试间隔
+VERSION_RETRY_SECONDS = 60
+
+
+class ConverterUnavailable(Exception):
+    pass
+
+
+class ConversionCache:
+    # 以源内容哈希和转换器版本为键缓存转换结果，按最近访问时间淘汰
+    def __init__(self, app=None):
+        self.root = None
+        self.max_bytes = 0
+        self.version = None
+        self.version_provider = None
+        self.version_resolving = False
+        self.version_retry_at = 0
+        self.lock = threading.Lock()
+        self.inflight = {}
+        self.total_bytes = 0
+        self.stats = {'hits': 0, 'misses': 0, 'coalesced': 0, 'evictions': 0, 'failures': 0}
+        self.logger = logging.getLogger(__name__)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.root = app.config['PREVIEW_CACHE_PATH'] or os.path.join(app.config['BLOB_STORAGE_PATH'], 'previews')
+        self.max_bytes = app.config['PREVIEW_CACHE_MAX_BYTES']
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        self.total_bytes = sum(size for _, _, size in self._entries())
+        app.extensions['conversion_cache'] = self
+
+    @property
+    def tmp_dir(self):
+        return os.path.join(self.root, 'tmp')
+
+    def resolve_version(self):
+        # 查询版本要启动一次 soffice，放到后台线程执行；失败时不记录结果，稍后重试
+        with self.lock:
+            if self.version is not None or self.version_provider is None or self.version_resolving \
+                    or time.monotonic() < self.version_retry_at:
+                return
+            self.version_resolving = True
+        threading.Thread(target=self._resolve_version, name='converter-version', daemon=True).start()
+
+    def _resolve_version(self):
+        try:
+            self._query_version()
+        finally:
+            with self.lock:
+                self.version_resolving = False
+
+    def _query_version(self):
+        version = None
+        try:
+            version = self.version_provider()
+        except Exception as e:
+            self.logger.warning(f'Converter version lookup failed: {e}')
+        with self.lock:
+            if version:
+                self.version = version
+            else:
+                self.version_retry_at = time.monotonic() + VERSION_RETRY_SECONDS
+        return version
+
+    def ensure_version(self):
+        # 在转换线程中同步查询，写入缓存前必须知道版本
+        if self.version is None and self.version_provider is not None:
+            self._query_version()
+        return self.version
+
+    def key(self, content_hash, target):
+        # 转换器升级后旧缓存自然失效；版本未确定时没有键，不读也不写缓存，以免结果在查到版本后无法命中
+        if self.version is None:
+            self.resolve_version()
+            return None
+        return hashlib.sha256(f'{content_hash}:{self.version}:{target}'.encode('utf-8')).hexdigest()
+
+    def path(self, key, target):
+        return os.path.join(self.root, key[:2], f'{key}.{target}')
+
+    def lookup(self, content_hash, target):
+        key = self.key(content_hash, target)
+        if key is None:
+            return None
+        path = self.path(key, target)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        self._count('hits')
+        return path
+
+    def get_or_create(self, content_hash, target, producer):
+        cached_path = self.lookup(content_hash, target)
+        if cached_path:
+            return cached_path
+        if self.ensure_version() is None:
+            self._count('failures')
+            raise ConverterUnavailable('Converter version could not be determined')
+        key = self.key(content_hash, target)
+        path = self.path(key, target)
+
+        # 同一内容的并发请求只触发一次转换，其余请求等待同一结果
+        with self.lock:
+            future = self.inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self.inflight[key] = Future()
+        if not leader:
+            self._count('coalesced')
+            return future.result()
+
+        self._count('misses')
+        tmp_path = os.path.join(self.tmp_dir, f'{key}.{target}')
+        try:
+            producer(tmp_path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(tmp_path, path)
+            with self.lock:
+                self.total_bytes += os.path.getsize(path)
+            future.set_result(path)
+        except BaseException as e:
+            self._count('failures')
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            future.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                self.inflight.pop(key, None)
+
+        if self.total_bytes > self.max_bytes:
+            self.evict()
+        return path
+
+    def evict(self):
+        entries = sorted(self._entries(), key=lambda entry: entry[1])
+        total = sum(size for _, _, size in entries)
+        evicted = 0
+        for path, _, size in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            evicted += 1
+        with self.lock:
+            self.total_bytes = total
+            self.stats['evictions'] += evicted
+        if evicted:
+            self.logger.info(f'Evicted {evicted} cached previews')
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.stats, bytes=self.total_bytes, max_bytes=self.max_bytes, inflight=len(self.inflight))
+
+    def _count(self, name):
+        with self.lock:
+            self.stats[name] += 1
+
+    def _entries(self):
+        for shard in os.listdir(self.root):
+            shard_path = os.path.join(self.root, shard)
+            if shard == 'tmp' or not os.path.isdir(shard_path):
+                continue
+            for name in os.listdir(shard_path):
+                path = os.path.join(shard_path, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield path, stat.st_mtime, stat.st_size
+
+
+conversion_cache = ConversionCache()
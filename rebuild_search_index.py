@@ -0,0 +1,18 @@
+import logging
+from app import create_app
+from search_index import rebuild_index
+
+
+def rebuild_search_index():
+    app = create_app()
+
+    logging.basicConfig(level=logging.INFO)
+    logger = logging.getLogger(__name__)
+
+    with app.app_context():
+        indexed = rebuild_index()
+        logger.info(f"Indexed {indexed} files")
+
+
+if __name__ == '__main__':
+    rebuild_search_index()
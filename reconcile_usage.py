@@ -0,0 +1,18 @@
+import logging
+from app import create_app
+from usage import rebuild_usage
+
+
+def reconcile_usage():
+    app = create_app()
+
+    logging.basicConfig(level=logging.INFO)
+    logger = logging.getLogger(__name__)
+
+    with app.app_context():
+        users = rebuild_usage()
+        logger.info(f"Rebuilt storage usage for {users} users")
+
+
+if __name__ == '__main__':
+    reconcile_usage()
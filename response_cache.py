@@ -0,0 +1,178 @@
+import json
+import uuid
+import base64
+import hashlib
+import logging
+import threading
+from functools import wraps
+from collections import OrderedDict
+from flask import request, session, current_app
+from sqlalchemy import event
+from extensions import db
+from models import File
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+CACHED_HEADERS = ('Content-Type', 'X-Next-Cursor')
+
+
+class LocalBackend:
+    # 进程内 LRU，只适用于单进程部署；多进程下各进程的版本号互不可见
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.versions = {}
+        # 版本号带上进程启动标识，重启后旧 ETag 不会被误判为有效
+        self.boot_id = uuid.uuid4().hex[:8]
+        self.lock = threading.Lock()
+
+    def version(self, user_id):
+        with self.lock:
+            return f'{self.boot_id}.{self.versions.get(user_id, 0)}'
+
+    def bump(self, user_ids):
+        with self.lock:
+            for user_id in user_ids:
+                self.versions[user_id] = self.versions.get(user_id, 0) + 1
+
+    def get(self, key):
+        with self.lock:
+            value = self.entries.get(key)
+            if value is not None:
+                self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+
+class RedisBackend:
+    # 多进程/多实例共享版本号和缓存内容，条目依赖 TTL 和 Redis 的淘汰策略回收
+    def __init__(self, url, ttl):
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+
+    def version(self, user_id):
+        return (self.client.get(f'clouddrive:version:{user_id}') or b'0').decode('ascii')
+
+    def bump(self, user_ids):
+        pipeline = self.client.pipeline()
+        for user_id in user_ids:
+            pipeline.incr(f'clouddrive:version:{user_id}')
+        pipeline.execute()
+
+    # 条目以 JSON 存储，Redis 中的数据被篡改也不会在反序列化时执行代码
+    def get(self, key):
+        value = self.client.get(f'clouddrive:listing:{key}')
+        if value is None:
+            return None
+        entry = json.loads(value)
+        return base64.b64decode(entry['body']), entry['headers']
+
+    def set(self, key, value):
+        body, headers = value
+        entry = {'body': base64.b64encode(body).decode('ascii'), 'headers': headers}
+        self.client.setex(f'clouddrive:listing:{key}', self.ttl, json.dumps(entry))
+
+
+class ListingCache:
+    # 每个用户一个版本号，任何写操作提交后递增；列表响应按 (用户, 端点, 参数, 版本) 缓存
+    def __init__(self, app=None):
+        self.backend = None
+        self.stats = {'hits': 0, 'misses': 0, 'not_modified': 0}
+        self.lock = threading.Lock()
+        self.logger = logging.getLogger(__name__)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        backend = app.config['RESPONSE_CACHE_BACKEND']
+        if backend == 'redis':
+            if redis is None:
+                raise RuntimeError('RESPONSE_CACHE_BACKEND is redis but the redis package is not installed')
+            self.backend = RedisBackend(app.config['RESPONSE_CACHE_REDIS_URL'], app.config['RESPONSE_CACHE_TTL'])
+        else:
+            self.backend = LocalBackend(app.config['RESPONSE_CACHE_SIZE'])
+        app.extensions['listing_cache'] = self
+
+    def touch(self, user_id):
+        # 记录到当前事务，提交成功后才递增版本号
+        db.session.info.setdefault('touched_users', set()).add(user_id)
+
+    def etag(self, user_id, version):
+        args = json.dumps(sorted(request.args.items(multi=True)), ensure_ascii=False)
+        digest = hashlib.sha1(f'{user_id}|{request.endpoint}|{args}|{version}'.encode('utf-8')).hexdigest()
+        return digest[:32]
+
+    def cached(self, view):
+        # 放在 login_required 之外：命中 If-None-Match 时直接从会话取用户 ID，不加载用户、不查询数据库
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            user_id = session.get('_user_id')
+            if user_id is None or request.method != 'GET':
+                return view(*args, **kwargs)
+
+            etag = self.etag(user_id, self.backend.version(int(user_id)))
+            if request.if_none_match.contains(etag):
+                self._count('not_modified')
+                response = current_app.response_class(status=304)
+                return self._finish(response, etag)
+
+            cached = self.backend.get(etag)
+            if cached is not None:
+                self._count('hits')
+                body, headers = cached
+                return self._finish(current_app.response_class(body, headers=headers), etag)
+
+            self._count('misses')
+            response = current_app.make_response(view(*args, **kwargs))
+            if response.status_code == 200 and not response.is_streamed:
+                headers = {name: response.headers[name] for name in CACHED_HEADERS if name in response.headers}
+                self.backend.set(etag, (response.get_data(), headers))
+                self._finish(response, etag)
+            return response
+        return wrapper
+
+    def _finish(self, response, etag):
+        response.set_etag(etag)
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        return response
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.stats)
+
+    def _count(self, name):
+        with self.lock:
+            self.stats[name] += 1
+
+
+listing_cache = ListingCache()
+
+
+@event.listens_for(db.session, 'after_flush')
+def collect_touched_users(session, flush_context):
+    user_ids = {obj.uploader_id for obj in list(session.new) + list(session.dirty) + list(session.deleted)
+                if isinstance(obj, File)}
+    if user_ids:
+        session.info.setdefault('touched_users', set()).update(user_ids)
+
+
+@event.listens_for(db.session, 'after_commit')
+def bump_touched_users(session):
+    user_ids = session.info.pop('touched_users', None)
+    if user_ids and listing_cache.backend is not None:
+        listing_cache.backend.bump(user_ids)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def discard_touched_users(session):
+    session.info.pop('touched_users', None)
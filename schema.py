@@ -0,0 +1,33 @@
+import logging
+from sqlalchemy import inspect, text
+from extensions import db
+
+logger = logging.getLogger(__name__)
+
+
+def upgrade_schema():
+    # create_all 只创建缺少的表，不会修改已有的表；旧库的表在这里补上新增的可空列和索引，
+    # 必须在任何查询这些列的代码（ensure_closure、migrate_blobs）之前执行
+    connection = db.session.connection()
+    inspector = inspect(connection)
+    preparer = connection.dialect.identifier_preparer
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        columns = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in columns:
+                continue
+            if not column.nullable:
+                raise RuntimeError(f'Cannot add NOT NULL column {table.name}.{column.name} to an existing table')
+            column_type = column.type.compile(dialect=connection.dialect)
+            connection.execute(text(f'ALTER TABLE {preparer.format_table(table)} '
+                                    f'ADD COLUMN {preparer.format_column(column)} {column_type}'))
+            logger.info(f'Added column {table.name}.{column.name}')
+
+        indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in indexes:
+                index.create(connection)
+                logger.info(f'Created index {index.name}')
+    db.session.commit()
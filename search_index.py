@@ -0,0 +1,380 @@
+import re
+import queue
+import zipfile
+import logging
+import threading
+from flask import current_app
+from sqlalchemy import event, inspect, text, table, column, delete, select
+from extensions import db
+from models import File
+from storage import blob_store
+
+try:
+    from pypdf import PdfReader
+except ImportError:
+    PdfReader = None
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 500
+CONTENT_MAX_CHARS = 200000
+PDF_MAX_PAGES = 50
+# Office 文档各 XML 部件合计最多读取的字节数，标签去掉后的正文远小于 XML 本身
+XML_MAX_BYTES = 16 * 1024 * 1024
+OFFICE_XML_PARTS = {
+    'docx': re.compile(r'^word/(document|header\d*|footer\d*)\.xml$'),
+    'pptx': re.compile(r'^ppt/slides/slide\d+\.xml$'),
+    'xlsx': re.compile(r'^xl/sharedStrings\.xml$'),
+}
+CJK_PATTERN = re.compile(r'([㐀-鿿豈-﫿])')
+TOKEN_PATTERN = re.compile(r'[^\W_]+')
+XML_TAG_PATTERN = re.compile(r'<[^>]+>')
+
+search_table = table('file_search', column('rowid'), column('file_id'))
+
+# SQLite 索引中每个词都加上所属用户的前缀，相当于按用户分区：前缀展开和 bm25 的词频统计只涉及该用户的文档。
+# 用户 id 后固定跟一个字母，u1x0a 与 u10xa 不会混淆
+SQLITE_SCHEMA = "CREATE VIRTUAL TABLE IF NOT EXISTS file_search USING fts5(filename, tags, content)"
+OWNER_PREFIX = 'u{}x'
+POSTGRES_SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS file_search ("
+    "file_id INTEGER PRIMARY KEY, uploader_id INTEGER NOT NULL, "
+    "filename TEXT, tags TEXT, content TEXT, document TSVECTOR)",
+    "CREATE INDEX IF NOT EXISTS ix_file_search_document ON file_search USING GIN (document)",
+    "CREATE INDEX IF NOT EXISTS ix_file_search_uploader ON file_search (uploader_id)",
+]
+POSTGRES_DOCUMENT = ("setweight(to_tsvector('simple', coalesce(filename, '')), 'A') || "
+                     "setweight(to_tsvector('simple', coalesce(tags, '')), 'B') || "
+                     "setweight(to_tsvector('simple', coalesce(content, '')), 'C')")
+
+
+def backend_for(bind):
+    name = bind.dialect.name
+    return name if name in ('sqlite', 'postgresql') else None
+
+
+def init_app(app):
+    content_indexer.init_app(app)
+    with app.app_context():
+        backend = backend_for(db.engine)
+        if backend == 'sqlite':
+            _upgrade_sqlite(db.session)
+            db.session.execute(text(SQLITE_SCHEMA))
+        elif backend == 'postgresql':
+            for statement in POSTGRES_SCHEMA:
+                db.session.execute(text(statement))
+        db.session.commit()
+
+
+def _upgrade_sqlite(session):
+    # 旧表按 uploader_id 列过滤，MATCH 会先匹配并排序所有用户的文档；逐批复制到新表，不必重新提取正文
+    columns = {row[1] for row in session.execute(text('PRAGMA table_info(file_search)'))}
+    if 'uploader_id' not in columns:
+        return
+    session.execute(text('ALTER TABLE file_search RENAME TO file_search_old'))
+    session.execute(text(SQLITE_SCHEMA))
+    last_id = 0
+    while True:
+        rows = session.execute(text(
+            'SELECT rowid AS file_id, uploader_id, filename, tags, content FROM file_search_old '
+            'WHERE rowid > :last_id ORDER BY rowid LIMIT :limit'
+        ), {'last_id': last_id, 'limit': BATCH_SIZE}).mappings().all()
+        if not rows:
+            break
+        _upsert(session, 'sqlite', rows)
+        last_id = rows[-1]['file_id']
+    session.execute(text('DROP TABLE file_search_old'))
+    logger.info('Rebuilt file_search with per-user tokens')
+
+
+def segment(value):
+    # 中文没有空格分词，按单字切分后用短语查询实现子串匹配
+    return CJK_PATTERN.sub(r' \1 ', value) if value else ''
+
+
+def extract_text(file):
+    if file.is_folder or not file.content_hash or '.' not in file.filename:
+        return ''
+    ext = file.filename.rsplit('.', 1)[1].lower()
+    path = blob_store.path(file.content_hash)
+    try:
+        if ext == 'txt':
+            with open(path, 'rb') as f:
+                return f.read(CONTENT_MAX_CHARS * 4).decode('utf-8', errors='ignore')[:CONTENT_MAX_CHARS]
+        if ext in OFFICE_XML_PARTS:
+            parts = []
+            length = 0
+            budget = XML_MAX_BYTES
+            with zipfile.ZipFile(path) as archive:
+                for name in archive.namelist():
+                    if length >= CONTENT_MAX_CHARS or budget <= 0:
+                        break
+                    if OFFICE_XML_PARTS[ext].match(name):
+                        with archive.open(name) as member:
+                            data = member.read(budget)
+                        budget -= len(data)
+                        part = XML_TAG_PATTERN.sub(' ', data.decode('utf-8', errors='ignore'))
+                        parts.append(part)
+                        length += len(part)
+            return ' '.join(parts)[:CONTENT_MAX_CHARS]
+        if ext == 'pdf' and PdfReader is not None:
+            reader = PdfReader(path)
+            parts = []
+            for page in reader.pages[:PDF_MAX_PAGES]:
+                parts.append(page.extract_text() or '')
+            return ' '.join(parts)[:CONTENT_MAX_CHARS]
+    except Exception as e:
+        logger.warning(f'Text extraction failed for file {file.id}: {e}')
+    # doc/xls/ppt 等二进制格式只索引文件名和标签
+    return ''
+
+
+def owned(uploader_id, value):
+    prefix = OWNER_PREFIX.format(int(uploader_id))
+    return ' '.join(prefix + token for token in TOKEN_PATTERN.findall(value or ''))
+
+
+def _owned_rows(rows):
+    return [dict(row, **{key: owned(row['uploader_id'], row[key]) for key in ('filename', 'tags', 'content') if key in row})
+            for row in rows]
+
+
+def index_rows(files, with_content=True):
+    rows = []
+    for file in files:
+        rows.append({
+            'file_id': file.id,
+            'uploader_id': file.uploader_id,
+            'filename': segment(file.filename),
+            'tags': segment(file.tags),
+            'content': segment(extract_text(file)) if with_content else '',
+        })
+    return rows
+
+
+def _upsert(session, backend, rows):
+    ids = [{'file_id': row['file_id']} for row in rows]
+    if backend == 'sqlite':
+        session.execute(text('DELETE FROM file_search WHERE rowid = :file_id'), ids)
+        session.execute(text('INSERT INTO file_search (rowid, filename, tags, content) '
+                             'VALUES (:file_id, :filename, :tags, :content)'), _owned_rows(rows))
+    else:
+        session.execute(text('DELETE FROM file_search WHERE file_id = :file_id'), ids)
+        session.execute(text('INSERT INTO file_search (file_id, uploader_id, filename, tags, content, document) '
+                             f'VALUES (:file_id, :uploader_id, :filename, :tags, :content, {POSTGRES_DOCUMENT})'), rows)
+
+
+def _update_names(session, backend, files):
+    rows = [{'file_id': file.id, 'uploader_id': file.uploader_id, 'filename': segment(file.filename),
+             'tags': segment(file.tags)} for file in files]
+    if backend == 'sqlite':
+        session.execute(text('UPDATE file_search SET filename = :filename, tags = :tags WHERE rowid = :file_id'),
+                        _owned_rows(rows))
+    else:
+        session.execute(text('UPDATE file_search SET filename = :filename, tags = :tags, '
+                             f'document = {POSTGRES_DOCUMENT} WHERE file_id = :file_id'), rows)
+
+
+def _update_content(session, backend, rows):
+    # 只在文件内容仍是提取时的版本时写入，避免较慢的旧任务覆盖新版本的内容
+    current = 'EXISTS (SELECT 1 FROM files WHERE files.id = :file_id AND files.content_hash = :content_hash)'
+    if backend == 'sqlite':
+        session.execute(text(f'UPDATE file_search SET content = :content WHERE rowid = :file_id AND {current}'),
+                        _owned_rows(rows))
+    else:
+        session.execute(text(f'UPDATE file_search SET content = :content, document = {POSTGRES_DOCUMENT} '
+                             f'WHERE file_id = :file_id AND {current}'), rows)
+
+
+class ContentIndexer:
+    # PDF/Office 正文提取较慢，提交后交给后台线程，写事务内只索引文件名和标签
+    def __init__(self, app=None):
+        self.app = None
+        self.queue = queue.Queue()
+        self.thread = None
+        self.pending = set()
+        self.lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.extensions['content_indexer'] = self
+        if app.config['SEARCH_INDEX_CONTENT'] and self.thread is None:
+            self.thread = threading.Thread(target=self._run, name='search-content', daemon=True)
+            self.thread.start()
+
+    def schedule(self, file_ids):
+        if self.thread is None:
+            return
+        for file_id in file_ids:
+            with self.lock:
+                if file_id in self.pending:
+                    continue
+                self.pending.add(file_id)
+            self.queue.put(file_id)
+
+    def _run(self):
+        while True:
+            file_ids = [self.queue.get()]
+            while not self.queue.empty() and len(file_ids) < BATCH_SIZE:
+                file_ids.append(self.queue.get_nowait())
+            # 出队即移出 pending，处理期间再次修改的文件会重新排队
+            with self.lock:
+                self.pending.difference_update(file_ids)
+
+            with self.app.app_context():
+                try:
+                    self.index_content(file_ids)
+                except Exception as e:
+                    logger.error(f'Content indexing failed: {e}')
+                    db.session.rollback()
+                finally:
+                    db.session.remove()
+
+    def index_content(self, file_ids):
+        backend = backend_for(db.engine)
+        if backend is None:
+            return 0
+        files = db.session.execute(
+            select(File.id, File.uploader_id, File.filename, File.content_hash, File.is_folder)
+            .where(File.id.in_(file_ids), File.content_hash.isnot(None))
+        ).all()
+        # 提取期间不持有数据库事务
+        db.session.rollback()
+        rows = [{'file_id': file.id, 'uploader_id': file.uploader_id, 'content_hash': file.content_hash,
+                 'content': segment(extract_text(file))} for file in files]
+        if rows:
+            _update_content(db.session, backend, rows)
+            db.session.commit()
+        return len(rows)
+
+
+content_indexer = ContentIndexer()
+
+
+def remove(session, file_ids_query):
+    backend = backend_for(session.get_bind())
+    if backend is None:
+        return
+    key = search_table.c.rowid if backend == 'sqlite' else search_table.c.file_id
+    session.execute(delete(search_table).where(key.in_(file_ids_query)))
+
+
+@event.listens_for(db.session, 'after_flush')
+def maintain_search_index(session, flush_context):
+    backend = backend_for(session.get_bind())
+    if backend is None:
+        return
+
+    new_files = [obj for obj in session.new if isinstance(obj, File) and not obj.is_favorite_folder]
+    # 上传新版本后内容变化，正文在提交后重新提取，在此之前保留旧内容
+    changed_files = [obj for obj in session.dirty if isinstance(obj, File) and not obj.is_favorite_folder
+                     and inspect(obj).attrs.content_hash.history.has_changes()]
+    renamed_files = [obj for obj in session.dirty if isinstance(obj, File) and not obj.is_favorite_folder
+                     and obj not in changed_files and (
+        inspect(obj).attrs.filename.history.has_changes() or inspect(obj).attrs.tags.history.has_changes())]
+    deleted_ids = [obj.id for obj in session.deleted if isinstance(obj, File)]
+
+    if deleted_ids:
+        key = search_table.c.rowid if backend == 'sqlite' else search_table.c.file_id
+        session.execute(delete(search_table).where(key.in_(deleted_ids)))
+    for start in range(0, len(new_files), BATCH_SIZE):
+        _upsert(session, backend, index_rows(new_files[start:start + BATCH_SIZE], with_content=False))
+    if renamed_files or changed_files:
+        _update_names(session, backend, renamed_files + changed_files)
+    if current_app.config['SEARCH_INDEX_CONTENT']:
+        content_ids = {obj.id for obj in new_files + changed_files if not obj.is_folder and obj.content_hash}
+        if content_ids:
+            session.info.setdefault('search_content_ids', set()).update(content_ids)
+
+
+@event.listens_for(db.session, 'after_commit')
+def schedule_content(session):
+    file_ids = session.info.pop('search_content_ids', None)
+    if file_ids:
+        content_indexer.schedule(file_ids)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def discard_content(session):
+    session.info.pop('search_content_ids', None)
+
+
+def build_match_query(terms, uploader_id, column=None):
+    tokens = _tokens(terms, OWNER_PREFIX.format(int(uploader_id)))
+    if not tokens:
+        return None
+    expression = ' '.join(tokens)
+    return f'{column} : ({expression})' if column else f'({expression})'
+
+
+def _tokens(terms, prefix):
+    # 连续的中文字符作为短语，其余词按前缀匹配
+    tokens = []
+    for word in TOKEN_PATTERN.findall(terms):
+        chars = [prefix + part for part in CJK_PATTERN.split(word) if part]
+        phrase = ' '.join(chars)
+        tokens.append(f'"{phrase}"*')
+    return tokens
+
+
+def _tsquery_terms(terms, weight=''):
+    # 权重 A/B 分别对应文件名和标签，字段过滤同样走 GIN 索引
+    tokens = []
+    for word in TOKEN_PATTERN.findall(terms):
+        chars = [part.lower() for part in CJK_PATTERN.split(word) if part]
+        parts = [f'{char}:{weight}' if weight else char for char in chars[:-1]]
+        tokens.append(' <-> '.join(parts + [f'{chars[-1]}:*{weight}']))
+    return tokens
+
+
+def search(uploader_id, query=None, filename=None, tags=None, limit=50, offset=0):
+    backend = backend_for(db.session.get_bind())
+    if backend == 'sqlite':
+        expressions = [expression for expression in (
+            build_match_query(query, uploader_id) if query else None,
+            build_match_query(filename, uploader_id, 'filename') if filename else None,
+            build_match_query(tags, uploader_id, 'tags') if tags else None,
+        ) if expression]
+        if not expressions:
+            return []
+        rows = db.session.execute(text(
+            'SELECT rowid FROM file_search WHERE file_search MATCH :match '
+            'ORDER BY bm25(file_search, 10.0, 5.0, 1.0) LIMIT :limit OFFSET :offset'
+        ), {'match': ' AND '.join(expressions), 'limit': limit, 'offset': offset})
+        return [row[0] for row in rows]
+
+    if backend == 'postgresql':
+        tokens = []
+        for terms, weight in ((query, ''), (filename, 'A'), (tags, 'B')):
+            if terms:
+                tokens.extend(_tsquery_terms(terms, weight))
+        if not tokens:
+            return []
+        rows = db.session.execute(text(
+            "SELECT file_id FROM file_search, to_tsquery('simple', :tsquery) AS query "
+            'WHERE uploader_id = :uploader_id AND document @@ query '
+            'ORDER BY ts_rank(document, query) DESC, file_id LIMIT :limit OFFSET :offset'
+        ), {'tsquery': ' & '.join(tokens), 'uploader_id': uploader_id, 'limit': limit, 'offset': offset})
+        return [row[0] for row in rows]
+
+    return None
+
+
+def rebuild_index():
+    backend = backend_for(db.engine)
+    if backend is None:
+        return 0
+    db.session.execute(text('DELETE FROM file_search'))
+    indexed = 0
+    last_id = 0
+    while True:
+        files = File.query.filter(File.id > last_id, File.is_favorite_folder == False).order_by(File.id).limit(BATCH_SIZE).all()
+        if not files:
+            break
+        _upsert(db.session, backend, index_rows(files))
+        indexed += len(files)
+        last_id = files[-1].id
+    db.session.commit()
+    return indexed
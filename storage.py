@@ -0,0 +1,304 @@
+import hashlib
+import os
+import glob
+import time
+import queue
+import logging
+import tempfile
+import threading
+from datetime import datetime
+from flask import has_app_context
+from sqlalchemy import bindparam, insert, update, event
+from sqlalchemy.exc import IntegrityError
+from extensions import db
+from models import Blob
+
+CHUNK_SIZE = 1024 * 1024
+BATCH_SIZE = 500
+
+
+class BlobStore:
+    def __init__(self, app=None):
+        self.root = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.root = app.config['BLOB_STORAGE_PATH']
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        app.extensions['blob_store'] = self
+
+    @property
+    def tmp_dir(self):
+        return os.path.join(self.root, 'tmp')
+
+    def path(self, content_hash):
+        # 按哈希前缀分两级目录，避免单目录文件过多
+        return os.path.join(self.root, content_hash[:2], content_hash[2:4], content_hash)
+
+    def variant_path(self, content_hash, variant, extension):
+        # 派生内容（缩略图等）与原始内容放在同一目录，回收原始内容时一并删除
+        return f'{self.path(content_hash)}.{variant}.{extension}'
+
+    def exists(self, content_hash):
+        return os.path.exists(self.path(content_hash))
+
+    def open(self, content_hash):
+        return open(self.path(content_hash), 'rb')
+
+    def mkstemp(self, suffix=''):
+        return tempfile.mkstemp(dir=self.tmp_dir, suffix=suffix)
+
+    def write_stream(self, stream):
+        return self.write_chunks(iter(lambda: stream.read(CHUNK_SIZE), b''))
+
+    def write_chunks(self, chunks):
+        fd, tmp_path = self.mkstemp()
+        sha = hashlib.sha256()
+        size = 0
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                for chunk in chunks:
+                    sha.update(chunk)
+                    out.write(chunk)
+                    size += len(chunk)
+                out.flush()
+                os.fsync(out.fileno())
+            content_hash = sha.hexdigest()
+            self.adopt(tmp_path, content_hash)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return content_hash, size
+
+    def adopt(self, tmp_path, content_hash):
+        # tmp_path 必须已完整写入并位于同一文件系统，os.replace 保证原子可见
+        final_path = self.path(content_hash)
+        try:
+            # 刷新修改时间，让回收线程在宽限期内不会删除刚被复用的内容；
+            # 文件已被回收线程改名为墓碑时按不存在处理，重新写入
+            os.utime(final_path)
+        except FileNotFoundError:
+            pass
+        else:
+            os.remove(tmp_path)
+            return final_path
+        os.makedirs(os.path.dirname(final_path), exist_ok=True)
+        os.replace(tmp_path, final_path)
+        if has_app_context():
+            # 文件先于 Blob 行写入，事务回滚时由回收线程清理没有对应行的文件
+            db.session.info.setdefault('written_blobs', set()).add(content_hash)
+        return final_path
+
+    def retire(self, content_hash, cutoff):
+        # 先改名为墓碑再检查修改时间：改名前到达的 adopt 刷新的时间随墓碑保留，
+        # 改名后到达的 adopt 看不到文件会写入新文件，purge 只删墓碑不会误删
+        path = self.path(content_hash)
+        tombstone = f'{path}.reclaim'
+        try:
+            os.replace(path, tombstone)
+        except FileNotFoundError:
+            return tombstone
+        if os.path.getmtime(tombstone) > cutoff:
+            self.revive(content_hash, tombstone)
+            return None
+        return tombstone
+
+    def revive(self, content_hash, tombstone):
+        # 期间 adopt 可能已写入相同内容，覆盖无妨
+        try:
+            os.replace(tombstone, self.path(content_hash))
+        except FileNotFoundError:
+            pass
+
+    def purge(self, content_hash):
+        # 删除墓碑和派生内容，retire 之后重新写入的原始文件保留
+        for path in glob.glob(f'{glob.escape(self.path(content_hash))}.*'):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+blob_store = BlobStore()
+
+
+class BlobReclaimer:
+    # 后台线程删除引用计数归零的内容，删除请求因此无需等待文件系统操作
+    def __init__(self, app=None):
+        self.app = None
+        self.queue = queue.Queue()
+        self.orphans = {}
+        self.orphans_lock = threading.Lock()
+        self.thread = None
+        self.logger = logging.getLogger(__name__)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.grace_seconds = app.config['BLOB_RECLAIM_GRACE_SECONDS']
+        self.interval = app.config['BLOB_RECLAIM_INTERVAL']
+        app.extensions['blob_reclaimer'] = self
+        if app.config['BLOB_RECLAIMER_ENABLED'] and self.thread is None:
+            self.thread = threading.Thread(target=self._run, name='blob-reclaimer', daemon=True)
+            self.thread.start()
+
+    def schedule(self, hashes):
+        for content_hash in hashes:
+            self.queue.put(content_hash)
+
+    def schedule_orphans(self, hashes):
+        # 回滚事务写入的文件，宽限期过后仍没有 Blob 行才删除，期间可能被并发的相同上传复用
+        with self.orphans_lock:
+            for content_hash in hashes:
+                self.orphans.setdefault(content_hash, time.time())
+
+    def _run(self):
+        while True:
+            try:
+                hashes = {self.queue.get(timeout=self.interval)}
+            except queue.Empty:
+                hashes = None
+            else:
+                while not self.queue.empty():
+                    hashes.add(self.queue.get_nowait())
+
+            with self.app.app_context():
+                try:
+                    self.reclaim(hashes)
+                    self.reclaim_orphans()
+                except Exception as e:
+                    self.logger.error(f'Blob reclaim failed: {e}')
+                    db.session.rollback()
+                finally:
+                    db.session.remove()
+
+    def reclaim(self, hashes=None):
+        query = Blob.query.filter(Blob.ref_count <= 0)
+        if hashes is not None:
+            query = query.filter(Blob.hash.in_(list(hashes)))
+        cutoff = time.time() - self.grace_seconds
+
+        reclaimed = 0
+        for content_hash in [blob.hash for blob in query.limit(BATCH_SIZE)]:
+            tombstone = blob_store.retire(content_hash, cutoff)
+            if tombstone is None:
+                continue
+            deleted = Blob.query.filter(Blob.hash == content_hash, Blob.ref_count <= 0).delete()
+            db.session.commit()
+            if deleted:
+                blob_store.purge(content_hash)
+                reclaimed += 1
+            else:
+                # 改名之后有上传重新引用了这份内容
+                blob_store.revive(content_hash, tombstone)
+        if reclaimed:
+            self.logger.info(f'Reclaimed {reclaimed} blobs')
+        return reclaimed
+
+    def reclaim_orphans(self):
+        cutoff = time.time() - self.grace_seconds
+        with self.orphans_lock:
+            due = [content_hash for content_hash, written_at in self.orphans.items() if written_at <= cutoff]
+        if not due:
+            return 0
+
+        referenced = set()
+        for start in range(0, len(due), BATCH_SIZE):
+            referenced.update(db.session.scalars(db.select(Blob.hash).where(Blob.hash.in_(due[start:start + BATCH_SIZE]))))
+        reclaimed = 0
+        done = []
+        for content_hash in due:
+            if content_hash not in referenced and blob_store.exists(content_hash):
+                if blob_store.retire(content_hash, cutoff) is None:
+                    # 宽限期内被其他上传复用过，等那次上传提交或回滚后再判断
+                    continue
+                blob_store.purge(content_hash)
+                reclaimed += 1
+            done.append(content_hash)
+        with self.orphans_lock:
+            for content_hash in done:
+                self.orphans.pop(content_hash, None)
+        if reclaimed:
+            self.logger.info(f'Reclaimed {reclaimed} orphaned blobs')
+        return reclaimed
+
+
+blob_reclaimer = BlobReclaimer()
+
+
+def release_blobs(hashes):
+    # 记录到当前事务，提交成功后才交给回收线程
+    db.session.info.setdefault('released_blobs', set()).update(hashes)
+
+
+@event.listens_for(db.session, 'after_commit')
+def schedule_released_blobs(session):
+    session.info.pop('written_blobs', None)
+    released = session.info.pop('released_blobs', None)
+    if released:
+        blob_reclaimer.schedule(released)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def discard_released_blobs(session):
+    session.info.pop('released_blobs', None)
+    written = session.info.pop('written_blobs', None)
+    if written:
+        blob_reclaimer.schedule_orphans(written)
+
+
+def add_blob_references(references):
+    # references: {content_hash: (size, count)}，已有的行批量加计数，新内容批量插入
+    hashes = list(references)
+    existing = set()
+    for start in range(0, len(hashes), BATCH_SIZE):
+        existing.update(db.session.scalars(db.select(Blob.hash).where(Blob.hash.in_(hashes[start:start + BATCH_SIZE]))))
+
+    if existing:
+        db.session.execute(
+            update(Blob.__table__).where(Blob.__table__.c.hash == bindparam('b_hash'))
+            .values(ref_count=Blob.__table__.c.ref_count + bindparam('b_count')),
+            [{'b_hash': content_hash, 'b_count': references[content_hash][1]} for content_hash in existing]
+        )
+
+    new_rows = [{'hash': content_hash, 'size': size, 'ref_count': count, 'created_at': datetime.utcnow()}
+                for content_hash, (size, count) in references.items() if content_hash not in existing]
+    if not new_rows:
+        return
+    try:
+        with db.session.begin_nested():
+            db.session.execute(insert(Blob.__table__), new_rows)
+    except IntegrityError:
+        # 并发上传了相同内容，另一请求已插入部分行，逐行重试
+        for row in new_rows:
+            add_blob_reference(row['hash'], row['size'], row['ref_count'])
+
+
+def add_blob_reference(content_hash, size, count=1):
+    updated = Blob.query.filter_by(hash=content_hash).update({Blob.ref_count: Blob.ref_count + count})
+    if updated:
+        return
+    try:
+        with db.session.begin_nested():
+            db.session.add(Blob(hash=content_hash, size=size, ref_count=count))
+    except IntegrityError:
+        # 并发上传了相同内容，另一请求已插入该行
+        Blob.query.filter_by(hash=content_hash).update({Blob.ref_count: Blob.ref_count + count})
+
+
+def claim_blob(content_hash, size):
+    # 只在引用计数仍为正时加一，回收线程只删除计数归零的行，两者不会交错
+    if not blob_store.exists(content_hash):
+        return False
+    claimed = Blob.query.filter(Blob.hash == content_hash, Blob.size == size, Blob.ref_count > 0) \
+        .update({Blob.ref_count: Blob.ref_count + 1})
+    return claimed > 0
+
+
+def store_upload(stream):
+    content_hash, size = blob_store.write_stream(stream)
+    add_blob_reference(content_hash, size)
+    return content_hash, size
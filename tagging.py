@@ -0,0 +1,153 @@
+import re
+from collections import Counter
+from sqlalchemy import insert, update, delete, select, func, bindparam
+from sqlalchemy.exc import IntegrityError
+from extensions import db
+from models import File, Tag, FileTag
+
+BATCH_SIZE = 500
+TAG_SEPARATORS = re.compile(r'[,，;；\s]+')
+
+tag_table = Tag.__table__
+file_tag_table = FileTag.__table__
+
+
+def parse_tags(value):
+    names = []
+    for name in TAG_SEPARATORS.split(value or ''):
+        name = name.strip()[:64]
+        if name and name not in names:
+            names.append(name)
+    return names
+
+
+def get_or_create_tags(user_id, names):
+    tags = {tag.name: tag for tag in Tag.query.filter(Tag.user_id == user_id, Tag.name.in_(names))}
+    for name in names:
+        if name in tags:
+            continue
+        try:
+            with db.session.begin_nested():
+                tag = Tag(user_id=user_id, name=name, file_count=0)
+                db.session.add(tag)
+        except IntegrityError:
+            # 并发请求已创建同名标签
+            tag = Tag.query.filter_by(user_id=user_id, name=name).one()
+        tags[name] = tag
+    return [tags[name] for name in names]
+
+
+def _adjust_counts(counts, sign=1):
+    if counts:
+        db.session.execute(
+            update(tag_table).where(tag_table.c.id == bindparam('t_id'))
+            .values(file_count=tag_table.c.file_count + bindparam('t_delta')),
+            [{'t_id': tag_id, 't_delta': sign * count} for tag_id, count in counts.items()]
+        )
+
+
+def tag_files(user_id, file_ids, value):
+    names = parse_tags(value)
+    file_ids = list(file_ids)
+    if not names or not file_ids:
+        return
+    tag_ids = [tag.id for tag in get_or_create_tags(user_id, names)]
+    for start in range(0, len(file_ids), BATCH_SIZE):
+        db.session.execute(insert(file_tag_table), [
+            {'file_id': file_id, 'tag_id': tag_id} for file_id in file_ids[start:start + BATCH_SIZE] for tag_id in tag_ids
+        ])
+    _adjust_counts({tag_id: len(file_ids) for tag_id in tag_ids})
+
+
+def set_file_tags(file, value):
+    db.session.flush()
+    current = dict(db.session.execute(
+        select(Tag.name, Tag.id).join(FileTag, FileTag.tag_id == Tag.id).where(FileTag.file_id == file.id)
+    ).all())
+    names = parse_tags(value)
+    removed = [tag_id for name, tag_id in current.items() if name not in names]
+    if removed:
+        db.session.execute(delete(file_tag_table).where(
+            file_tag_table.c.file_id == file.id, file_tag_table.c.tag_id.in_(removed)))
+        _adjust_counts(Counter(removed), -1)
+    tag_files(file.uploader_id, [file.id], ' '.join(name for name in names if name not in current))
+    file.tags = value
+
+
+def copy_tags(pairs):
+    # pairs: [(源文件 ID, 副本 ID)]，副本沿用源文件的标签关联
+    copies = {}
+    for source_id, copy_id in pairs:
+        copies.setdefault(source_id, []).append(copy_id)
+    source_ids = list(copies)
+    counts = Counter()
+    for start in range(0, len(source_ids), BATCH_SIZE):
+        rows = [{'file_id': copy_id, 'tag_id': tag_id} for file_id, tag_id in db.session.execute(
+            select(FileTag.file_id, FileTag.tag_id).where(FileTag.file_id.in_(source_ids[start:start + BATCH_SIZE]))
+        ) for copy_id in copies[file_id]]
+        if rows:
+            db.session.execute(insert(file_tag_table), rows)
+            counts.update(row['tag_id'] for row in rows)
+    _adjust_counts(counts)
+
+
+def remove_subtree(file_ids_query):
+    counts = dict(db.session.execute(
+        select(FileTag.tag_id, func.count()).where(FileTag.file_id.in_(file_ids_query)).group_by(FileTag.tag_id)
+    ).all())
+    _adjust_counts(counts, -1)
+    db.session.execute(delete(file_tag_table).where(file_tag_table.c.file_id.in_(file_ids_query)))
+
+
+def tagged_file_ids(user_id, names):
+    return select(FileTag.file_id).join(Tag, Tag.id == FileTag.tag_id).where(Tag.user_id == user_id, Tag.name.in_(names))
+
+
+def filter_by_tags(query, user_id, all_tags=(), any_tags=(), none_tags=()):
+    if all_tags:
+        query = query.filter(File.id.in_(
+            tagged_file_ids(user_id, all_tags).group_by(FileTag.file_id)
+            .having(func.count(FileTag.tag_id) == len(set(all_tags)))
+        ))
+    if any_tags:
+        query = query.filter(File.id.in_(tagged_file_ids(user_id, any_tags)))
+    if none_tags:
+        query = query.filter(File.id.not_in(tagged_file_ids(user_id, none_tags)))
+    return query
+
+
+def tag_counts(user_id):
+    return Tag.query.filter(Tag.user_id == user_id, Tag.file_count > 0).order_by(Tag.file_count.desc(), Tag.name).all()
+
+
+def migrate_legacy_tags():
+    # 根据 files.tags 字符串重建标签表，可重复执行
+    db.session.execute(delete(file_tag_table))
+    db.session.execute(delete(tag_table))
+    migrated = 0
+    last_id = 0
+    while True:
+        rows = db.session.execute(
+            select(File.id, File.uploader_id, File.tags)
+            .where(File.id > last_id, File.tags != None, File.tags != '')
+            .order_by(File.id).limit(BATCH_SIZE)
+        ).all()
+        if not rows:
+            break
+
+        files_by_user = {}
+        for file_id, uploader_id, value in rows:
+            files_by_user.setdefault(uploader_id, []).append((file_id, parse_tags(value)))
+        for uploader_id, files in files_by_user.items():
+            names = sorted({name for _, file_names in files for name in file_names})
+            if not names:
+                continue
+            tag_ids = {tag.name: tag.id for tag in get_or_create_tags(uploader_id, names)}
+            links = [{'file_id': file_id, 'tag_id': tag_ids[name]} for file_id, file_names in files for name in file_names]
+            db.session.execute(insert(file_tag_table), links)
+            _adjust_counts(Counter(link['tag_id'] for link in links))
+
+        migrated += len(rows)
+        last_id = rows[-1][0]
+    db.session.commit()
+    return migrated
@@ -0,0 +1,79 @@
+import io
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app
+from config import Config
+from extensions import db
+from models import File, User
+
+
+def make_config(tmp_path):
+    # 后台线程全部关闭，分块等异步步骤由测试显式执行
+    class TestConfig(Config):
+        TESTING = True
+        SQLALCHEMY_DATABASE_URI = 'sqlite:///' + str(tmp_path / 'app.db')
+        SQLALCHEMY_BINDS = {}
+        BLOB_STORAGE_PATH = str(tmp_path / 'blobs')
+        BLOB_RECLAIMER_ENABLED = False
+        SEARCH_INDEX_CONTENT = False
+        THUMBNAILS_ENABLED = False
+        VERSION_CHUNKING_ENABLED = False
+        CONVERTER_WORKERS = 0
+        LIBREOFFICE_PATH = str(tmp_path / 'soffice')
+    return TestConfig
+
+
+def upload(client, name, data, parent_id=None, tags='', new_version=False):
+    form = {'file': (io.BytesIO(data), name), 'parent_id': '' if parent_id is None else str(parent_id), 'tags': tags}
+    if new_version:
+        form['new_version'] = 'true'
+    response = client.post('/file_management/upload', data=form, content_type='multipart/form-data')
+    assert response.get_json()['success'], response.get_json()
+    return response.get_json()
+
+
+def create_user(app, username):
+    with app.app_context():
+        user = User(username=username, password='x')
+        db.session.add(user)
+        db.session.commit()
+        return user.id
+
+
+def create_folder(client, app, name, parent_id=None):
+    response = client.post('/file_management/create_folder', json={'folder_name': name, 'parent_id': parent_id})
+    assert response.get_json()['success'], response.get_json()
+    return file_id(app, name, parent_id)
+
+
+def file_id(app, name, parent_id=None):
+    with app.app_context():
+        return File.query.filter_by(filename=name, parent_id=parent_id).one().id
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = create_app(make_config(tmp_path))
+    yield app
+    with app.app_context():
+        db.session.remove()
+        db.engine.dispose()
+
+
+@pytest.fixture
+def client(app):
+    from auth import create_default_favorite_folder
+
+    user_id = create_user(app, 'alice')
+    with app.app_context():
+        create_default_favorite_folder(user_id)
+
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user_id)
+        session['_fresh'] = True
+    return client
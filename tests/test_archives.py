@@ -0,0 +1,83 @@
+import io
+import zipfile
+from models import File, FileClosure
+from conftest import upload, file_id
+
+ARCHIVE_URL = '/file_management/archive'
+
+
+def make_zip(members):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name, data in members:
+            archive.writestr(name, data)
+    return buffer.getvalue()
+
+
+def test_list_archive_members(app, client):
+    upload(client, 'pack.zip', make_zip([('docs/', b''), ('docs/a.txt', b'alpha' * 100), ('b.pdf', b'bravo')]))
+    url = f'{ARCHIVE_URL}/{file_id(app, "pack.zip")}'
+
+    response = client.get(url)
+    body = response.get_json()
+    assert body['total'] == 3 and not body['truncated']
+    assert [(member['name'], member['size'], member['is_dir']) for member in body['members']] == [
+        ('docs/', 0, True), ('docs/a.txt', 500, False), ('b.pdf', 5, False)]
+    assert body['members'][1]['compressed_size'] < 500
+    assert client.get(url, headers={'If-None-Match': response.headers['ETag']}).status_code == 304
+
+    app.config['ARCHIVE_LIST_LIMIT'] = 2
+    body = client.get(url).get_json()
+    assert body['total'] == 3 and body['truncated'] and len(body['members']) == 2
+
+
+def test_download_archive_member(app, client):
+    upload(client, 'pack.zip', make_zip([('docs/', b''), ('docs/a.txt', b'alpha' * 100)]))
+    url = f'{ARCHIVE_URL}/{file_id(app, "pack.zip")}/member'
+
+    response = client.get(url, query_string={'name': 'docs/a.txt'})
+    assert response.status_code == 200
+    assert response.data == b'alpha' * 100
+    assert response.content_length == 500
+    assert 'a.txt' in response.headers['Content-Disposition']
+
+    assert client.get(url, query_string={'name': 'docs/'}).status_code == 404
+    assert client.get(url, query_string={'name': 'missing.txt'}).status_code == 404
+
+
+def test_extract_keeps_members_inside_folder(app, client):
+    upload(client, 'pack.zip', make_zip([
+        ('../escape.txt', b'escape'),
+        ('docs/../../up.txt', b'up'),
+        ('/abs.txt', b'abs'),
+        ('docs/./c.txt', b'charlie'),
+        ('tool.exe', b'binary'),
+    ]))
+    response = client.post(f'{ARCHIVE_URL}/{file_id(app, "pack.zip")}/extract', json={})
+    body = response.get_json()
+    assert body['success']
+    assert body['stats']['skipped'] == 1
+    folder_id = body['folder_id']
+    assert folder_id == file_id(app, 'pack')
+
+    # ../ 和绝对路径被去掉，所有成员都落在以压缩包命名的文件夹内
+    with app.app_context():
+        extracted = {file.id: file for file in File.query.filter(
+            File.id != folder_id, File.filename != 'pack.zip', File.is_favorite_folder == False)}
+        inside = {row.descendant_id for row in FileClosure.query.filter_by(ancestor_id=folder_id)}
+        assert set(extracted) <= inside
+        assert sorted(file.filename for file in extracted.values()) == ['abs.txt', 'c.txt', 'docs', 'escape.txt',
+                                                                        'up.txt']
+        docs = next(file for file in extracted.values() if file.filename == 'docs')
+        assert docs.parent_id == folder_id
+        assert {file.filename for file in extracted.values() if file.parent_id == docs.id} == {'c.txt', 'up.txt'}
+    c_id = file_id(app, 'c.txt', docs.id)
+    assert client.get(f'/file_management/serve_file_for_download/{c_id}').data == b'charlie'
+
+
+def test_invalid_archive(app, client):
+    upload(client, 'broken.zip', b'not a zip file')
+    upload(client, 'plain.txt', b'text')
+    assert client.get(f'{ARCHIVE_URL}/{file_id(app, "broken.zip")}').status_code == 422
+    assert client.post(f'{ARCHIVE_URL}/{file_id(app, "broken.zip")}/extract', json={}).status_code == 422
+    assert client.get(f'{ARCHIVE_URL}/{file_id(app, "plain.txt")}').status_code == 404
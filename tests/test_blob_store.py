@@ -0,0 +1,49 @@
+import sqlite3
+from extensions import db
+from models import File, Blob, FileClosure
+from storage import blob_store
+from migrate_blobs import migrate_blobs
+from conftest import make_config
+
+# 基线版本 db.create_all() 建出的表结构，文件内容存放在 files.data 中
+BASELINE_SCHEMA = [
+    'CREATE TABLE user (id INTEGER NOT NULL, username VARCHAR(80) NOT NULL, password VARCHAR(200) NOT NULL, '
+    'PRIMARY KEY (id), UNIQUE (username))',
+    'CREATE TABLE files (id INTEGER NOT NULL, filename VARCHAR(255) NOT NULL, data BLOB, '
+    'uploader_id INTEGER NOT NULL, category VARCHAR(50), tags VARCHAR(255), is_folder BOOLEAN, parent_id INTEGER, '
+    'created_at DATETIME, updated_at DATETIME, is_favorite_folder BOOLEAN, PRIMARY KEY (id), '
+    'FOREIGN KEY(uploader_id) REFERENCES user (id), FOREIGN KEY(parent_id) REFERENCES files (id))',
+    'CREATE TABLE favorites (id INTEGER NOT NULL, file_id INTEGER NOT NULL, folder_id INTEGER NOT NULL, '
+    'PRIMARY KEY (id), FOREIGN KEY(file_id) REFERENCES files (id), FOREIGN KEY(folder_id) REFERENCES files (id))',
+]
+
+
+def test_migrate_blobs_upgrades_a_baseline_database(tmp_path):
+    connection = sqlite3.connect(tmp_path / 'app.db')
+    for statement in BASELINE_SCHEMA:
+        connection.execute(statement)
+    connection.execute("INSERT INTO user VALUES (1, 'old', 'x')")
+    connection.execute("INSERT INTO files VALUES (1, 'docs', NULL, 1, NULL, NULL, 1, NULL, "
+                       "'2024-01-01 00:00:00', '2024-01-01 00:00:00', 0)")
+    connection.execute("INSERT INTO files VALUES (2, 'a.txt', ?, 1, 'documents', NULL, 0, 1, "
+                       "'2024-01-01 00:00:00', '2024-01-01 00:00:00', 0)", (b'hello old world',))
+    connection.execute("INSERT INTO files VALUES (3, 'b.txt', ?, 1, 'documents', NULL, 0, NULL, "
+                       "'2024-01-01 00:00:00', '2024-01-01 00:00:00', 0)", (b'hello old world',))
+    connection.commit()
+    connection.close()
+
+    config = make_config(tmp_path)
+    assert migrate_blobs(config) == 2
+
+    from app import create_app
+    app = create_app(config)
+    with app.app_context():
+        files = {file.filename: file for file in File.query}
+        assert files['a.txt'].content_hash == files['b.txt'].content_hash
+        assert files['a.txt'].size == 15
+        with blob_store.open(files['a.txt'].content_hash) as f:
+            assert f.read() == b'hello old world'
+        assert db.session.get(Blob, files['a.txt'].content_hash).ref_count == 2
+        assert FileClosure.query.filter_by(ancestor_id=1, descendant_id=2, depth=1).count() == 1
+        db.session.remove()
+        db.engine.dispose()
@@ -0,0 +1,65 @@
+import io
+from conftest import create_folder, create_user, file_id
+from extensions import db
+from models import File, Blob, FileClosure, FileTag, Tag
+
+UPLOAD_URL = '/file_management/upload_folder'
+
+
+def upload_folder(client, paths, parent_id=None, tags=''):
+    form = {'folder': [(io.BytesIO(data), path) for path, data in paths.items()],
+            'parent_id': '' if parent_id is None else str(parent_id), 'tags': tags}
+    return client.post(UPLOAD_URL, data=form, content_type='multipart/form-data')
+
+
+def test_folder_upload_builds_tree_and_shares_blobs(app, client):
+    parent_id = create_folder(client, app, 'parent')
+    response = upload_folder(client, {
+        'proj/a.txt': b'same',
+        'proj/sub/b.txt': b'same',
+        'proj/sub/deep/c.txt': b'other',
+    }, parent_id=parent_id, tags='work')
+    assert response.status_code == 200
+    stats = response.get_json()['stats']
+    assert (stats['files'], stats['folders'], stats['skipped']) == (3, 3, 0)
+
+    with app.app_context():
+        proj = File.query.filter_by(filename='proj', parent_id=parent_id).one()
+        sub = File.query.filter_by(filename='sub', parent_id=proj.id).one()
+        deep = File.query.filter_by(filename='deep', parent_id=sub.id).one()
+        assert {f.filename for f in File.query.filter_by(parent_id=deep.id)} == {'c.txt'}
+        assert FileClosure.query.filter_by(ancestor_id=parent_id).count() == 7
+        tagged = db.session.scalars(db.select(FileTag.file_id).join(Tag).where(Tag.name == 'work')).all()
+        assert proj.id in tagged
+
+        same = File.query.filter_by(filename='a.txt').one().content_hash
+        assert db.session.get(Blob, same).ref_count == 2
+
+    # 同一父目录下重复上传同名文件夹被拒绝
+    assert upload_folder(client, {'proj/x.txt': b'x'}, parent_id=parent_id).status_code == 400
+
+
+def test_folder_upload_rejects_bad_parent(app, client):
+    assert upload_folder(client, {'proj/a.txt': b'a'}, parent_id='abc').status_code == 400
+    assert upload_folder(client, {'proj/a.txt': b'a'}, parent_id=9999).status_code == 404
+
+    # 其他用户的文件夹同样视为不存在
+    with client.session_transaction() as session:
+        alice_id = session['_user_id']
+        session['_user_id'] = str(create_user(app, 'bob'))
+    foreign_id = create_folder(client, app, 'bob_folder')
+    with client.session_transaction() as session:
+        session['_user_id'] = alice_id
+    assert upload_folder(client, {'proj/a.txt': b'a'}, parent_id=foreign_id).status_code == 404
+
+    with app.app_context():
+        assert File.query.filter_by(filename='proj').count() == 0
+        assert Blob.query.count() == 0
+
+
+def test_folder_upload_at_root(app, client):
+    response = upload_folder(client, {'top/a.txt': b'a', 'top/b.txt': b'b'})
+    assert response.get_json()['stats']['files'] == 2
+    top_id = file_id(app, 'top')
+    listing = client.get('/file_management/files', query_string={'folder_id': top_id}).get_json()
+    assert sorted(item['filename'] for item in listing) == ['a.txt', 'b.txt']
@@ -0,0 +1,81 @@
+import hashlib
+import pytest
+from conftest import upload, file_id, create_folder, create_user
+from extensions import db
+from models import Blob, File, UploadSession
+
+UPLOADS_URL = '/file_management/uploads'
+DATA = b'instant upload content' * 100
+SHA256 = hashlib.sha256(DATA).hexdigest()
+
+
+def ref_count(app):
+    with app.app_context():
+        blob = db.session.get(Blob, SHA256)
+        return blob.ref_count if blob else 0
+
+
+def init(client, filename='copy.txt', **extra):
+    return client.post(UPLOADS_URL, json=dict({'filename': filename, 'size': len(DATA), 'sha256': SHA256}, **extra))
+
+
+def switch_user(client, user_id):
+    with client.session_transaction() as session:
+        previous = session['_user_id']
+        session['_user_id'] = str(user_id)
+    return previous
+
+
+def test_instant_upload_shares_the_blob(app, client):
+    upload(client, 'original.txt', DATA)
+    folder_id = create_folder(client, app, 'docs')
+
+    response = init(client, parent_id=folder_id, tags='copy')
+    assert response.get_json()['instant'] is True
+    assert response.get_json()['file_id'] == file_id(app, 'copy.txt', folder_id)
+    assert ref_count(app) == 2
+    assert client.get(f'/file_management/serve_file_for_download/{response.get_json()["file_id"]}').data == DATA
+
+    response = init(client, parent_id=folder_id, new_version=True)
+    assert response.get_json()['version'] == 2
+
+    client.post('/file_management/delete', json={'file_ids': [folder_id]})
+    assert ref_count(app) == 1
+
+
+@pytest.mark.parametrize('parent_id, status', [('abc', 400), ([1], 400), (9999, 404)])
+def test_bad_parent_claims_nothing(app, client, parent_id, status):
+    upload(client, 'original.txt', DATA)
+    assert init(client, parent_id=parent_id).status_code == status
+    assert ref_count(app) == 1
+    with app.app_context():
+        assert File.query.filter_by(filename='copy.txt').count() == 0
+        assert UploadSession.query.count() == 0
+
+
+def test_foreign_parent_and_foreign_content(app, client):
+    upload(client, 'original.txt', DATA)
+    alice_id = switch_user(client, create_user(app, 'bob'))
+    bob_folder = create_folder(client, app, 'bob_folder')
+
+    # 默认只复用本人已有的内容，bob 需要完整上传
+    response = init(client)
+    assert response.get_json()['instant'] is False
+    assert ref_count(app) == 1
+
+    switch_user(client, alice_id)
+    assert init(client, parent_id=bob_folder).status_code == 404
+    assert ref_count(app) == 1
+
+
+def test_global_scope_and_missing_content(app, client):
+    upload(client, 'original.txt', DATA)
+    switch_user(client, create_user(app, 'bob'))
+    app.config['INSTANT_UPLOAD_SCOPE'] = 'global'
+    assert init(client).get_json()['instant'] is True
+    assert ref_count(app) == 2
+
+    # 内容声明的大小不符时不能秒传
+    response = client.post(UPLOADS_URL, json={'filename': 'other.txt', 'size': len(DATA) + 1, 'sha256': SHA256})
+    assert response.get_json()['instant'] is False
+    assert ref_count(app) == 2
@@ -0,0 +1,110 @@
+import os
+import sys
+import stat
+import time
+import pytest
+import file_management
+from conftest import upload, file_id
+from converter_pool import ConverterPool, ConverterBusy
+from preview_cache import conversion_cache
+
+FAKE_SOFFICE = '''#!{python}
+import os, sys, time
+args = sys.argv[1:]
+if '--version' in args:
+    print('LibreOffice 7.6.0.0 fake')
+    sys.exit(0)
+outdir = args[args.index('--outdir') + 1]
+source = args[-1]
+data = open(source, 'rb').read()
+if b'SLEEP' in data:
+    time.sleep(30)
+if b'FAIL' in data:
+    sys.stderr.write('source file could not be loaded')
+    sys.exit(1)
+name = os.path.splitext(os.path.basename(source))[0] + '.pdf'
+with open(os.path.join(outdir, name), 'wb') as out:
+    out.write(b'%PDF-fake ' + data)
+'''
+
+
+@pytest.fixture
+def pool(app, tmp_path, monkeypatch):
+    # 用脚本代替 soffice，按输入内容模拟成功、失败和超时
+    script = tmp_path / 'soffice'
+    script.write_text(FAKE_SOFFICE.format(python=sys.executable))
+    script.chmod(script.stat().st_mode | stat.S_IEXEC)
+    app.config.update(LIBREOFFICE_PATH=str(script), CONVERTER_WORKERS=1, CONVERTER_TIMEOUT=2,
+                      CONVERTER_QUEUE_SIZE=4)
+    pool = ConverterPool(app)
+    monkeypatch.setattr(file_management, 'converter_pool', pool)
+    monkeypatch.setattr(conversion_cache, 'version', None)
+    monkeypatch.setattr(conversion_cache, 'version_provider', pool.version)
+    return pool
+
+
+def wait_for_status(client, fid, expected, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        status = client.get(f'/file_management/preview_status/{fid}').get_json()
+        if status['status'] == expected:
+            return status
+        time.sleep(0.05)
+    raise AssertionError(f'preview of {fid} never became {expected}: {status}')
+
+
+def test_conversion_is_cached_and_conditional(app, client, pool):
+    upload(client, 'doc.docx', b'hello')
+    fid = file_id(app, 'doc.docx')
+    url = f'/file_management/preview_content/{fid}?wait=10'
+
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.mimetype == 'application/pdf'
+    assert response.data == b'%PDF-fake hello'
+    etag = response.headers['ETag']
+
+    assert client.get(url).data == b'%PDF-fake hello'
+    assert client.get(url, headers={'If-None-Match': etag}).status_code == 304
+    assert pool.snapshot()['submitted'] == 1
+    assert pool.snapshot()['completed'] == 1
+    assert wait_for_status(client, fid, 'ready')['url'].endswith(f'/preview_content/{fid}')
+    # 每个工作线程使用自己的配置目录
+    assert os.path.isdir(pool.root)
+
+
+def test_slow_conversion_answers_202_then_times_out(app, client, pool):
+    upload(client, 'slow.docx', b'SLEEP')
+    fid = file_id(app, 'slow.docx')
+
+    response = client.get(f'/file_management/preview_content/{fid}?wait=0')
+    assert response.status_code == 202
+    assert response.headers['Retry-After'] == '2'
+    assert client.get(response.get_json()['status_url']).get_json()['status'] == 'pending'
+    # 重复请求复用排队中的任务
+    assert client.get(f'/file_management/preview_content/{fid}?wait=0').status_code == 202
+    assert pool.snapshot()['submitted'] == 1
+
+    status = wait_for_status(client, fid, 'failed')
+    assert 'exceeded' in status['message']
+    stats = pool.snapshot()
+    assert (stats['timeouts'], stats['restarts'], stats['failed']) == (1, 1, 1)
+
+
+def test_failed_conversion_reports_error(app, client, pool):
+    upload(client, 'bad.docx', b'FAIL')
+    fid = file_id(app, 'bad.docx')
+    assert client.get(f'/file_management/preview_content/{fid}?wait=10').status_code == 500
+    assert wait_for_status(client, fid, 'failed')['success'] is False
+    assert pool.snapshot()['restarts'] == 1
+
+
+def test_full_queue_rejects_new_jobs(app):
+    app.config.update(CONVERTER_WORKERS=0, CONVERTER_QUEUE_SIZE=1)
+    pool = ConverterPool(app)
+    first = pool.submit('a:pdf', lambda worker: None)
+    assert pool.submit('a:pdf', lambda worker: None) is first
+    with pytest.raises(ConverterBusy):
+        pool.submit('b:pdf', lambda worker: None)
+    assert pool.status('a:pdf') == ('pending', None)
+    assert pool.snapshot()['rejected'] == 1
@@ -0,0 +1,80 @@
+import os
+from extensions import db
+from models import File, FileClosure, Blob, Tag, FileTag
+from storage import blob_store
+from conftest import upload, file_id, create_folder, create_user
+
+COPY_URL = '/file_management/copy'
+
+
+def blob_files(app):
+    return sorted(name for _, _, names in os.walk(app.config['BLOB_STORAGE_PATH']) for name in names)
+
+
+def test_copy_shares_content(app, client):
+    upload(client, 'a.txt', b'alpha' * 1000)
+    source_id = file_id(app, 'a.txt')
+    stored = blob_files(app)
+
+    response = client.post(COPY_URL, json={'file_ids': [source_id], 'target_folder_id': None})
+    copy_id, = response.get_json()['file_ids']
+    assert file_id(app, 'a_copy.txt') == copy_id
+
+    # 副本只增加引用计数，不写入新内容
+    assert blob_files(app) == stored
+    with app.app_context():
+        content_hash = db.session.get(File, source_id).content_hash
+        assert db.session.get(File, copy_id).content_hash == content_hash
+        assert db.session.get(Blob, content_hash).ref_count == 2
+
+    # 删除源文件后副本的内容仍在
+    assert client.post('/file_management/delete', json={'file_ids': [source_id]}).get_json()['success']
+    with app.app_context():
+        assert db.session.get(Blob, content_hash).ref_count == 1
+        assert blob_store.exists(content_hash)
+    assert client.get(f'/file_management/serve_file_for_download/{copy_id}').data == b'alpha' * 1000
+
+
+def test_copy_folder_tree(app, client):
+    docs_id = create_folder(client, app, 'docs')
+    sub_id = create_folder(client, app, 'sub', docs_id)
+    upload(client, 'b.txt', b'bravo', parent_id=sub_id, tags='work')
+    dest_id = create_folder(client, app, 'dest')
+
+    response = client.post(COPY_URL, json={'file_ids': [docs_id], 'target_folder_id': dest_id})
+    copy_id, = response.get_json()['file_ids']
+
+    with app.app_context():
+        sub_copy = File.query.filter_by(filename='sub', parent_id=copy_id).one()
+        b_copy = File.query.filter_by(filename='b.txt', parent_id=sub_copy.id).one()
+        b_source = File.query.filter_by(filename='b.txt', parent_id=sub_id).one()
+        assert b_copy.id != b_source.id
+
+        # 副本的闭包表各层都已写入，标签关联和计数随副本增加
+        assert {(row.ancestor_id, row.depth) for row in FileClosure.query.filter_by(descendant_id=b_copy.id)} == {
+            (b_copy.id, 0), (sub_copy.id, 1), (copy_id, 2), (dest_id, 3)}
+        tag = Tag.query.one()
+        assert tag.file_count == 2
+        assert {row.file_id for row in FileTag.query} == {b_source.id, b_copy.id}
+        assert db.session.get(Blob, b_source.content_hash).ref_count == 2
+
+
+def test_copy_rejects_invalid_targets(app, client):
+    docs_id = create_folder(client, app, 'docs')
+    sub_id = create_folder(client, app, 'sub', docs_id)
+    upload(client, 'c.txt', b'charlie' * 100)
+
+    response = client.post(COPY_URL, json={'file_ids': [docs_id], 'target_folder_id': sub_id})
+    assert response.status_code == 400
+    response = client.post(COPY_URL, json={'file_ids': [docs_id], 'target_folder_id': file_id(app, 'c.txt')})
+    assert response.status_code == 404
+
+    # 副本计入配额
+    app.config['STORAGE_QUOTA_BYTES'] = 1000
+    response = client.post(COPY_URL, json={'file_ids': [file_id(app, 'c.txt')], 'target_folder_id': None})
+    assert response.status_code == 413
+
+    with client.session_transaction() as session:
+        session['_user_id'] = str(create_user(app, 'bob'))
+    response = client.post(COPY_URL, json={'file_ids': [docs_id], 'target_folder_id': None})
+    assert response.status_code == 404
@@ -0,0 +1,95 @@
+import shutil
+import pytest
+from sqlalchemy import select
+from app import create_app
+from auth import create_default_favorite_folder
+from conftest import make_config, create_user, create_folder
+from extensions import db
+from models import File
+
+
+@pytest.fixture
+def replica_app(tmp_path):
+    class ReplicaConfig(make_config(tmp_path)):
+        SQLALCHEMY_BINDS = {'replica_0': 'sqlite:///' + str(tmp_path / 'replica.db')}
+        RESPONSE_CACHE_SIZE = 0
+        REPLICA_STICKY_SECONDS = 60
+
+    app = create_app(ReplicaConfig)
+    app.replica_path = tmp_path / 'replica.db'
+    app.primary_path = tmp_path / 'app.db'
+    yield app
+    with app.app_context():
+        db.session.remove()
+        for engine in db.engines.values():
+            engine.dispose()
+
+
+def login(app, user_id):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user_id)
+    return client
+
+
+def sync_replica(app):
+    # 把主库当前内容复制到副本，之后主库的写入副本看不到，用来区分查询发往哪个库
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose()
+    shutil.copyfile(app.primary_path, app.replica_path)
+
+
+def folder_names(client):
+    response = client.get('/file_management/files')
+    assert response.status_code == 200
+    return {item['filename'] for item in response.get_json()}
+
+
+def test_reads_go_to_replica_until_the_client_writes(replica_app):
+    app = replica_app
+    user_id = create_user(app, 'alice')
+    with app.app_context():
+        create_default_favorite_folder(user_id)
+    sync_replica(app)
+
+    writer = login(app, user_id)
+    reader = login(app, user_id)
+    create_folder(writer, app, 'fresh')
+
+    # 写过的客户端在粘滞期内读主库，其他客户端读副本
+    assert folder_names(writer) == {'fresh'}
+    assert folder_names(reader) == set()
+
+    sync_replica(app)
+    assert folder_names(reader) == {'fresh'}
+
+
+def test_non_get_requests_use_primary(replica_app):
+    app = replica_app
+    user_id = create_user(app, 'alice')
+    sync_replica(app)
+    client = login(app, user_id)
+    folder_id = create_folder(client, app, 'docs')
+    # 副本中不存在刚建的文件夹，POST 中的读取必须走主库才能找到
+    response = client.post('/file_management/rename', json={'file_id': folder_id, 'new_name': 'renamed'})
+    assert response.status_code == 200
+
+
+def test_session_switches_to_primary_after_flush(replica_app):
+    app = replica_app
+    with app.test_request_context('/file_management/files', method='GET'):
+        app.preprocess_request()
+        replica = db.session.info['replica']
+        assert db.session.get_bind(clause=select(File)) is replica
+        db.session.add(File(filename='x', uploader_id=1, is_folder=True))
+        db.session.flush()
+        assert db.session.get_bind(clause=select(File)) is db.engine
+        db.session.rollback()
+
+
+def test_without_replicas_everything_uses_primary(app):
+    with app.test_request_context('/file_management/files', method='GET'):
+        app.preprocess_request()
+        assert 'replica' not in db.session.info
+        assert db.session.get_bind(clause=select(File)) is db.engine
@@ -0,0 +1,62 @@
+from conftest import upload, file_id, create_user
+
+DATA = bytes(range(256)) * 64
+
+
+def test_download_supports_range_and_conditional_get(app, client):
+    upload(client, 'data.pdf', DATA)
+    url = f'/file_management/serve_file_for_download/{file_id(app, "data.pdf")}'
+
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.data == DATA
+    assert response.headers['Accept-Ranges'] == 'bytes'
+    etag = response.headers['ETag']
+
+    response = client.get(url, headers={'Range': 'bytes=100-299'})
+    assert response.status_code == 206
+    assert response.data == DATA[100:300]
+    assert response.headers['Content-Range'] == f'bytes 100-299/{len(DATA)}'
+
+    response = client.get(url, headers={'Range': 'bytes=-10'})
+    assert response.status_code == 206
+    assert response.data == DATA[-10:]
+
+    response = client.get(url, headers={'Range': f'bytes={len(DATA)}-'})
+    assert response.status_code == 416
+
+    response = client.get(url, headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.data == b''
+
+    # If-Range 与当前 ETag 不符时忽略 Range，返回完整内容
+    response = client.get(url, headers={'Range': 'bytes=0-9', 'If-Range': '"stale"'})
+    assert response.status_code == 200
+    assert response.data == DATA
+
+
+def test_preview_supports_range_and_etag_follows_content(app, client):
+    upload(client, 'clip.mp4', DATA)
+    fid = file_id(app, 'clip.mp4')
+    url = f'/file_management/preview_content/{fid}'
+
+    response = client.get(url, headers={'Range': 'bytes=0-1023'})
+    assert response.status_code == 206
+    assert response.data == DATA[:1024]
+    assert response.mimetype == 'video/mp4'
+    etag = response.headers['ETag']
+    assert client.get(url, headers={'If-None-Match': etag}).status_code == 304
+
+    # 上传新版本后内容哈希变化，旧 ETag 不再命中
+    upload(client, 'clip.mp4', DATA[::-1], new_version=True)
+    response = client.get(url, headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.data == DATA[::-1]
+
+
+def test_download_requires_owner(app, client):
+    upload(client, 'data.pdf', DATA)
+    url = f'/file_management/serve_file_for_download/{file_id(app, "data.pdf")}'
+    with client.session_transaction() as session:
+        session['_user_id'] = str(create_user(app, 'bob'))
+    assert client.get(url, headers={'Range': 'bytes=0-9'}).status_code == 403
@@ -0,0 +1,79 @@
+import csv
+import io
+import json
+from conftest import upload, create_folder, create_user
+from models import File
+
+EXPORT_URL = '/file_management/export_directory'
+
+
+def build_tree(app, client):
+    docs_id = create_folder(client, app, 'docs')
+    reports_id = create_folder(client, app, '报告', docs_id)
+    create_folder(client, app, 'empty', docs_id)
+    upload(client, 'a.txt', b'aaa', parent_id=reports_id)
+    upload(client, 'b.txt', b'b', parent_id=docs_id)
+    upload(client, 'top.txt', b'top')
+
+
+def expected_paths(app, user_id=1):
+    with app.app_context():
+        files = {file.id: file for file in File.query.filter_by(uploader_id=user_id)}
+    paths = {}
+    for file_id, file in files.items():
+        parts = []
+        node = file
+        while node is not None:
+            parts.append(node.filename)
+            node = files.get(node.parent_id)
+        paths[file_id] = '/'.join(reversed(parts))
+    return paths
+
+
+def test_json_export_has_full_paths(app, client):
+    build_tree(app, client)
+    response = client.get(EXPORT_URL, query_string={'format': 'json'})
+    assert response.status_code == 200
+    assert response.mimetype == 'application/json'
+    rows = json.loads(response.get_data(as_text=True))
+
+    assert {row['id']: row['path'] for row in rows} == expected_paths(app)
+    assert [row['path'] for row in rows] == sorted(row['path'] for row in rows)
+    by_path = {row['path']: row for row in rows}
+    assert by_path['docs/报告/a.txt']['size'] == 3
+    assert by_path['docs/报告/a.txt']['is_folder'] is False
+    assert by_path['docs/empty']['is_folder'] is True
+    assert by_path['docs/报告/a.txt']['updated_at'].endswith('Z')
+
+
+def test_csv_and_txt_exports(app, client):
+    build_tree(app, client)
+    paths = expected_paths(app)
+
+    text = client.get(EXPORT_URL, query_string={'format': 'csv'}).get_data(as_text=True)
+    assert text.startswith('﻿')
+    reader = list(csv.reader(io.StringIO(text.lstrip('﻿'))))
+    assert reader[0] == ['id', 'path', 'type', 'size', 'updated_at']
+    assert {int(row[0]): row[1] for row in reader[1:]} == paths
+    rows = {row[1]: row for row in reader[1:]}
+    assert rows['docs/b.txt'][2:4] == ['file', '1']
+    assert rows['docs/empty'][2:4] == ['folder', '']
+
+    response = client.get(EXPORT_URL)
+    assert 'file_structure.txt' in response.headers['Content-Disposition']
+    lines = response.get_data(as_text=True).splitlines()
+    assert lines == [f'{path} (ID: {file_id})' for file_id, path in sorted(paths.items(), key=lambda item: item[1])]
+
+
+def test_export_excludes_other_users_and_rejects_unknown_format(app, client):
+    with client.session_transaction() as session:
+        alice_id = session['_user_id']
+        session['_user_id'] = str(create_user(app, 'bob'))
+    assert json.loads(client.get(EXPORT_URL, query_string={'format': 'json'}).data) == []
+    upload(client, 'bob.txt', b'bob')
+    with client.session_transaction() as session:
+        session['_user_id'] = alice_id
+
+    rows = json.loads(client.get(EXPORT_URL, query_string={'format': 'json'}).data)
+    assert 'bob.txt' not in {row['path'] for row in rows}
+    assert client.get(EXPORT_URL, query_string={'format': 'xml'}).status_code == 400
@@ -0,0 +1,83 @@
+import file_management
+from sqlalchemy import event
+from conftest import upload, create_folder, create_user
+from extensions import db
+
+TREE_URL = '/file_management/folder_tree'
+
+
+def build_tree(app, client):
+    # a/{a1/{a1x}, a2}, b, c/{c1}，外加一个文件
+    ids = {'a': create_folder(client, app, 'a'), 'b': create_folder(client, app, 'b'), 'c': create_folder(client, app, 'c')}
+    ids['a1'] = create_folder(client, app, 'a1', ids['a'])
+    ids['a2'] = create_folder(client, app, 'a2', ids['a'])
+    ids['a1x'] = create_folder(client, app, 'a1x', ids['a1'])
+    ids['c1'] = create_folder(client, app, 'c1', ids['c'])
+    upload(client, 'file.txt', b'x', parent_id=ids['a'])
+    return ids
+
+
+def shape(nodes):
+    return [(node['filename'], shape(node['children']) if 'children' in node else node['child_count'])
+            for node in nodes]
+
+
+def tree(client, **params):
+    response = client.get(TREE_URL, query_string=params)
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def test_tree_shape_by_depth(app, client):
+    ids = build_tree(app, client)
+    assert shape(tree(client)['folders']) == [('a', 2), ('b', 0), ('c', 1)]
+    assert shape(tree(client, depth=2)['folders']) == [('a', [('a1', 1), ('a2', 0)]), ('b', []), ('c', [('c1', 0)])]
+    assert shape(tree(client, depth=5)['folders']) == [
+        ('a', [('a1', [('a1x', [])]), ('a2', [])]), ('b', []), ('c', [('c1', [])])]
+
+    result = tree(client, parent_id=ids['a'], depth=2)
+    assert result['parent_id'] == ids['a']
+    assert shape(result['folders']) == [('a1', [('a1x', 0)]), ('a2', [])]
+    node = result['folders'][0]
+    assert (node['id'], node['parent_id'], node['has_children']) == (ids['a1'], ids['a'], True)
+
+
+def test_prefix_filters_only_the_requested_level(app, client):
+    ids = build_tree(app, client)
+    assert shape(tree(client, prefix='a', depth=2)['folders']) == [('a', [('a1', 1), ('a2', 0)])]
+    assert shape(tree(client, parent_id=ids['a'], prefix='a2')['folders']) == [('a2', 0)]
+    assert tree(client, prefix='zzz')['folders'] == []
+
+
+def test_favorites_truncation_and_ownership(app, client, monkeypatch):
+    ids = build_tree(app, client)
+    names = [node['filename'] for node in tree(client, include_favorites='true')['folders']]
+    assert len(names) == 4 and {'a', 'b', 'c'} < set(names)
+
+    monkeypatch.setattr(file_management, 'MAX_TREE_NODES', 4)
+    result = tree(client, depth=3)
+    assert result['truncated'] is True
+    assert shape(result['folders']) == [('a', [('a1', [])]), ('b', []), ('c', [])]
+
+    with client.session_transaction() as session:
+        session['_user_id'] = str(create_user(app, 'bob'))
+    assert client.get(TREE_URL, query_string={'parent_id': ids['a']}).status_code == 404
+    assert tree(client)['folders'] == []
+
+
+def test_queries_per_level(app, client):
+    build_tree(app, client)
+    statements = []
+    with app.app_context():
+        engine = db.engine
+
+    def count(*args):
+        statements.append(args[2])
+
+    event.listen(engine, 'before_cursor_execute', count)
+    try:
+        tree(client, depth=3)
+    finally:
+        event.remove(engine, 'before_cursor_execute', count)
+    # 每层两条：取子文件夹、统计各自的子文件夹数
+    assert len([statement for statement in statements if 'FROM files' in statement]) == 2 * 3
@@ -0,0 +1,219 @@
+import hashlib
+from collections import Counter, defaultdict
+from sqlalchemy import select, text
+from extensions import db
+from models import File, FileClosure, Blob, FileVersion, VersionChunk, Tag, FileTag, UserUsage, CategoryUsage
+from storage import blob_store
+from versioning import chunker, superseded
+from conftest import upload, file_id
+
+FILES_URL = '/file_management/files'
+
+
+def listing_etag(client):
+    response = client.get(FILES_URL)
+    assert response.status_code == 200
+    return response.headers['ETag']
+
+
+def assert_listing_changed(client, etag):
+    # 写操作提交后旧 ETag 不再命中
+    response = client.get(FILES_URL, headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+    return response.headers['ETag']
+
+
+def chunk_pending_versions(app):
+    with app.app_context():
+        pending = db.session.scalars(
+            select(FileVersion.id).where(FileVersion.chunk_count.is_(None), superseded())).all()
+        for version_id in pending:
+            assert chunker.chunk_version(version_id)
+        db.session.remove()
+
+
+def assert_invariants(app):
+    with app.app_context():
+        files = File.query.all()
+
+        # Blob 引用计数 = 文件当前内容 + 已分块版本的块 + 尚未分块版本的完整内容
+        expected = Counter(file.content_hash for file in files if file.content_hash)
+        expected.update(db.session.scalars(select(VersionChunk.chunk_hash)))
+        expected.update(db.session.scalars(select(FileVersion.content_hash).where(FileVersion.chunk_count.is_(None))))
+        actual = {blob.hash: blob.ref_count for blob in Blob.query if blob.ref_count != 0}
+        assert actual == dict(expected)
+        assert all(blob_store.exists(content_hash) for content_hash in expected)
+
+        # 闭包表与 parent_id 逐级推导的结果一致
+        parents = {file.id: file.parent_id for file in files}
+        closure = set()
+        for descendant in parents:
+            node, depth = descendant, 0
+            while node is not None:
+                closure.add((node, descendant, depth))
+                node, depth = parents[node], depth + 1
+        assert {(row.ancestor_id, row.descendant_id, row.depth) for row in FileClosure.query} == closure
+
+        # 用量汇总与文件表重新统计的结果一致，收藏夹不计入
+        users = defaultdict(lambda: [0, 0, 0])
+        categories = defaultdict(lambda: [0, 0])
+        for file in files:
+            if file.is_favorite_folder:
+                continue
+            if file.is_folder:
+                users[file.uploader_id][2] += 1
+                continue
+            users[file.uploader_id][0] += file.size or 0
+            users[file.uploader_id][1] += 1
+            categories[(file.uploader_id, file.category or 'other')][0] += 1
+            categories[(file.uploader_id, file.category or 'other')][1] += file.size or 0
+        assert {row.user_id: [row.bytes, row.files, row.folders] for row in UserUsage.query
+                if row.bytes or row.files or row.folders} == dict(users)
+        assert {(row.user_id, row.category): [row.files, row.bytes] for row in CategoryUsage.query
+                if row.files or row.bytes} == dict(categories)
+
+        # 标签计数与 file_tags 一致
+        tag_counts = Counter(db.session.scalars(select(FileTag.tag_id)))
+        assert {tag.id: tag.file_count for tag in Tag.query if tag.file_count} == dict(tag_counts)
+
+        # 全文索引每个非收藏夹文件一行
+        indexed = set(db.session.scalars(text('SELECT rowid FROM file_search')))
+        assert indexed == {file.id for file in files if not file.is_favorite_folder}
+        db.session.remove()
+
+
+def test_invariants_after_each_operation(app, client):
+    etag = listing_etag(client)
+
+    upload(client, 'a.txt', b'alpha' * 1000, tags='work draft')
+    assert_invariants(app)
+    etag = assert_listing_changed(client, etag)
+
+    response = client.post('/file_management/create_folder', json={'folder_name': 'docs', 'tags': 'work'})
+    assert response.get_json()['success']
+    docs_id = file_id(app, 'docs')
+    upload(client, 'b.txt', b'bravo' * 1000, parent_id=docs_id, tags='draft')
+    upload(client, 'same.txt', b'alpha' * 1000, parent_id=docs_id)
+    assert_invariants(app)
+    etag = assert_listing_changed(client, etag)
+
+    a_id = file_id(app, 'a.txt')
+    response = client.post('/file_management/move', json={'file_ids': [a_id], 'target_folder_id': docs_id})
+    assert response.get_json()['success']
+    assert_invariants(app)
+    etag = assert_listing_changed(client, etag)
+
+    response = client.post('/file_management/copy', json={'file_ids': [docs_id], 'target_folder_id': None})
+    assert response.get_json()['success']
+    assert_invariants(app)
+    etag = assert_listing_changed(client, etag)
+
+    upload(client, 'a.txt', b'alpha' * 999 + b'omega', parent_id=docs_id, new_version=True)
+    assert_invariants(app)
+    etag = assert_listing_changed(client, etag)
+    chunk_pending_versions(app)
+    assert_invariants(app)
+
+    response = client.post(f'/file_management/versions/{a_id}/1/restore')
+    assert response.get_json()['version'] == 3
+    assert_invariants(app)
+    etag = assert_listing_changed(client, etag)
+    chunk_pending_versions(app)
+    assert_invariants(app)
+
+    response = client.post('/file_management/delete', json={'file_ids': [docs_id]})
+    assert response.get_json()['success']
+    assert_invariants(app)
+    assert_listing_changed(client, etag)
+
+
+def test_version_history_and_restore(app, client):
+    v1 = bytes(range(256)) * 4096
+    v2 = v1[:500000] + b'changed' + v1[500007:]
+    upload(client, 'data.txt', v1)
+    fid = file_id(app, 'data.txt')
+    assert upload(client, 'data.txt', v2, new_version=True)['version'] == 2
+
+    # 分块前后下载的历史版本内容都与上传时一致
+    for chunked in (False, True):
+        if chunked:
+            chunk_pending_versions(app)
+        assert client.get(f'/file_management/versions/{fid}/1').data == v1
+        assert client.get(f'/file_management/versions/{fid}/2').data == v2
+        assert_invariants(app)
+
+    with app.app_context():
+        assert [version.chunk_count is not None for version in FileVersion.query.order_by(FileVersion.version)] \
+            == [True, False]
+
+    client.post(f'/file_management/versions/{fid}/1/restore')
+    chunk_pending_versions(app)
+    with app.app_context():
+        file = db.session.get(File, fid)
+        with blob_store.open(file.content_hash) as f:
+            assert f.read() == v1
+    assert_invariants(app)
+
+    client.post('/file_management/delete', json={'file_ids': [fid]})
+    assert_invariants(app)
+    with app.app_context():
+        assert FileVersion.query.count() == 0
+        assert VersionChunk.query.count() == 0
+
+
+def test_resent_chunk_replaces_marker(app, client):
+    data = b'a' * 10 + b'b' * 10
+    response = client.post('/file_management/uploads', json={'filename': 'c.txt', 'size': 20, 'chunk_size': 10,
+                                                             'sha256': hashlib.sha256(data).hexdigest()})
+    upload_id = response.get_json()['upload_id']
+    chunk_url = f'/file_management/uploads/{upload_id}/chunks'
+    assert client.put(f'{chunk_url}/0', data=data[:10]).status_code == 200
+    assert client.put(f'{chunk_url}/1', data=data[10:]).status_code == 200
+
+    # 重传的分片校验失败后不能再被视为已收到
+    response = client.put(f'{chunk_url}/1', data=b'z' * 10, headers={'X-Chunk-SHA256': '0' * 64})
+    assert response.status_code == 400
+    assert client.get(f'/file_management/uploads/{upload_id}').get_json()['missing'] == [1]
+    response = client.post(f'/file_management/uploads/{upload_id}/complete')
+    assert response.status_code == 400
+    assert response.get_json()['missing'] == [1]
+
+    assert client.put(f'{chunk_url}/1', data=data[10:]).status_code == 200
+    response = client.post(f'/file_management/uploads/{upload_id}/complete')
+    assert response.get_json()['success']
+    fid = response.get_json()['file_id']
+    assert client.get(f'/file_management/serve_file_for_download/{fid}').data == data
+    assert client.post(f'/file_management/uploads/{upload_id}/complete').status_code == 404
+    assert_invariants(app)
+
+
+def test_current_version_is_not_chunked(app, client):
+    v1 = bytes(range(256)) * 4096
+    v2 = v1[::-1]
+    upload(client, 'data.txt', v1)
+    fid = file_id(app, 'data.txt')
+    upload(client, 'data.txt', v2, new_version=True)
+    chunk_pending_versions(app)
+
+    # 当前版本只存一份完整内容，不再额外写入块
+    with app.app_context():
+        current = FileVersion.query.filter_by(file_id=fid, version=2).one()
+        assert not chunker.chunk_version(current.id)
+        assert current.chunk_count is None
+        assert VersionChunk.query.filter_by(version_id=current.id).count() == 0
+        chunk_hashes = set(db.session.scalars(select(VersionChunk.chunk_hash)))
+        assert chunk_hashes and all(blob_store.exists(chunk_hash) for chunk_hash in chunk_hashes)
+        assert hashlib.sha256(v2).hexdigest() not in chunk_hashes
+        db.session.remove()
+    assert_invariants(app)
+
+    # 出现新版本后原来的当前版本才分块
+    upload(client, 'data.txt', v1 + b'tail', new_version=True)
+    chunk_pending_versions(app)
+    with app.app_context():
+        chunked = [version.chunk_count is not None for version in FileVersion.query.order_by(FileVersion.version)]
+        assert chunked == [True, True, False]
+        db.session.remove()
+    assert client.get(f'/file_management/versions/{fid}/2').data == v2
+    assert_invariants(app)
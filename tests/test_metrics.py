@@ -0,0 +1,73 @@
+import re
+import pytest
+from conftest import upload
+
+SAMPLE = re.compile(r'^(\w+)(\{[^}]*\})? (\S+)$')
+
+
+def scrape(client):
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    samples = {}
+    for line in response.get_data(as_text=True).splitlines():
+        match = SAMPLE.match(line)
+        if match:
+            samples[match.group(1) + (match.group(2) or '')] = float(match.group(3))
+    return samples
+
+
+def delta(before, after, key):
+    return after.get(key, 0) - before.get(key, 0)
+
+
+def test_requests_and_sql_are_counted(app, client):
+    upload(client, 'a.txt', b'abc')
+    before = scrape(client)
+    assert client.get('/file_management/files').status_code == 200
+    after = scrape(client)
+
+    labels = '{endpoint="file_management.file_list",method="GET"'
+    assert delta(before, after, 'clouddrive_http_requests_total' + labels + ',status="200"}') == 1
+    assert delta(before, after, 'clouddrive_http_request_duration_seconds_count' + labels + '}') == 1
+    assert delta(before, after, 'clouddrive_sql_statements_per_request_count{endpoint="file_management.file_list"}') == 1
+    assert delta(before, after, 'clouddrive_sql_statements_per_request_sum{endpoint="file_management.file_list"}') >= 1
+    assert delta(before, after, 'clouddrive_http_response_bytes_total{endpoint="file_management.file_list"}') > 0
+
+
+def test_streamed_response_bytes_are_counted(app, client):
+    upload(client, 'a.txt', b'abc')
+    before = scrape(client)
+    response = client.get('/file_management/export_directory')
+    body = response.get_data()
+    after = scrape(client)
+    assert delta(before, after, 'clouddrive_http_response_bytes_total{endpoint="file_management.export_directory"}') \
+        == len(body)
+
+
+@pytest.mark.parametrize('propagate', [True, False])
+def test_unhandled_errors_are_recorded_once_as_500(app, client, propagate):
+    def explode():
+        raise RuntimeError('boom')
+
+    app.add_url_rule('/explode', 'explode', explode)
+    app.config['PROPAGATE_EXCEPTIONS'] = propagate
+    before = scrape(client)
+    if propagate:
+        with pytest.raises(RuntimeError):
+            client.get('/explode')
+    else:
+        assert client.get('/explode').status_code == 500
+    after = scrape(client)
+    assert delta(before, after, 'clouddrive_http_requests_total{endpoint="explode",method="GET",status="500"}') == 1
+    assert delta(before, after, 'clouddrive_http_request_duration_seconds_count{endpoint="explode",method="GET"}') == 1
+
+
+def test_component_snapshots_are_exported(app, client):
+    samples = scrape(client)
+    for name in ('clouddrive_converter_submitted_total', 'clouddrive_preview_cache_hits_total',
+                 'clouddrive_listing_cache_hits_total', 'clouddrive_thumbnails_generated_total'):
+        assert name in samples
+    # 多次 create_app 不会重复导出同名指标
+    text = client.get('/metrics').get_data(as_text=True)
+    assert text.count('# TYPE clouddrive_converter_submitted_total counter') == 1
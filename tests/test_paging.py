@@ -0,0 +1,73 @@
+from conftest import upload, create_folder
+from models import File
+
+FILES_URL = '/file_management/files'
+
+
+def fetch_pages(client, limit, **params):
+    pages = []
+    cursor = None
+    while True:
+        query = dict(params, limit=limit)
+        if cursor:
+            query['cursor'] = cursor
+        response = client.get(FILES_URL, query_string=query)
+        assert response.status_code == 200
+        pages.append([item['id'] for item in response.get_json()])
+        cursor = response.headers.get('X-Next-Cursor')
+        if not cursor:
+            return pages
+
+
+def populate(app, client):
+    # 大小和时间都有大量重复，翻页必须靠 id 打破平局
+    for i in range(23):
+        upload(client, f'f{i % 5}_{i:02d}.txt', b'x' * (i % 4) + str(i).encode())
+    create_folder(client, app, 'folder')
+    with app.app_context():
+        return File.query.filter_by(parent_id=None, is_favorite_folder=False).all()
+
+
+def expected_order(files, sort, descending):
+    key = {
+        'name': lambda f: f.filename,
+        'created_at': lambda f: f.created_at,
+        'updated_at': lambda f: f.updated_at,
+        'size': lambda f: f.size or 0,
+    }[sort]
+    return [f.id for f in sorted(files, key=lambda f: (key(f), f.id), reverse=descending)]
+
+
+def test_cursor_pages_have_no_duplicates_or_gaps(app, client):
+    files = populate(app, client)
+    for sort in ('name', 'created_at', 'updated_at', 'size'):
+        for order in ('asc', 'desc'):
+            pages = fetch_pages(client, 5, sort=sort, order=order)
+            assert all(len(page) == 5 for page in pages[:-1])
+            assert 0 < len(pages[-1]) <= 5
+            flat = [file_id for page in pages for file_id in page]
+            assert flat == expected_order(files, sort, order == 'desc'), (sort, order)
+
+
+def test_rows_inserted_before_cursor_do_not_shift_pages(app, client):
+    populate(app, client)
+    first = client.get(FILES_URL, query_string={'sort': 'name', 'limit': 10})
+    seen = [item['id'] for item in first.get_json()]
+    cursor = first.headers['X-Next-Cursor']
+
+    # 在已读过的位置插入新行，偏移分页会让下一页重复一行
+    upload(client, 'a_new.txt', b'new')
+    rest = client.get(FILES_URL, query_string={'sort': 'name', 'limit': 100, 'cursor': cursor})
+    remaining = [item['id'] for item in rest.get_json()]
+    assert not set(seen) & set(remaining)
+    assert len(seen) + len(remaining) == 24
+
+
+def test_unpaged_listing_and_invalid_cursor(app, client):
+    files = populate(app, client)
+    response = client.get(FILES_URL, query_string={'sort': 'size', 'order': 'desc'})
+    assert [item['id'] for item in response.get_json()] == expected_order(files, 'size', True)
+    assert 'X-Next-Cursor' not in response.headers
+
+    assert client.get(FILES_URL, query_string={'limit': 5, 'cursor': 'garbage'}).status_code == 400
+    assert client.get(FILES_URL, query_string={'sort': 'owner'}).status_code == 400
@@ -0,0 +1,82 @@
+import os
+import pytest
+from conftest import upload, file_id
+from extensions import db
+from models import File
+from preview_cache import ConversionCache, ConverterUnavailable, conversion_cache
+
+
+def make_cache(tmp_path, provider):
+    cache = ConversionCache()
+    cache.root = str(tmp_path / 'previews')
+    cache.max_bytes = 1024 * 1024
+    os.makedirs(cache.tmp_dir)
+    cache.version_provider = provider
+    return cache
+
+
+def producer(calls, data=b'%PDF'):
+    def produce(path):
+        calls.append(path)
+        with open(path, 'wb') as f:
+            f.write(data)
+    return produce
+
+
+def test_nothing_is_cached_while_version_is_unknown(tmp_path):
+    versions = [None]
+    cache = make_cache(tmp_path, lambda: versions[0])
+    calls = []
+
+    assert cache.lookup('abc', 'pdf') is None
+    with pytest.raises(ConverterUnavailable):
+        cache.get_or_create('abc', 'pdf', producer(calls))
+    assert calls == []
+    assert cache.total_bytes == 0
+
+    # 版本查到后转换结果写入缓存，之后直接命中
+    versions[0] = 'LibreOffice 7.6'
+    path = cache.get_or_create('abc', 'pdf', producer(calls))
+    assert len(calls) == 1
+    assert cache.lookup('abc', 'pdf') == path
+    assert cache.get_or_create('abc', 'pdf', producer(calls)) == path
+    assert len(calls) == 1
+
+
+def test_converter_upgrade_invalidates_entries(tmp_path):
+    cache = make_cache(tmp_path, lambda: 'LibreOffice 7.6')
+    calls = []
+    old_path = cache.get_or_create('abc', 'pdf', producer(calls))
+    cache.version = 'LibreOffice 24.2'
+    assert cache.lookup('abc', 'pdf') is None
+    assert cache.get_or_create('abc', 'pdf', producer(calls)) != old_path
+    assert len(calls) == 2
+
+
+def test_eviction_keeps_recent_entries(tmp_path):
+    cache = make_cache(tmp_path, lambda: 'v1')
+    cache.max_bytes = 250
+    calls = []
+    for index in range(5):
+        cache.get_or_create(f'h{index}', 'pdf', producer(calls, b'x' * 100))
+    assert cache.total_bytes <= 250
+    assert cache.lookup('h4', 'pdf')
+    assert cache.lookup('h0', 'pdf') is None
+    assert cache.snapshot()['evictions'] == 3
+
+
+def test_preview_status_matches_cache(app, client, monkeypatch):
+    upload(client, 'report.docx', b'not really a document')
+    fid = file_id(app, 'report.docx')
+    with app.app_context():
+        content_hash = db.session.get(File, fid).content_hash
+
+    monkeypatch.setattr(conversion_cache, 'version', None)
+    monkeypatch.setattr(conversion_cache, 'version_provider', lambda: None)
+    assert client.get(f'/file_management/preview_status/{fid}').get_json()['status'] == 'idle'
+
+    monkeypatch.setattr(conversion_cache, 'version_provider', lambda: 'v1')
+    conversion_cache.get_or_create(content_hash, 'pdf', producer([]))
+    response = client.get(f'/file_management/preview_status/{fid}').get_json()
+    assert response['status'] == 'ready'
+    assert client.get(response['url']).data == b'%PDF'
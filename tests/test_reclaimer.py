@@ -0,0 +1,91 @@
+import os
+import time
+import pytest
+from conftest import upload, file_id
+from extensions import db
+from models import Blob
+from storage import blob_store, blob_reclaimer, add_blob_reference
+
+DATA = b'reclaim me' * 100
+
+
+@pytest.fixture
+def released(app, client):
+    # 上传后删除，留下一个计数为零且已过宽限期的 Blob
+    upload(client, 'a.txt', DATA)
+    fid = file_id(app, 'a.txt')
+    with app.app_context():
+        content_hash = db.session.scalar(db.select(Blob.hash))
+    assert client.post('/file_management/delete', json={'file_ids': [fid]}).get_json()['success']
+    old = time.time() - 3600
+    os.utime(blob_store.path(content_hash), (old, old))
+    return content_hash
+
+
+def blob_row(content_hash):
+    return db.session.get(Blob, content_hash)
+
+
+def test_reclaim_removes_unreferenced_blob(app, released):
+    with app.app_context():
+        assert blob_row(released).ref_count == 0
+        assert blob_reclaimer.reclaim() == 1
+        assert blob_row(released) is None
+        assert not os.path.exists(blob_store.path(released))
+        assert not os.listdir(os.path.dirname(blob_store.path(released)))
+
+
+def test_recently_adopted_blob_is_kept(app, released):
+    with app.app_context():
+        # 相同内容的上传刚刚复用了文件，修改时间被刷新
+        blob_store.write_chunks([DATA])
+        assert blob_reclaimer.reclaim() == 0
+        assert blob_row(released) is not None
+        assert blob_store.exists(released)
+
+
+def test_adopt_after_retire_writes_a_new_file(app, released, monkeypatch):
+    retire = blob_store.retire
+
+    def retire_then_upload(content_hash, cutoff):
+        tombstone = retire(content_hash, cutoff)
+        # 并发上传在改名之后到达，看不到文件，重新写入
+        assert blob_store.write_chunks([DATA]) == (released, len(DATA))
+        return tombstone
+
+    with app.app_context():
+        monkeypatch.setattr(blob_store, 'retire', retire_then_upload)
+        assert blob_reclaimer.reclaim() == 1
+        # 上传随后插入新的 Blob 行，文件必须仍然存在
+        add_blob_reference(released, len(DATA))
+        db.session.commit()
+        with blob_store.open(released) as f:
+            assert f.read() == DATA
+
+
+def test_reference_added_after_retire_revives_file(app, released, monkeypatch):
+    retire = blob_store.retire
+
+    def retire_then_reference(content_hash, cutoff):
+        tombstone = retire(content_hash, cutoff)
+        add_blob_reference(content_hash, len(DATA))
+        return tombstone
+
+    with app.app_context():
+        monkeypatch.setattr(blob_store, 'retire', retire_then_reference)
+        assert blob_reclaimer.reclaim() == 0
+        assert blob_row(released).ref_count == 1
+        with blob_store.open(released) as f:
+            assert f.read() == DATA
+        assert not os.path.exists(blob_store.path(released) + '.reclaim')
+
+
+def test_orphaned_write_is_reclaimed_after_grace(app):
+    with app.app_context():
+        content_hash, _ = blob_store.write_chunks([b'orphan'])
+        db.session.rollback()
+        old = time.time() - 3600
+        os.utime(blob_store.path(content_hash), (old, old))
+        blob_reclaimer.orphans[content_hash] = old
+        assert blob_reclaimer.reclaim_orphans() == 1
+        assert not blob_store.exists(content_hash)
@@ -0,0 +1,93 @@
+import sqlite3
+from sqlalchemy import text
+from app import create_app
+from conftest import make_config, upload, create_user, file_id
+from extensions import db
+import search_index
+
+
+def fill_index(start_user, users, files_per_user):
+    rows = [{'file_id': user * files_per_user + index, 'uploader_id': user,
+             'filename': f'report {index}', 'tags': 'work', 'content': 'quarterly report draft'}
+            for user in range(start_user, start_user + users) for index in range(files_per_user)]
+    for start in range(0, len(rows), search_index.BATCH_SIZE):
+        search_index._upsert(db.session, 'sqlite', rows[start:start + search_index.BATCH_SIZE])
+    db.session.commit()
+
+
+def vm_steps(uploader_id, query):
+    # 统计 SQLite 虚拟机执行的指令数，比计时稳定，不受机器负载影响
+    steps = 0
+
+    def count():
+        nonlocal steps
+        steps += 1
+
+    connection = db.session.connection().connection.driver_connection
+    connection.set_progress_handler(count, 100)
+    try:
+        results = search_index.search(uploader_id, query)
+    finally:
+        connection.set_progress_handler(None, 0)
+    return steps, results
+
+
+def test_search_only_returns_own_files(app, client):
+    upload(client, 'report_alice.txt', b'a')
+    with client.session_transaction() as session:
+        alice_id = session['_user_id']
+        session['_user_id'] = str(create_user(app, 'bob'))
+    upload(client, 'report_bob.txt', b'b')
+    with client.session_transaction() as session:
+        session['_user_id'] = alice_id
+
+    results = client.get('/file_management/search_files', query_string={'q': 'report'}).get_json()
+    assert [item['id'] for item in results] == [file_id(app, 'report_alice.txt')]
+    assert client.get('/file_management/search_files', query_string={'filename': 'bob'}).get_json() == []
+
+
+def test_search_cost_does_not_grow_with_other_users(app):
+    # 其他用户的文档不参与匹配和排序，查询代价只取决于本用户的文档数
+    with app.app_context():
+        fill_index(1, 11, 50)
+        small_steps, results = vm_steps(1, 'report')
+        assert len(results) == 50
+        fill_index(12, 400, 50)
+        large_steps, results = vm_steps(1, 'report')
+        assert len(results) == 50
+        assert large_steps < small_steps * 2
+
+
+def test_old_index_is_upgraded_in_place(tmp_path):
+    config = make_config(tmp_path)
+    connection = sqlite3.connect(tmp_path / 'app.db')
+    connection.execute("CREATE VIRTUAL TABLE file_search USING fts5("
+                       "filename, tags, content, uploader_id UNINDEXED, prefix='2 3')")
+    connection.execute("INSERT INTO file_search (rowid, filename, tags, content, uploader_id) "
+                       "VALUES (7, 'budget', '', 'extracted text', 3)")
+    connection.commit()
+    connection.close()
+
+    app = create_app(config)
+    with app.app_context():
+        assert 'uploader_id' not in {row[1] for row in db.session.execute(text('PRAGMA table_info(file_search)'))}
+        assert search_index.search(3, 'extracted') == [7]
+        assert search_index.search(4, 'extracted') == []
+        db.session.remove()
+        db.engine.dispose()
+
+
+def test_renames_and_extracted_content_stay_scoped(app, client):
+    upload(client, 'notes.txt', '季度预算 quarterly'.encode('utf-8'))
+    fid = file_id(app, 'notes.txt')
+    with app.app_context():
+        assert search_index.search(1, 'quarterly') == []
+        assert search_index.content_indexer.index_content([fid]) == 1
+        assert search_index.search(1, 'quart') == [fid]
+        assert search_index.search(1, '预算') == [fid]
+        assert search_index.search(2, 'quarterly') == []
+
+    assert client.post('/file_management/rename', json={'file_id': fid, 'new_name': 'minutes.txt'}).status_code == 200
+    with app.app_context():
+        assert search_index.search(1, None, filename='minutes') == [fid]
+        assert search_index.search(1, None, filename='notes') == []
@@ -0,0 +1,66 @@
+from conftest import upload, file_id, create_user
+from tagging import parse_tags
+
+TAGGED = {
+    'a.txt': 'work urgent',
+    'b.txt': 'work',
+    'c.txt': 'personal urgent',
+    'd.txt': 'personal',
+    'e.txt': '',
+}
+
+
+def tagged(client, **params):
+    response = client.get('/file_management/tags/files', query_string=params)
+    assert response.status_code == 200
+    return sorted(item['filename'] for item in response.get_json())
+
+
+def populate(client):
+    for name, tags in TAGGED.items():
+        upload(client, name, name.encode(), tags=tags)
+
+
+def test_parse_tags_splits_and_dedupes():
+    assert parse_tags('work, urgent；工作 work\turgent') == ['work', 'urgent', '工作']
+    assert parse_tags('') == []
+    assert parse_tags(None) == []
+    assert parse_tags('x' * 100) == ['x' * 64]
+
+
+def test_all_any_none_semantics(app, client):
+    populate(client)
+    assert tagged(client, all='work urgent') == ['a.txt']
+    assert tagged(client, all='work') == ['a.txt', 'b.txt']
+    # 重复的标签不影响 AND 的计数
+    assert tagged(client, all='work,work') == ['a.txt', 'b.txt']
+    assert tagged(client, any='work personal') == ['a.txt', 'b.txt', 'c.txt', 'd.txt']
+    assert tagged(client, none='urgent') == ['b.txt', 'd.txt', 'e.txt']
+    assert tagged(client, any='work personal', none='urgent') == ['b.txt', 'd.txt']
+    assert tagged(client, all='urgent', any='personal') == ['c.txt']
+    assert tagged(client, all='work missing') == []
+    assert tagged(client, any='missing') == []
+    assert client.get('/file_management/tags/files').status_code == 400
+
+
+def test_tags_are_scoped_to_owner(app, client):
+    populate(client)
+    with client.session_transaction() as session:
+        alice_id = session['_user_id']
+        session['_user_id'] = str(create_user(app, 'bob'))
+    upload(client, 'bob.txt', b'bob', tags='work')
+    assert tagged(client, any='work') == ['bob.txt']
+    assert tagged(client, none='work') == []
+    with client.session_transaction() as session:
+        session['_user_id'] = alice_id
+    assert tagged(client, any='work') == ['a.txt', 'b.txt']
+
+
+def test_tag_counts_follow_changes(app, client):
+    populate(client)
+    counts = {tag['name']: tag['file_count'] for tag in client.get('/file_management/tags').get_json()}
+    assert counts == {'work': 2, 'urgent': 2, 'personal': 2}
+
+    client.post('/file_management/delete', json={'file_ids': [file_id(app, 'a.txt')]})
+    counts = {tag['name']: tag['file_count'] for tag in client.get('/file_management/tags').get_json()}
+    assert counts == {'work': 1, 'urgent': 1, 'personal': 2}
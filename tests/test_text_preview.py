@@ -0,0 +1,108 @@
+import os
+import codecs
+import text_preview
+from storage import blob_store
+from extensions import db
+from models import File
+from conftest import upload, file_id
+
+TEXT_URL = '/file_management/text'
+
+
+def text_file(app, client, name, data):
+    upload(client, name, data)
+    return file_id(app, name)
+
+
+def test_line_pages_cover_every_line(app, client, monkeypatch):
+    # 索引块调小，让各页的起点都要经过索引定位再在块内数换行
+    monkeypatch.setattr(text_preview, 'INDEX_BLOCK', 100)
+    lines = [f'第 {number} 行' for number in range(2500)]
+    fid = text_file(app, client, 'log.txt', '\n'.join(lines).encode('utf-8'))
+
+    collected, start_line = [], 0
+    while start_line is not None:
+        page = client.get(f'{TEXT_URL}/{fid}', query_string={'start_line': start_line, 'lines': 700}).get_json()
+        assert page['start_line'] == start_line and page['total_lines'] == 2500
+        assert len(page['lines']) == min(700, 2500 - start_line)
+        collected.extend(page['lines'])
+        start_line = page['next_line']
+    assert collected == lines
+
+    # 单页行数不超过上限，起点越界时返回空页
+    page = client.get(f'{TEXT_URL}/{fid}', query_string={'start_line': 1, 'lines': 5000}).get_json()
+    assert len(page['lines']) == app.config['TEXT_PREVIEW_MAX_LINES']
+    page = client.get(f'{TEXT_URL}/{fid}', query_string={'start_line': 2500}).get_json()
+    assert page['lines'] == [] and page['next_line'] is None
+
+    # 行索引在首次访问时生成并随内容存放
+    with app.app_context():
+        content_hash = db.session.get(File, fid).content_hash
+    assert os.path.exists(blob_store.variant_path(content_hash, 'lines', 'idx'))
+
+
+def test_byte_windows_align_to_lines(app, client):
+    data = ''.join(f'中文第 {number} 行\r\n' for number in range(300)).encode('utf-8')
+    fid = text_file(app, client, 'windows.txt', data)
+
+    text, offset = '', 0
+    while offset is not None:
+        page = client.get(f'{TEXT_URL}/{fid}', query_string={'offset': offset, 'length': 1000}).get_json()
+        assert page['offset'] == offset
+        text += page['text']
+        offset = page['next_offset']
+    assert text.encode('utf-8') == data
+
+    # 起点落在多字节字符中间时移到下一行开头，不会输出残缺字符
+    page = client.get(f'{TEXT_URL}/{fid}', query_string={'offset': 1, 'length': 100}).get_json()
+    first_line = len('中文第 0 行\r\n'.encode('utf-8'))
+    assert page['offset'] == first_line
+    assert page['text'].startswith('中文第 1 行') and page['text'].endswith('\n')
+    assert '�' not in page['text']
+
+
+def test_long_line_is_cut_on_character_boundary(app, client):
+    app.config['TEXT_PREVIEW_MAX_BYTES'] = 1000
+    fid = text_file(app, client, 'long.txt', '中'.encode('utf-8') * 1000 + b'\nend\n')
+
+    page = client.get(f'{TEXT_URL}/{fid}', query_string={'lines': 10}).get_json()
+    assert page['truncated']
+    assert page['lines'] == ['中' * 333]
+    assert page['next_line'] == 1
+    page = client.get(f'{TEXT_URL}/{fid}', query_string={'start_line': 1}).get_json()
+    assert page['lines'] == ['end'] and not page['truncated']
+
+
+def test_detects_encoding(app, client):
+    fid = text_file(app, client, 'utf16.txt', codecs.BOM_UTF16_LE + '一\n二\n'.encode('utf-16-le'))
+    page = client.get(f'{TEXT_URL}/{fid}').get_json()
+    assert page['encoding'] == 'utf-16-le'
+    assert page['lines'] == ['一', '二']
+
+    text = '这是一个用 GBK 编码保存的中文文本文件。\n' * 20
+    fid = text_file(app, client, 'gbk.txt', text.encode('gbk'))
+    page = client.get(f'{TEXT_URL}/{fid}').get_json()
+    assert page['encoding'] != 'utf-8'
+    assert page['lines'] == text.splitlines()
+
+
+def test_text_etag_and_preview_truncation(app, client):
+    app.config['TEXT_PREVIEW_MAX_BYTES'] = 100
+    fid = text_file(app, client, 'notes.txt', b'line\n' * 50)
+
+    url = f'{TEXT_URL}/{fid}?start_line=10&lines=5'
+    response = client.get(url)
+    assert response.get_json()['lines'] == ['line'] * 5
+    assert client.get(url, headers={'If-None-Match': response.headers['ETag']}).status_code == 304
+    # 不同页的 ETag 不同
+    other = client.get(f'{TEXT_URL}/{fid}?start_line=15&lines=5', headers={'If-None-Match': response.headers['ETag']})
+    assert other.status_code == 200
+
+    response = client.get(f'/file_management/preview_content/{fid}')
+    assert response.headers['X-Text-Truncated'] == 'true'
+    assert response.get_data(as_text=True) == 'line\n' * 20
+
+    fid = text_file(app, client, 'short.txt', b'short\n')
+    response = client.get(f'/file_management/preview_content/{fid}')
+    assert response.headers['X-Text-Truncated'] == 'false'
+    assert response.headers['X-Text-Encoding'] == 'utf-8'
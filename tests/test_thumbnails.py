@@ -0,0 +1,70 @@
+import io
+import pytest
+from conftest import upload, file_id
+from models import File
+from thumbnails import thumbnail_generator, VARIANTS
+
+Image = pytest.importorskip('PIL.Image')
+
+
+def png_bytes(size, color=(200, 30, 30)):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, color).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+def content_hash(app, name):
+    with app.app_context():
+        return File.query.filter_by(filename=name).one().content_hash
+
+
+def test_thumbnail_is_scaled_and_cacheable(app, client):
+    upload(client, 'wide.png', png_bytes((2000, 1000)))
+    url = f'/file_management/thumbnail/{file_id(app, "wide.png")}/thumb'
+
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.mimetype == f'image/{thumbnail_generator.format}'
+    assert Image.open(io.BytesIO(response.data)).size == (256, 128)
+    assert 'immutable' in response.headers['Cache-Control']
+    assert 'private' in response.headers['Cache-Control']
+    assert client.get(url, headers={'If-None-Match': response.headers['ETag']}).status_code == 304
+
+    # 一次生成全部尺寸
+    for variant, size in VARIANTS.items():
+        assert max(Image.open(thumbnail_generator.path(content_hash(app, 'wide.png'), variant)).size) == size
+
+
+def test_identical_images_are_generated_once(app, client):
+    data = png_bytes((800, 800))
+    upload(client, 'a.png', data)
+    upload(client, 'b.png', data)
+    before = thumbnail_generator.snapshot()
+    assert client.get(f'/file_management/thumbnail/{file_id(app, "a.png")}/small').status_code == 200
+    assert client.get(f'/file_management/thumbnail/{file_id(app, "b.png")}/small').status_code == 200
+    after = thumbnail_generator.snapshot()
+    assert after['generated'] - before['generated'] == len(VARIANTS)
+
+
+def test_undecodable_image_falls_back_to_original(app, client):
+    upload(client, 'broken.png', b'not an image at all')
+    response = client.get(f'/file_management/thumbnail/{file_id(app, "broken.png")}/thumb')
+    assert response.status_code == 200
+    assert response.data == b'not an image at all'
+    assert response.mimetype == 'image/png'
+
+
+def test_without_pillow_original_is_served(app, client, monkeypatch):
+    data = png_bytes((300, 300))
+    upload(client, 'plain.png', data)
+    monkeypatch.setattr(thumbnail_generator, 'format', None)
+    response = client.get(f'/file_management/thumbnail/{file_id(app, "plain.png")}/medium')
+    assert response.status_code == 200
+    assert response.data == data
+
+
+def test_unknown_variant_and_non_images(app, client):
+    upload(client, 'img.png', png_bytes((10, 10)))
+    upload(client, 'doc.txt', b'text')
+    assert client.get(f'/file_management/thumbnail/{file_id(app, "img.png")}/huge').status_code == 404
+    assert client.get(f'/file_management/thumbnail/{file_id(app, "doc.txt")}/thumb').status_code == 404
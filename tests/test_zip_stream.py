@@ -0,0 +1,67 @@
+import io
+import zipfile
+from conftest import upload, file_id, create_folder
+
+TEXT = b'hello world\n' * 5000
+IMAGE = bytes(range(256)) * 100
+
+
+def read_zip(response):
+    assert response.status_code == 200
+    assert response.mimetype == 'application/zip'
+    archive = zipfile.ZipFile(io.BytesIO(response.data))
+    assert archive.testzip() is None
+    return archive
+
+
+def build_tree(app, client):
+    docs_id = create_folder(client, app, 'docs')
+    empty_id = create_folder(client, app, 'empty', docs_id)
+    sub_id = create_folder(client, app, 'sub', docs_id)
+    upload(client, 'a.txt', TEXT, parent_id=docs_id)
+    upload(client, 'b.png', IMAGE, parent_id=sub_id)
+    return docs_id, empty_id
+
+
+def test_folder_download_round_trips(app, client):
+    docs_id, _ = build_tree(app, client)
+    archive = read_zip(client.get(f'/file_management/serve_file_for_download/{docs_id}'))
+
+    assert sorted(archive.namelist()) == ['docs/', 'docs/a.txt', 'docs/empty/', 'docs/sub/', 'docs/sub/b.png']
+    assert archive.read('docs/a.txt') == TEXT
+    assert archive.read('docs/sub/b.png') == IMAGE
+    assert archive.getinfo('docs/empty/').is_dir()
+    # 文本压缩，图片按原样存储
+    assert archive.getinfo('docs/a.txt').compress_type == zipfile.ZIP_DEFLATED
+    assert archive.getinfo('docs/sub/b.png').compress_type == zipfile.ZIP_STORED
+
+
+def test_selection_download_mixes_files_and_folders(app, client):
+    _, empty_id = build_tree(app, client)
+    upload(client, 'top.txt', b'top')
+    response = client.post('/file_management/download', json={'file_ids': [file_id(app, 'top.txt'), empty_id]})
+    archive = read_zip(response)
+
+    assert sorted(archive.namelist()) == ['empty/', 'top.txt']
+    assert archive.read('top.txt') == b'top'
+    assert 'files.zip' in response.headers['Content-Disposition']
+
+
+def test_large_entries_use_zip64(app, client, monkeypatch):
+    # 把 ZIP64 阈值调低，不必真的生成 4 GiB 的文件就能走到 ZIP64 本地头和中央目录
+    monkeypatch.setattr(zipfile, 'ZIP64_LIMIT', 1024)
+    docs_id, _ = build_tree(app, client)
+    archive = read_zip(client.get(f'/file_management/serve_file_for_download/{docs_id}'))
+
+    info = archive.getinfo('docs/a.txt')
+    assert info.extra[:2] == b'\x01\x00'
+    assert archive.read('docs/a.txt') == TEXT
+
+
+def test_zip_response_is_streamed(app, client):
+    docs_id, _ = build_tree(app, client)
+    response = client.get(f'/file_management/serve_file_for_download/{docs_id}', buffered=False)
+    assert response.is_streamed
+    assert 'Content-Length' not in response.headers
+    assert zipfile.ZipFile(io.BytesIO(b''.join(response.response))).read('docs/a.txt') == TEXT
+    response.close()
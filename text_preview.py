@@ -0,0 +1,165 @@
+import os
+import codecs
+from array import array
+from bisect import bisect_left
+from storage import blob_store, CHUNK_SIZE
+
+try:
+    from charset_normalizer import from_bytes
+except ImportError:
+    from_bytes = None
+
+DETECT_BYTES = 64 * 1024
+# 行索引每隔 INDEX_BLOCK 字节记录一次（块起始偏移, 之前的换行数），定位某一行最多再扫描一个块
+INDEX_BLOCK = 64 * 1024
+BOMS = (
+    (codecs.BOM_UTF8, 'utf-8'),
+    (codecs.BOM_UTF16_LE, 'utf-16-le'),
+    (codecs.BOM_UTF16_BE, 'utf-16-be'),
+)
+
+
+def detect_encoding(prefix):
+    # 返回 (编码, BOM 长度)；先看 BOM，再依次尝试 UTF-8、charset_normalizer、GB18030
+    for bom, encoding in BOMS:
+        if prefix.startswith(bom):
+            return encoding, len(bom)
+    try:
+        codecs.getincrementaldecoder('utf-8')().decode(prefix, final=False)
+        return 'utf-8', 0
+    except UnicodeDecodeError:
+        pass
+    if from_bytes is not None:
+        best = from_bytes(prefix).best()
+        if best is not None:
+            return best.encoding, 0
+    try:
+        codecs.getincrementaldecoder('gb18030')().decode(prefix, final=False)
+        return 'gb18030', 0
+    except UnicodeDecodeError:
+        return 'latin-1', 0
+
+
+class TextFile:
+    # 按页读取文本内容，每次只读取请求的窗口（不超过 max_bytes），内存占用与文件大小无关
+    def __init__(self, content_hash, max_bytes):
+        self.content_hash = content_hash
+        self.path = blob_store.path(content_hash)
+        self.size = os.path.getsize(self.path)
+        self.max_bytes = max_bytes
+        with open(self.path, 'rb') as f:
+            self.encoding, self.start = detect_encoding(f.read(DETECT_BYTES))
+        self.newline = '\n'.encode(self.encoding)
+
+    def decode(self, data, final=True):
+        # final=False 时丢弃末尾不完整的多字节字符，窗口截断在字符中间也不会出现乱码
+        decoder = codecs.getincrementaldecoder(self.encoding)(errors='replace')
+        return decoder.decode(data, final=final).rstrip('\r') if final else decoder.decode(data, final=False)
+
+    def line_index(self):
+        # 首次访问时扫描一遍生成索引，与内容一起按哈希存放，内容回收时一并删除
+        index = array('Q')
+        path = blob_store.variant_path(self.content_hash, 'lines', 'idx')
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                index.frombytes(f.read())
+            return index
+
+        lines = 0
+        offset = self.start
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            for block in iter(lambda: f.read(CHUNK_SIZE), b''):
+                for start in range(0, len(block), INDEX_BLOCK):
+                    index.extend((offset + start, lines))
+                    lines += block.count(self.newline, start, start + INDEX_BLOCK)
+                offset += len(block)
+        index.extend((self.size, lines))
+
+        fd, tmp_path = blob_store.mkstemp(suffix='.idx')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(index.tobytes())
+        os.replace(tmp_path, path)
+        return index
+
+    def total_lines(self, index):
+        # 最后一行没有换行符时也算一行
+        if self.size <= self.start:
+            return 0
+        with open(self.path, 'rb') as f:
+            f.seek(self.size - len(self.newline))
+            ends_with_newline = f.read() == self.newline
+        return index[-1] if ends_with_newline else index[-1] + 1
+
+    def line_offset(self, f, line, index):
+        if line == 0:
+            return self.start
+        # 找到之前换行数小于 line 的最后一个块，再在块内向后数剩余的换行
+        block = bisect_left(index[1::2], line) - 1
+        offset, skip = index[block * 2], line - index[block * 2 + 1]
+        f.seek(offset)
+        for data in iter(lambda: f.read(INDEX_BLOCK), b''):
+            position = 0
+            while skip:
+                found = data.find(self.newline, position)
+                if found < 0:
+                    break
+                position = found + len(self.newline)
+                skip -= 1
+            if not skip:
+                return offset + position
+            offset += len(data)
+        return self.size
+
+    def read_lines(self, start_line, count):
+        index = self.line_index()
+        total = self.total_lines(index)
+        lines = []
+        truncated = False
+        if start_line < total:
+            with open(self.path, 'rb') as f:
+                offset = self.line_offset(f, start_line, index)
+                f.seek(offset)
+                data = f.read(self.max_bytes)
+            position = 0
+            while len(lines) < count and position < len(data):
+                found = data.find(self.newline, position)
+                if found < 0:
+                    # 单行超过窗口大小时只返回窗口内的部分
+                    truncated = offset + len(data) < self.size
+                    lines.append(self.decode(data[position:], final=not truncated))
+                    break
+                lines.append(self.decode(data[position:found]))
+                position = found + len(self.newline)
+        return {'total_lines': total, 'start_line': start_line, 'lines': lines,
+                'next_line': start_line + len(lines) if start_line + len(lines) < total else None,
+                'truncated': truncated}
+
+    def read_window(self, offset, length):
+        # 字节窗口对齐到行边界：起点移到下一行开头，终点截到最后一个完整行
+        offset = max(offset, self.start)
+        length = max(1, min(length, self.max_bytes))
+        with open(self.path, 'rb') as f:
+            if offset > self.start:
+                f.seek(offset - len(self.newline))
+                data = f.read(length + len(self.newline))
+                if not data.startswith(self.newline):
+                    found = data.find(self.newline)
+                    if found >= 0:
+                        offset += found
+                        data = data[found:]
+                data = data[len(self.newline):]
+            else:
+                f.seek(offset)
+                data = f.read(length)
+
+        end = offset + len(data)
+        final = end >= self.size
+        if not final:
+            cut = data.rfind(self.newline)
+            if cut >= 0:
+                data = data[:cut + len(self.newline)]
+                end = offset + len(data)
+                final = True
+        return {'offset': offset, 'next_offset': end if end < self.size else None,
+                'text': self.decode(data, final=final) if data else ''}
@@ -0,0 +1,165 @@
+import os
+import time
+import queue
+import logging
+import threading
+from sqlalchemy import event, inspect
+from extensions import db
+from models import File
+from storage import blob_store
+
+try:
+    from PIL import Image, ImageOps, features
+except ImportError:
+    Image = None
+
+VARIANTS = {'thumb': 256, 'small': 640, 'medium': 1280}
+IMAGE_CATEGORY = 'images'
+
+
+def variant_format():
+    if Image is None:
+        return None
+    return 'webp' if features.check('webp') else 'jpeg'
+
+
+class ThumbnailGenerator:
+    # 后台线程为图片生成缩略图，与原始内容按哈希存放在同一目录，相同内容只生成一次
+    def __init__(self, app=None):
+        self.app = None
+        self.queue = queue.Queue()
+        self.threads = []
+        self.pending = set()
+        self.lock = threading.Lock()
+        self.stats = {'generated': 0, 'skipped': 0, 'failed': 0, 'seconds': 0.0}
+        self.logger = logging.getLogger(__name__)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.format = variant_format()
+        app.extensions['thumbnail_generator'] = self
+        if self.format is None:
+            self.logger.warning('Pillow is not installed, thumbnails fall back to the original images')
+            return
+        if app.config['THUMBNAILS_ENABLED'] and not self.threads:
+            for index in range(app.config['THUMBNAIL_WORKERS']):
+                thread = threading.Thread(target=self._run, name=f'thumbnails-{index}', daemon=True)
+                self.threads.append(thread)
+                thread.start()
+
+    def path(self, content_hash, variant):
+        return blob_store.variant_path(content_hash, variant, self.format)
+
+    def schedule(self, hashes):
+        if not self.threads:
+            return
+        for content_hash in hashes:
+            with self.lock:
+                if content_hash in self.pending:
+                    continue
+                self.pending.add(content_hash)
+            self.queue.put(content_hash)
+
+    def _run(self):
+        while True:
+            content_hash = self.queue.get()
+            try:
+                self.generate(content_hash)
+            except Exception as e:
+                self.logger.error(f'Thumbnail generation failed for {content_hash}: {e}')
+            finally:
+                with self.lock:
+                    self.pending.discard(content_hash)
+
+    def generate(self, content_hash):
+        missing = [variant for variant in VARIANTS if not os.path.exists(self.path(content_hash, variant))]
+        if not missing:
+            self._count('skipped')
+            return 0
+
+        started = time.perf_counter()
+        try:
+            with Image.open(blob_store.path(content_hash)) as image:
+                # JPEG 可以在解码时直接按比例缩小，大图的内存和耗时都明显降低
+                largest = max(VARIANTS[variant] for variant in missing)
+                image.draft('RGB', (largest, largest))
+                image = ImageOps.exif_transpose(image)
+                if image.mode not in ('RGB', 'RGBA'):
+                    image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+                if self.format == 'jpeg' and image.mode != 'RGB':
+                    image = image.convert('RGB')
+
+                # 从大到小逐级缩放，每一级都基于上一级结果
+                for variant in sorted(missing, key=VARIANTS.get, reverse=True):
+                    image.thumbnail((VARIANTS[variant], VARIANTS[variant]), Image.LANCZOS)
+                    self._save(image, content_hash, variant)
+        except Exception:
+            self._count('failed')
+            raise
+
+        with self.lock:
+            self.stats['generated'] += len(missing)
+            self.stats['seconds'] += time.perf_counter() - started
+        return len(missing)
+
+    def _save(self, image, content_hash, variant):
+        fd, tmp_path = blob_store.mkstemp(suffix=f'.{self.format}')
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                image.save(out, self.format.upper(), quality=80)
+            os.replace(tmp_path, self.path(content_hash, variant))
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def ensure(self, content_hash, variant):
+        # 历史文件没有缩略图时在首次访问时补生成
+        if self.format is None:
+            return None
+        path = self.path(content_hash, variant)
+        if not os.path.exists(path):
+            self.generate(content_hash)
+        return path
+
+    def snapshot(self):
+        with self.lock:
+            stats = dict(self.stats)
+            pending = len(self.pending)
+        stats['per_second'] = round(stats['generated'] / stats['seconds'], 1) if stats['seconds'] else None
+        stats['seconds'] = round(stats['seconds'], 3)
+        stats.update({'format': self.format, 'workers': len(self.threads), 'pending': pending})
+        return stats
+
+    def _count(self, name):
+        with self.lock:
+            self.stats[name] += 1
+
+
+thumbnail_generator = ThumbnailGenerator()
+
+
+@event.listens_for(db.session, 'after_flush')
+def collect_new_images(session, flush_context):
+    # 新文件以及上传了新版本的文件
+    hashes = {obj.content_hash for obj in session.new
+              if isinstance(obj, File) and obj.category == IMAGE_CATEGORY and obj.content_hash}
+    hashes.update(obj.content_hash for obj in session.dirty
+                  if isinstance(obj, File) and obj.category == IMAGE_CATEGORY and obj.content_hash
+                  and inspect(obj).attrs.content_hash.history.has_changes())
+    if hashes:
+        session.info.setdefault('thumbnail_hashes', set()).update(hashes)
+
+
+@event.listens_for(db.session, 'after_commit')
+def schedule_thumbnails(session):
+    hashes = session.info.pop('thumbnail_hashes', None)
+    if hashes:
+        thumbnail_generator.schedule(hashes)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def discard_thumbnails(session):
+    session.info.pop('thumbnail_hashes', None)
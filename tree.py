@@ -0,0 +1,199 @@
+from itertools import groupby
+from sqlalchemy import event, insert, delete, update, select, func, literal, bindparam, or_, true
+from sqlalchemy.orm import aliased
+from extensions import db
+from models import File, FileClosure, Favorite, Blob
+from storage import release_blobs, add_blob_references
+import search_index
+import tagging
+import usage
+import versioning
+
+BATCH_SIZE = 500
+
+closure_table = FileClosure.__table__
+
+
+def _batches(ids):
+    ids = list(ids)
+    for start in range(0, len(ids), BATCH_SIZE):
+        yield ids[start:start + BATCH_SIZE]
+
+
+def _insert_closure_rows(session, file_ids):
+    for batch in _batches(file_ids):
+        session.execute(insert(closure_table), [
+            {'ancestor_id': file_id, 'descendant_id': file_id, 'depth': 0} for file_id in batch
+        ])
+        session.execute(insert(closure_table).from_select(
+            ['ancestor_id', 'descendant_id', 'depth'],
+            select(FileClosure.ancestor_id, File.id, FileClosure.depth + 1)
+            .join(FileClosure, FileClosure.descendant_id == File.parent_id)
+            .where(File.id.in_(batch))
+        ))
+
+
+def _delete_closure_rows(session, file_ids):
+    for batch in _batches(file_ids):
+        session.execute(delete(closure_table).where(
+            or_(closure_table.c.descendant_id.in_(batch), closure_table.c.ancestor_id.in_(batch))
+        ))
+
+
+@event.listens_for(db.session, 'after_flush')
+def maintain_closure(session, flush_context):
+    new_files = [obj for obj in session.new if isinstance(obj, File)]
+    deleted_ids = [obj.id for obj in session.deleted if isinstance(obj, File)]
+
+    if deleted_ids:
+        _delete_closure_rows(session, deleted_ids)
+
+    # 同一次 flush 中可能同时新建父子节点，按层写入保证父节点的祖先记录已存在
+    pending = {file.id: file.parent_id for file in new_files}
+    while pending:
+        level = [file_id for file_id, parent_id in pending.items() if parent_id not in pending]
+        _insert_closure_rows(session, level)
+        for file_id in level:
+            del pending[file_id]
+
+
+def move_subtree(node_id, new_parent_id):
+    subtree = select(FileClosure.descendant_id).where(FileClosure.ancestor_id == node_id)
+    db.session.execute(delete(closure_table).where(
+        closure_table.c.descendant_id.in_(subtree),
+        closure_table.c.ancestor_id.not_in(subtree)
+    ))
+    if new_parent_id is None:
+        return
+
+    parent_path = aliased(FileClosure)
+    sub_path = aliased(FileClosure)
+    db.session.execute(insert(closure_table).from_select(
+        ['ancestor_id', 'descendant_id', 'depth'],
+        select(parent_path.ancestor_id, sub_path.descendant_id, parent_path.depth + sub_path.depth + 1)
+        .join(sub_path, true())
+        .where(parent_path.descendant_id == new_parent_id, sub_path.ancestor_id == node_id)
+    ))
+
+
+def subtree_ids_query(root_ids, include_roots=True):
+    query = select(FileClosure.descendant_id).where(FileClosure.ancestor_id.in_(root_ids))
+    if not include_roots:
+        query = query.where(FileClosure.depth > 0)
+    return query
+
+
+def descendant_ids(folder_id):
+    return db.session.scalars(subtree_ids_query([folder_id], include_roots=False)).all()
+
+
+def is_descendant(node_id, ancestor_id):
+    return db.session.query(
+        FileClosure.query.filter_by(ancestor_id=ancestor_id, descendant_id=node_id).exists()
+    ).scalar()
+
+
+def subtree_files(root_id, include_root=True):
+    # 按深度排序，调用方可以保证先处理父节点再处理子节点
+    query = File.query.join(FileClosure, FileClosure.descendant_id == File.id).filter(FileClosure.ancestor_id == root_id)
+    if not include_root:
+        query = query.filter(FileClosure.depth > 0)
+    return query.order_by(FileClosure.depth)
+
+
+def delete_subtrees(root_ids):
+    # 整棵子树用少量集合语句删除，内容文件由后台回收线程在提交后清理
+    subtree = subtree_ids_query(root_ids)
+    released = db.session.execute(
+        select(File.content_hash, func.count())
+        .where(File.id.in_(subtree), File.content_hash != None)
+        .group_by(File.content_hash)
+    ).all()
+    if released:
+        blob_table = Blob.__table__
+        db.session.execute(
+            update(blob_table).where(blob_table.c.hash == bindparam('b_hash'))
+            .values(ref_count=blob_table.c.ref_count - bindparam('b_count')),
+            [{'b_hash': content_hash, 'b_count': count} for content_hash, count in released]
+        )
+        release_blobs(content_hash for content_hash, _ in released)
+
+    usage.remove_subtree(subtree)
+    versioning.remove_subtree(subtree)
+    search_index.remove(db.session, subtree)
+    tagging.remove_subtree(subtree)
+    favorite_table = Favorite.__table__
+    db.session.execute(delete(favorite_table).where(
+        or_(favorite_table.c.file_id.in_(subtree), favorite_table.c.folder_id.in_(subtree))
+    ))
+    deleted = db.session.execute(delete(File.__table__).where(File.__table__.c.id.in_(subtree))).rowcount
+    db.session.execute(delete(closure_table).where(closure_table.c.descendant_id.in_(subtree)))
+    return deleted
+
+
+def copy_subtrees(roots, target_id):
+    # roots: {源根节点 ID: 副本名称}。按层分批插入，每层写入后才能得到下一层的 parent_id；
+    # 副本与源文件共享内容，只增加引用计数，不复制任何数据
+    rows = db.session.execute(
+        select(FileClosure.ancestor_id, FileClosure.depth, File.id, File.parent_id, File.filename, File.content_hash,
+               File.size, File.uploader_id, File.category, File.tags, File.is_folder)
+        .join(File, File.id == FileClosure.descendant_id)
+        .where(FileClosure.ancestor_id.in_(list(roots)))
+        .order_by(FileClosure.depth)
+    ).all()
+
+    copies = {}
+    pairs = []
+    references = {}
+    for depth, level in groupby(rows, key=lambda row: row.depth):
+        for batch in _batches(level):
+            files = [File(
+                filename=roots[row.ancestor_id] if depth == 0 else row.filename,
+                content_hash=row.content_hash,
+                size=row.size,
+                uploader_id=row.uploader_id,
+                category=row.category,
+                tags=row.tags,
+                is_folder=row.is_folder,
+                is_favorite_folder=False,
+                parent_id=target_id if depth == 0 else copies[(row.ancestor_id, row.parent_id)]
+            ) for row in batch]
+            db.session.add_all(files)
+            db.session.flush()
+            for row, file in zip(batch, files):
+                copies[(row.ancestor_id, row.id)] = file.id
+                pairs.append((row.id, file.id))
+                if row.content_hash:
+                    size, count = references.get(row.content_hash, (row.size, 0))
+                    references[row.content_hash] = (size, count + 1)
+                db.session.expunge(file)
+
+    tagging.copy_tags(pairs)
+    if references:
+        add_blob_references(references)
+    return [copies[(root_id, root_id)] for root_id in roots]
+
+
+def rebuild_closure():
+    db.session.execute(delete(closure_table))
+    db.session.execute(insert(closure_table).from_select(
+        ['ancestor_id', 'descendant_id', 'depth'],
+        select(File.id, File.id, literal(0))
+    ))
+    depth = 0
+    while True:
+        result = db.session.execute(insert(closure_table).from_select(
+            ['ancestor_id', 'descendant_id', 'depth'],
+            select(FileClosure.ancestor_id, File.id, literal(depth + 1))
+            .join(FileClosure, FileClosure.descendant_id == File.parent_id)
+            .where(FileClosure.depth == depth)
+        ))
+        if not result.rowcount:
+            break
+        depth += 1
+    db.session.commit()
+
+
+def ensure_closure():
+    if File.query.first() is not None and FileClosure.query.first() is None:
+        rebuild_closure()
@@ -0,0 +1,164 @@
+from collections import defaultdict
+from flask import current_app
+from sqlalchemy import event, inspect, insert, update, delete, select, func, case, bindparam, and_, tuple_
+from sqlalchemy.exc import IntegrityError
+from extensions import db
+from models import File, User, UserUsage, CategoryUsage
+
+BATCH_SIZE = 500
+DEFAULT_CATEGORY = 'other'
+
+usage_table = UserUsage.__table__
+category_table = CategoryUsage.__table__
+
+
+class UsageDelta:
+    # 汇总一次 flush 或一次子树删除带来的变化，最后按用户/分类各执行一条批量更新
+    def __init__(self):
+        self.users = defaultdict(lambda: {'bytes': 0, 'files': 0, 'folders': 0})
+        self.categories = defaultdict(lambda: {'files': 0, 'bytes': 0})
+
+    def add(self, user_id, is_folder, category, size, count=1):
+        if is_folder:
+            self.users[user_id]['folders'] += count
+            return
+        self.users[user_id]['files'] += count
+        self.users[user_id]['bytes'] += size or 0
+        key = (user_id, category or DEFAULT_CATEGORY)
+        self.categories[key]['files'] += count
+        self.categories[key]['bytes'] += size or 0
+
+    def add_file(self, file, sign=1):
+        if not file.is_favorite_folder:
+            self.add(file.uploader_id, file.is_folder, file.category, sign * (file.size or 0), sign)
+
+    def apply(self, session):
+        users = {user_id: delta for user_id, delta in self.users.items() if any(delta.values())}
+        categories = {key: delta for key, delta in self.categories.items() if any(delta.values())}
+        if users:
+            _ensure_rows(session, usage_table, [usage_table.c.user_id], [(user_id,) for user_id in users],
+                         {'bytes': 0, 'files': 0, 'folders': 0, 'quota_bytes': None})
+            session.execute(
+                update(usage_table).where(usage_table.c.user_id == bindparam('u_id')).values(
+                    bytes=usage_table.c.bytes + bindparam('u_bytes'),
+                    files=usage_table.c.files + bindparam('u_files'),
+                    folders=usage_table.c.folders + bindparam('u_folders')),
+                [{'u_id': user_id, 'u_bytes': delta['bytes'], 'u_files': delta['files'], 'u_folders': delta['folders']}
+                 for user_id, delta in users.items()]
+            )
+        if categories:
+            _ensure_rows(session, category_table, [category_table.c.user_id, category_table.c.category],
+                         list(categories), {'files': 0, 'bytes': 0})
+            session.execute(
+                update(category_table).where(and_(category_table.c.user_id == bindparam('c_user'),
+                                                  category_table.c.category == bindparam('c_category'))).values(
+                    files=category_table.c.files + bindparam('c_files'),
+                    bytes=category_table.c.bytes + bindparam('c_bytes')),
+                [{'c_user': user_id, 'c_category': category, 'c_files': delta['files'], 'c_bytes': delta['bytes']}
+                 for (user_id, category), delta in categories.items()]
+            )
+
+
+def _ensure_rows(session, table, key_columns, keys, defaults):
+    existing = set()
+    for start in range(0, len(keys), BATCH_SIZE):
+        existing.update(tuple(row) for row in session.execute(
+            select(*key_columns).where(tuple_(*key_columns).in_(keys[start:start + BATCH_SIZE]))))
+    rows = [dict(zip([column.name for column in key_columns], key), **defaults) for key in keys if key not in existing]
+    if not rows:
+        return
+    connection = session.connection()
+    try:
+        with connection.begin_nested():
+            connection.execute(insert(table), rows)
+    except IntegrityError:
+        # 并发事务已创建部分行，逐行补建
+        for row in rows:
+            try:
+                with connection.begin_nested():
+                    connection.execute(insert(table), [row])
+            except IntegrityError:
+                pass
+
+
+def _previous(file, name):
+    history = inspect(file).attrs[name].history
+    return history.deleted[0] if history.deleted else getattr(file, name)
+
+
+@event.listens_for(db.session, 'after_flush')
+def maintain_usage(session, flush_context):
+    delta = UsageDelta()
+    for obj in session.new:
+        if isinstance(obj, File):
+            delta.add_file(obj)
+    for obj in session.deleted:
+        if isinstance(obj, File):
+            delta.add_file(obj, -1)
+    for obj in session.dirty:
+        if isinstance(obj, File) and not obj.is_folder and not obj.is_favorite_folder and (
+                inspect(obj).attrs.size.history.has_changes() or inspect(obj).attrs.category.history.has_changes()):
+            delta.add(obj.uploader_id, False, _previous(obj, 'category'), -(_previous(obj, 'size') or 0), -1)
+            delta.add(obj.uploader_id, False, obj.category, obj.size or 0)
+    delta.apply(session)
+
+
+def remove_subtree(subtree):
+    # 集合删除绕过 ORM，先按用户/分类聚合被删除的行再扣减
+    delta = UsageDelta()
+    rows = db.session.execute(
+        select(File.uploader_id, File.is_folder, File.category, func.count(), func.coalesce(func.sum(File.size), 0))
+        .where(File.id.in_(subtree), File.is_favorite_folder.isnot(True))
+        .group_by(File.uploader_id, File.is_folder, File.category)
+    )
+    for user_id, is_folder, category, count, size in rows:
+        delta.add(user_id, is_folder, category, -size, -count)
+    delta.apply(db.session)
+
+
+def get_usage(user_id):
+    usage = db.session.get(UserUsage, user_id)
+    categories = CategoryUsage.query.filter(CategoryUsage.user_id == user_id, CategoryUsage.files > 0)
+    quota = usage.quota_bytes if usage and usage.quota_bytes is not None else current_app.config['STORAGE_QUOTA_BYTES']
+    return {
+        'bytes': usage.bytes if usage else 0,
+        'files': usage.files if usage else 0,
+        'folders': usage.folders if usage else 0,
+        'quota_bytes': quota,
+        'categories': {row.category: {'files': row.files, 'bytes': row.bytes} for row in categories},
+    }
+
+
+def check_quota(user_id, incoming_bytes):
+    usage = get_usage(user_id)
+    return usage['quota_bytes'] is None or usage['bytes'] + (incoming_bytes or 0) <= usage['quota_bytes']
+
+
+def rebuild_usage():
+    quotas = dict(db.session.execute(
+        select(usage_table.c.user_id, usage_table.c.quota_bytes).where(usage_table.c.quota_bytes != None)).all())
+    db.session.execute(delete(category_table))
+    db.session.execute(delete(usage_table))
+
+    counted = File.is_favorite_folder.isnot(True)
+    is_file = File.is_folder.isnot(True)
+    category = func.coalesce(File.category, DEFAULT_CATEGORY)
+    db.session.execute(insert(category_table).from_select(
+        ['user_id', 'category', 'files', 'bytes'],
+        select(File.uploader_id, category, func.count(), func.coalesce(func.sum(File.size), 0))
+        .where(counted, is_file).group_by(File.uploader_id, category)
+    ))
+
+    totals = db.session.execute(
+        select(User.id,
+               func.coalesce(func.sum(case((and_(counted, is_file), File.size), else_=0)), 0),
+               func.count(case((and_(counted, is_file), File.id))),
+               func.count(case((and_(counted, File.is_folder == True), File.id))))
+        .outerjoin(File, File.uploader_id == User.id).group_by(User.id)
+    ).all()
+    rows = [{'user_id': user_id, 'bytes': size, 'files': files, 'folders': folders, 'quota_bytes': quotas.get(user_id)}
+            for user_id, size, files, folders in totals]
+    for start in range(0, len(rows), BATCH_SIZE):
+        db.session.execute(insert(usage_table), rows[start:start + BATCH_SIZE])
+    db.session.commit()
+    return len(rows)
@@ -0,0 +1,316 @@
+import os
+import time
+import queue
+import hashlib
+import logging
+import threading
+from datetime import datetime
+from sqlalchemy import insert, update, delete, select, func, bindparam, event, inspect
+from sqlalchemy.orm import aliased
+from extensions import db
+from models import FileVersion, VersionChunk, Blob
+from storage import blob_store, add_blob_references, add_blob_reference, claim_blob, release_blobs, \
+    BATCH_SIZE, CHUNK_SIZE
+
+try:
+    # 只用编译版本；fastcdc 包在缺少扩展时会退回纯 Python 实现，在后台线程中长时间占用 GIL
+    from fastcdc.fastcdc_cy import fastcdc_cy as fastcdc
+except ImportError:
+    fastcdc = None
+
+version_table = FileVersion.__table__
+version_chunk_table = VersionChunk.__table__
+READ_SIZE = 8 * 1024 * 1024
+
+class Chunker:
+    # 版本内容按内容定义分块，每个块作为独立的 Blob 存储并引用计数，相同的块只存一份；
+    # 版本被新版本取代后才由后台线程分块，当前版本与文件共用完整内容，分块前版本持有完整内容的引用
+    def __init__(self, app=None):
+        self.app = None
+        self.min_size = self.avg_size = self.max_size = None
+        self.queue = queue.Queue()
+        self.thread = None
+        self.stats = {'bytes': 0, 'seconds': 0.0, 'chunks': 0, 'new_chunks': 0, 'new_bytes': 0}
+        self.lock = threading.Lock()
+        self.logger = logging.getLogger(__name__)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.avg_size = app.config['VERSION_CHUNK_AVG_SIZE']
+        self.min_size = app.config['VERSION_CHUNK_MIN_SIZE'] or self.avg_size // 4
+        self.max_size = app.config['VERSION_CHUNK_MAX_SIZE'] or self.avg_size * 8
+        app.extensions['chunker'] = self
+        if not app.config['VERSION_CHUNKING_ENABLED'] or self.thread is not None:
+            return
+        if fastcdc is None:
+            # 未分块的版本保留完整内容，安装 fastcdc 后重启时接着分块
+            self.logger.warning('fastcdc extension not available, version chunking disabled')
+            return
+        self.thread = threading.Thread(target=self._run, name='version-chunker', daemon=True)
+        self.thread.start()
+
+    def schedule(self, version_ids):
+        if self.thread is None:
+            return
+        for version_id in version_ids:
+            self.queue.put(version_id)
+
+    def _run(self):
+        # 先接上进程退出前未完成的版本；新数据库此时可能还没有建表
+        with self.app.app_context():
+            try:
+                if inspect(db.engine).has_table(version_table.name):
+                    self.schedule(db.session.scalars(
+                        select(FileVersion.id).where(FileVersion.chunk_count.is_(None), superseded())).all())
+            except Exception as e:
+                self.logger.error(f'Loading pending versions failed: {e}')
+            finally:
+                db.session.remove()
+
+        while True:
+            version_id = self.queue.get()
+            with self.app.app_context():
+                try:
+                    self.chunk_version(version_id)
+                except Exception as e:
+                    self.logger.error(f'Chunking version {version_id} failed: {e}')
+                    db.session.rollback()
+                finally:
+                    db.session.remove()
+
+    def chunk_version(self, version_id):
+        version = db.session.get(FileVersion, version_id)
+        if version is None or version.chunk_count is not None:
+            return False
+        content_hash = version.content_hash
+        # 分块期间不持有数据库事务
+        db.session.rollback()
+        manifest = self.chunk_blob(content_hash)
+
+        # 只有仍未分块的历史版本才写入；版本已被删除或已由其他进程完成时放弃，新写入的块交给回收线程
+        claimed = db.session.execute(
+            update(version_table).where(version_table.c.id == version_id, version_table.c.chunk_count.is_(None),
+                                        superseded())
+            .values(chunk_count=len(manifest))
+        ).rowcount
+        if not claimed:
+            db.session.rollback()
+            return False
+        _store_chunks(version_id, manifest)
+        Blob.query.filter_by(hash=content_hash).update({Blob.ref_count: Blob.ref_count - 1})
+        release_blobs([content_hash])
+        db.session.commit()
+        return True
+
+    def cut_point(self, window):
+        return next(iter(fastcdc(window, self.min_size, self.avg_size, self.max_size))).length
+
+    def split(self, stream):
+        # 缓冲区始终保留至少一个最大块长度的数据，每次只确定下一个切分点；
+        # 窗口和块都是缓冲区上的 memoryview，不复制数据
+        buffer = b''
+        view = memoryview(buffer)
+        position = 0
+        eof = False
+        while True:
+            if not eof and len(buffer) - position < self.max_size:
+                data = stream.read(max(READ_SIZE, self.max_size))
+                eof = not data
+                buffer = buffer[position:] + data
+                view = memoryview(buffer)
+                position = 0
+            if position >= len(buffer):
+                return
+            window = view[position:position + self.max_size]
+            cut = self.cut_point(window)
+            yield window[:cut]
+            position += cut
+
+    def chunk_blob(self, content_hash):
+        # 返回 [(块哈希, 块长度)]；只写入本地尚不存在的块，已有的块刷新修改时间以避开回收
+        started = time.perf_counter()
+        manifest = []
+        total = new_chunks = new_bytes = 0
+        with blob_store.open(content_hash) as f:
+            for piece in self.split(f):
+                chunk_hash = hashlib.sha256(piece).hexdigest()
+                if blob_store.exists(chunk_hash):
+                    os.utime(blob_store.path(chunk_hash))
+                else:
+                    blob_store.write_chunks([piece])
+                    new_chunks += 1
+                    new_bytes += len(piece)
+                manifest.append((chunk_hash, len(piece)))
+                total += len(piece)
+
+        elapsed = time.perf_counter() - started
+        with self.lock:
+            self.stats['bytes'] += total
+            self.stats['seconds'] += elapsed
+            self.stats['chunks'] += len(manifest)
+            self.stats['new_chunks'] += new_chunks
+            self.stats['new_bytes'] += new_bytes
+        self.logger.info(f'Chunked {content_hash[:12]} into {len(manifest)} chunks ({new_chunks} new) '
+                         f'in {elapsed:.3f}s')
+        return manifest
+
+    def snapshot(self):
+        with self.lock:
+            stats = dict(self.stats)
+        stats['throughput_bytes_per_second'] = stats['bytes'] / stats['seconds'] if stats['seconds'] else None
+        stats['running'] = self.thread is not None
+        return stats
+
+
+chunker = Chunker()
+
+
+def _store_chunks(version_id, manifest):
+    for start in range(0, len(manifest), BATCH_SIZE):
+        db.session.execute(insert(version_chunk_table), [
+            {'version_id': version_id, 'seq': seq, 'chunk_hash': chunk_hash, 'size': length}
+            for seq, (chunk_hash, length) in enumerate(manifest[start:start + BATCH_SIZE], start)
+        ])
+    references = {}
+    for chunk_hash, length in manifest:
+        references[chunk_hash] = (length, references.get(chunk_hash, (length, 0))[1] + 1)
+    if references:
+        add_blob_references(references)
+
+
+def superseded():
+    # 同一文件存在更新的版本，即该版本已不是当前版本
+    later = aliased(FileVersion)
+    return select(later.id).where(later.file_id == FileVersion.file_id, later.version > FileVersion.version).exists()
+
+
+def _store_version(file, number, content_hash, size, referenced=False):
+    # 新版本引用完整内容，被取代后才分块；referenced 表示调用方已转交一个引用
+    version = FileVersion(file_id=file.id, version=number, content_hash=content_hash, size=size,
+                          created_at=datetime.utcnow())
+    db.session.add(version)
+    db.session.flush()
+    if not referenced:
+        add_blob_reference(content_hash, size)
+    return version
+
+
+def version_manifest(version):
+    return db.session.execute(
+        select(VersionChunk.chunk_hash, VersionChunk.size)
+        .where(VersionChunk.version_id == version.id).order_by(VersionChunk.seq)
+    ).all()
+
+
+def add_version(file, content_hash, size):
+    # 调用方已为 content_hash 持有一个 Blob 引用，该引用转给文件的当前内容，旧的当前内容引用释放；
+    # 被取代的版本提交后由后台线程分块
+    previous_hash = file.content_hash
+    current = db.session.scalars(select(FileVersion).where(FileVersion.file_id == file.id)
+                                 .order_by(FileVersion.version.desc()).limit(1)).first()
+    if current is None and file.content_hash:
+        # 启用版本前上传的文件，先把现有内容记为第 1 版，文件原有的引用直接转给该版本
+        current = _store_version(file, 1, file.content_hash, file.size, referenced=True)
+        previous_hash = None
+
+    version = _store_version(file, current.version + 1 if current else 1, content_hash, size)
+    if current is not None and current.chunk_count is None:
+        db.session.info.setdefault('pending_versions', set()).add(current.id)
+
+    if previous_hash:
+        Blob.query.filter_by(hash=previous_hash).update({Blob.ref_count: Blob.ref_count - 1})
+        release_blobs([previous_hash])
+    file.content_hash = content_hash
+    file.size = size
+    file.updated_at = datetime.utcnow()
+    return version
+
+
+def version_chunks(version):
+    # 按块顺序读出整个版本的内容；尚未分块的版本仍持有完整内容，直接读取
+    if version.chunk_count is None:
+        with blob_store.open(version.content_hash) as f:
+            yield from iter(lambda: f.read(CHUNK_SIZE), b'')
+        return
+    for chunk_hash, _ in version_manifest(version):
+        with blob_store.open(chunk_hash) as f:
+            yield f.read()
+
+
+def restore_version(file, version):
+    # 当前内容若仍在则直接复用，否则由各块重新拼出完整内容；恢复出的版本同样等被取代后再分块，
+    # 相同的块届时直接复用
+    if not claim_blob(version.content_hash, version.size):
+        content_hash, size = blob_store.write_chunks(version_chunks(version))
+        add_blob_references({content_hash: (size, 1)})
+    return add_version(file, version.content_hash, version.size)
+
+
+def dedup_report(file_ids_query):
+    # logical_bytes：已分块版本的完整大小之和；stored_bytes：这些版本引用的不同块的大小之和
+    logical_bytes, versions = db.session.execute(
+        select(func.coalesce(func.sum(FileVersion.size), 0), func.count())
+        .where(FileVersion.file_id.in_(file_ids_query), FileVersion.chunk_count.isnot(None))
+    ).one()
+    distinct_chunks = (
+        select(VersionChunk.chunk_hash, func.max(VersionChunk.size).label('size'))
+        .join(FileVersion, FileVersion.id == VersionChunk.version_id)
+        .where(FileVersion.file_id.in_(file_ids_query))
+        .group_by(VersionChunk.chunk_hash)
+        .subquery()
+    )
+    stored_bytes, chunks = db.session.execute(
+        select(func.coalesce(func.sum(distinct_chunks.c.size), 0), func.count()).select_from(distinct_chunks)
+    ).one()
+    return {
+        'versions': versions,
+        'logical_bytes': logical_bytes,
+        'stored_bytes': stored_bytes,
+        'unique_chunks': chunks,
+        'dedup_ratio': round(logical_bytes / stored_bytes, 3) if stored_bytes else None,
+    }
+
+
+def remove_subtree(subtree):
+    # 删除子树时释放所有历史版本对块的引用，尚未分块的版本释放对完整内容的引用；
+    # 先锁住这些版本行，与后台分块互斥
+    version_ids = select(FileVersion.id).where(FileVersion.file_id.in_(subtree))
+    db.session.execute(version_ids.with_for_update()).all()
+    counts = {}
+    for content_hash, count in db.session.execute(
+        select(VersionChunk.chunk_hash, func.count())
+        .where(VersionChunk.version_id.in_(version_ids))
+        .group_by(VersionChunk.chunk_hash)
+    ):
+        counts[content_hash] = counts.get(content_hash, 0) + count
+    for content_hash, count in db.session.execute(
+        select(FileVersion.content_hash, func.count())
+        .where(FileVersion.file_id.in_(subtree), FileVersion.chunk_count.is_(None))
+        .group_by(FileVersion.content_hash)
+    ):
+        counts[content_hash] = counts.get(content_hash, 0) + count
+    released = list(counts.items())
+    if released:
+        blob_table = Blob.__table__
+        db.session.execute(
+            update(blob_table).where(blob_table.c.hash == bindparam('b_hash'))
+            .values(ref_count=blob_table.c.ref_count - bindparam('b_count')),
+            [{'b_hash': chunk_hash, 'b_count': count} for chunk_hash, count in released]
+        )
+        release_blobs(chunk_hash for chunk_hash, _ in released)
+    db.session.execute(delete(version_chunk_table).where(version_chunk_table.c.version_id.in_(version_ids)))
+    db.session.execute(delete(version_table).where(version_table.c.file_id.in_(subtree)))
+
+
+@event.listens_for(db.session, 'after_commit')
+def schedule_chunking(session):
+    version_ids = session.info.pop('pending_versions', None)
+    if version_ids:
+        chunker.schedule(version_ids)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def discard_chunking(session):
+    session.info.pop('pending_versions', None)
@@ -0,0 +1,83 @@
+import zipfile
+import unicodedata
+from collections import namedtuple
+from urllib.parse import quote
+from flask import Response
+
+READ_SIZE = 1024 * 1024
+
+# 已压缩的格式再次 deflate 只会浪费 CPU
+STORED_CATEGORIES = {'images', 'videos', 'audio'}
+STORED_EXTENSIONS = {'zip', 'rar', 'docx', 'xlsx', 'pptx'}
+
+ZipEntry = namedtuple('ZipEntry', ['arcname', 'path', 'size', 'modified_at', 'compress_type'])
+
+
+def compress_type_for(file):
+    ext = file.filename.rsplit('.', 1)[-1].lower() if '.' in file.filename else ''
+    if file.category in STORED_CATEGORIES or ext in STORED_EXTENSIONS:
+        return zipfile.ZIP_STORED
+    return zipfile.ZIP_DEFLATED
+
+
+class _StreamBuffer:
+    # 只能追加、不可 seek，zipfile 会改用数据描述符并在末尾写中央目录
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def stream_zip(entries):
+    buffer = _StreamBuffer()
+    with zipfile.ZipFile(buffer, 'w', allowZip64=True) as zipf:
+        for entry in entries:
+            date_time = max(entry.modified_at.timetuple()[:6], (1980, 1, 1, 0, 0, 0))
+            if entry.path is None:
+                zipf.writestr(zipfile.ZipInfo(entry.arcname.rstrip('/') + '/', date_time=date_time), b'')
+            else:
+                info = zipfile.ZipInfo(entry.arcname, date_time=date_time)
+                info.compress_type = entry.compress_type
+                # 预先给出大小，zipfile 据此决定是否写 ZIP64 本地头
+                info.file_size = entry.size or 0
+                with open(entry.path, 'rb') as source, zipf.open(info, 'w') as dest:
+                    for chunk in iter(lambda: source.read(READ_SIZE), b''):
+                        dest.write(chunk)
+                        data = buffer.drain()
+                        if data:
+                            yield data
+            data = buffer.drain()
+            if data:
+                yield data
+    yield buffer.drain()
+
+
+def zip_response(entries, download_name):
+    response = Response(stream_zip(entries), mimetype='application/zip')
+    set_attachment(response, download_name)
+    return response
+
+
+def set_attachment(response, download_name):
+    try:
+        download_name.encode('ascii')
+        names = {'filename': download_name}
+    except UnicodeEncodeError:
+        simple = unicodedata.normalize('NFKD', download_name).encode('ascii', 'ignore').decode('ascii')
+        names = {'filename': simple, 'filename*': "UTF-8''" + quote(download_name, safe="!#$&+-.^_`|~")}
+    response.headers.set('Content-Disposition', 'attachment', **names)